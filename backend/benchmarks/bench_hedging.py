@@ -0,0 +1,111 @@
+"""
+Tail latency with and without hedged requests, and fail-fast behaviour of the circuit breaker,
+against fake providers (no network calls).
+
+The primary and its equivalent hedge model answer in --latency-ms, except a --tail-rate share
+of calls that take --tail-latency-ms. Each scenario warms the latency tracker up, then sends
+--requests calls --concurrency at a time and reports latency percentiles.
+
+Run from backend/:
+    python -m benchmarks.bench_hedging [--requests 300] [--concurrency 16] [--tail-rate 0.02]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.fake_llm import FakeChatModel
+from src.resilience import CircuitOpen, LatencyTracker, ResilientChatModel, get_resilience_stats
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return round(values[min(int(len(values) * q), len(values) - 1)], 1)
+
+
+def make_model(name, args, hedges=None, tracker=None, failure_rate=0):
+    llm = FakeChatModel(
+        latency_ms=args.latency_ms,
+        tail_latency_ms=args.tail_latency_ms,
+        tail_rate=args.tail_rate,
+        failure_rate=failure_rate,
+    )
+    return ResilientChatModel(name, f"fake-{name}", llm, get_hedges=lambda: hedges or [], tracker=tracker)
+
+
+def timed_call(model):
+    start = time.perf_counter()
+    model.invoke("benchmark")
+    return (time.perf_counter() - start) * 1000
+
+
+def run_scenario(name, hedging, args):
+    os.environ["ENABLE_HEDGING"] = "true" if hedging else "false"
+    tracker = LatencyTracker()
+    hedge = make_model(f"{name}-hedge", args, tracker=tracker)
+    primary = make_model(f"{name}-primary", args, hedges=[hedge], tracker=tracker)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(lambda _: timed_call(primary), range(args.warmup)))
+        latencies = list(executor.map(lambda _: timed_call(primary), range(args.requests)))
+
+    return {
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": round(max(latencies), 1),
+    }
+
+
+def run_circuit_breaker(args):
+    os.environ["ENABLE_HEDGING"] = "false"
+    model = make_model("down", args, failure_rate=1)
+    calls = []
+    for _ in range(args.circuit_calls):
+        start = time.perf_counter()
+        try:
+            model.invoke("benchmark")
+            outcome = "ok"
+        except CircuitOpen:
+            outcome = "circuit_open"
+        except Exception:
+            outcome = "error"
+        calls.append((outcome, (time.perf_counter() - start) * 1000))
+
+    failed = [ms for outcome, ms in calls if outcome == "error"]
+    rejected = [ms for outcome, ms in calls if outcome == "circuit_open"]
+    return {
+        "calls": len(calls),
+        "provider_errors": len(failed),
+        "rejected_by_open_circuit": len(rejected),
+        "mean_error_ms": round(sum(failed) / len(failed), 2) if failed else None,
+        "mean_rejected_ms": round(sum(rejected) / len(rejected), 3) if rejected else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--tail-latency-ms", type=float, default=2000)
+    parser.add_argument("--tail-rate", type=float, default=0.02)
+    parser.add_argument("--circuit-calls", type=int, default=20)
+    args = parser.parse_args()
+
+    baseline = run_scenario("baseline", hedging=False, args=args)
+    hedged = run_scenario("hedged", hedging=True, args=args)
+    print(json.dumps({
+        "benchmark": "hedging",
+        "latency_ms": args.latency_ms,
+        "tail_latency_ms": args.tail_latency_ms,
+        "tail_rate": args.tail_rate,
+        "requests": args.requests,
+        "without_hedging": baseline,
+        "with_hedging": hedged,
+        "p99_improvement": round(baseline["p99_ms"] / hedged["p99_ms"], 2),
+        "hedges": get_resilience_stats()["hedges"],
+        "circuit_breaker": run_circuit_breaker(args),
+    }, indent=2))
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark of request body validation against canvas size.
+Compares the compiled validator used by validate_json with the interpreted _validate_schema.
+
+Run from backend/:
+    python -m benchmarks.bench_validation [--nodes 100,500,2000,5000] [--repeat 20]
+"""
+import argparse
+import json
+import time
+
+from src.routes.datastore import NODE_SCHEMA
+from src.routes.validation.validate import OptionalField, _compile_schema, _validate_schema
+
+
+CANVAS_SCHEMA = {
+    'title': OptionalField(str),
+    'description': OptionalField(str),
+    'nodes': OptionalField([NODE_SCHEMA]),
+}
+
+
+def make_canvas(node_count):
+    return {
+        "title": "Benchmark canvas",
+        "nodes": [
+            {
+                "id": f"node-{i}",
+                "type": "llmText",
+                "position": {"x": i * 10.5, "y": i * 3},
+                "data": {
+                    "model": "llama-3.3-70b",
+                    "prompt": f"Prompt {i}",
+                    "prompt_response": "Response " * 20,
+                    "parent_ids": [f"node-{i - 1}"] if i else [],
+                    "canvasId": "benchmark",
+                },
+                "selected": False,
+                "measured": {"width": 650, "height": 700},
+                "origin": [0, 0],
+            }
+            for i in range(node_count)
+        ],
+    }
+
+
+def time_per_call_ms(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(node_counts, repeat):
+    is_valid = _compile_schema(CANVAS_SCHEMA)
+    results = []
+    for node_count in node_counts:
+        canvas = make_canvas(node_count)
+        interpreted_ms = time_per_call_ms(lambda: _validate_schema(canvas, CANVAS_SCHEMA), repeat)
+        compiled_ms = time_per_call_ms(lambda: is_valid(canvas), repeat)
+        results.append({
+            "nodes": node_count,
+            "interpreted_ms": round(interpreted_ms, 4),
+            "compiled_ms": round(compiled_ms, 4),
+            "speedup": round(interpreted_ms / compiled_ms, 2),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", default="100,500,2000,5000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    node_counts = [int(count) for count in args.nodes.split(",")]
+    print(json.dumps({"benchmark": "validation", "results": run(node_counts, args.repeat)}, indent=2))
@@ -0,0 +1,59 @@
+"""
+Micro-benchmark of canvas payload encodings against canvas size.
+Compares Flask's default JSON encoder with orjson and MessagePack, each uncompressed,
+gzip and brotli compressed as src/wire_format.py does: bytes on the wire,
+and CPU time to encode (serialize and compress) and decode (decompress and parse).
+
+Run from backend/:
+    python -m benchmarks.bench_wire_format [--nodes 100,500,2000,5000] [--repeat 20]
+"""
+import argparse
+import json
+
+import msgpack
+import orjson
+
+from benchmarks.bench_validation import make_canvas, time_per_call_ms
+from src.wire_format import compress, decompress
+
+
+FORMATS = {
+    # Flask's DefaultJSONProvider settings
+    "json": (lambda obj: json.dumps(obj, ensure_ascii=True, sort_keys=True).encode(), json.loads),
+    "orjson": (orjson.dumps, orjson.loads),
+    "msgpack": (msgpack.packb, msgpack.unpackb),
+}
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+def run(node_counts, repeat):
+    results = []
+    for node_count in node_counts:
+        body = {"document": {**make_canvas(node_count), "canvas_id": "benchmark"}}
+        result = {"nodes": node_count}
+        for format_name, (dumps, loads) in FORMATS.items():
+            for encoding in ENCODINGS:
+                def encode():
+                    data = dumps(body)
+                    return data if encoding == "identity" else compress(data, encoding)
+
+                def decode():
+                    return loads(data if encoding == "identity" else decompress(data, encoding))
+
+                data = encode()
+                name = format_name if encoding == "identity" else f"{format_name}_{encoding}"
+                result[f"{name}_bytes"] = len(data)
+                result[f"{name}_encode_ms"] = round(time_per_call_ms(encode, repeat), 4)
+                result[f"{name}_decode_ms"] = round(time_per_call_ms(decode, repeat), 4)
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", default="100,500,2000,5000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    node_counts = [int(count) for count in args.nodes.split(",")]
+    print(json.dumps({"benchmark": "wire_format", "results": run(node_counts, args.repeat)}, indent=2))
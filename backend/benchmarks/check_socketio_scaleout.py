@@ -0,0 +1,119 @@
+"""
+Multi-process check that node updates reach every subscribed client exactly once
+when Socket.IO runs across several workers sharing the Redis message queue.
+
+Starts --workers instances of the app (`gunicorn -c gunicorn.conf.py src.app:app`, one eventlet
+worker each) with the Redis message queue and leader election, connects --clients clients
+spread across them, publishes --events node updates and counts what every client received.
+
+Requires a Redis server at REDIS_HOST/REDIS_PORT. Run from backend/:
+    python -m benchmarks.check_socketio_scaleout [--workers 3] [--clients 9] [--events 20]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import redis
+import requests
+import socketio as socketio_client
+
+from src.redis_listener import get_redis_url, publish_node_update, node_update_channel
+
+
+NODE_ID = "scaleout-check"
+
+
+def start_worker(port):
+    env = {
+        **os.environ,
+        "GUNICORN_WORKER_CLASS": "eventlet",
+        "GUNICORN_WORKERS": "1",
+        "ENABLE_REDIS": "true",
+        "ENABLE_REDIS_PUBSUB": "true",
+        "ENABLE_SOCKETIO_MESSAGE_QUEUE": "true",
+        "ENABLE_FAKE_LLM": "true",
+        "ENABLE_LAZY_INIT": "true",
+        "FLASK_ENV": "scaleout-check",
+        "CORS_ORIGIN": "*",
+        "GCP_PROJECT": os.getenv("GCP_PROJECT", "scaleout-check"),
+        # each instance clears its metrics directory on start, so they cannot share one
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(tempfile.gettempdir(), f"polylogue-scaleout-{port}"),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{port}", "src.app:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_for_worker(port):
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/api/v1/cache/stats", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Worker on port {port} did not start")
+
+
+def check(workers, clients, events, base_port):
+    processes = [start_worker(base_port + i) for i in range(workers)]
+    connected_clients = []
+    try:
+        for i in range(workers):
+            wait_for_worker(base_port + i)
+        received = [0] * clients
+        channel = node_update_channel(NODE_ID)
+        for i in range(clients):
+            client = socketio_client.Client()
+
+            def on_update(payload, index=i):
+                received[index] += 1
+
+            client.on(channel, on_update)
+            # the app only serves the websocket transport
+            client.connect(f"http://127.0.0.1:{base_port + i % workers}", transports=["websocket"], wait_timeout=10)
+            client.emit("subscribe", channel)
+            connected_clients.append(client)
+
+        # let subscriptions and leader election settle
+        time.sleep(2)
+        r_client = redis.Redis.from_url(get_redis_url())
+        for i in range(events):
+            publish_node_update(r_client, NODE_ID, {"prompt_response": f"update {i}"})
+        time.sleep(3)
+
+        return {
+            "check": "socketio_scaleout",
+            "workers": workers,
+            "clients": clients,
+            "events": events,
+            "received_per_client": received,
+            "exactly_once": all(count == events for count in received),
+        }
+    finally:
+        for client in connected_clients:
+            client.disconnect()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=9)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--base-port", type=int, default=5100)
+    args = parser.parse_args()
+
+    result = check(args.workers, args.clients, args.events, args.base_port)
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["exactly_once"] else 1)
@@ -0,0 +1,63 @@
+"""
+Compare two benchmark suite reports, flagging metrics that got worse by more than --threshold.
+Times (*_ms) and sizes (*_bytes) regress when they grow, throughputs (*_rps) and speedups when they drop.
+
+Run from backend/:
+    python -m benchmarks.compare base.json new.json [--threshold 0.1]
+"""
+import argparse
+import json
+import sys
+
+
+def flatten(results, prefix=""):
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            metrics.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def is_lower_better(name):
+    return name.endswith("_ms") or name.endswith("_bytes")
+
+
+def is_higher_better(name):
+    return name.endswith("_rps") or name.endswith("speedup")
+
+
+def compare(base, new, threshold):
+    base_metrics = flatten(base["results"])
+    new_metrics = flatten(new["results"])
+    changes = {}
+    regressions = []
+    for name in sorted(base_metrics.keys() & new_metrics.keys()):
+        if not (is_lower_better(name) or is_higher_better(name)) or not base_metrics[name]:
+            continue
+        change = (new_metrics[name] - base_metrics[name]) / base_metrics[name]
+        changes[name] = {"base": base_metrics[name], "new": new_metrics[name], "change": round(change, 3)}
+        if (is_lower_better(name) and change > threshold) or (is_higher_better(name) and change < -threshold):
+            regressions.append(name)
+    return {
+        "base_commit": base.get("commit"),
+        "new_commit": new.get("commit"),
+        "threshold": threshold,
+        "regressions": regressions,
+        "changes": changes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.base) as base_file, open(args.new) as new_file:
+        report = compare(json.load(base_file), json.load(new_file), args.threshold)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["regressions"] else 0)
@@ -0,0 +1,279 @@
+"""
+In-process stand-ins for the datastores, so benchmarks run without Firestore or Redis.
+
+InMemoryFirestore implements the part of the Firestore client API the app uses.
+Documents are copied in and out, as serialization would, and every call
+(a get, a write, a batch commit) waits latency_ms to stand in for a network round trip.
+Redis is replaced by fakeredis, see make_fake_redis.
+"""
+import copy
+import threading
+import time
+import uuid
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+
+def make_fake_redis():
+    """fakeredis client with Lua scripting (needs the lupa package)"""
+    import fakeredis
+    return fakeredis.FakeRedis()
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class DocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._db, self._path[:-1])
+
+    def collection(self, name):
+        return CollectionReference(self._db, self._path + (name,))
+
+    def get(self):
+        self._db.round_trip()
+        return self._db.snapshot(self)
+
+    def set(self, document, merge=False):
+        self._db.round_trip()
+        self._db.write(self, document, merge=merge)
+
+    def update(self, field_updates, option=None):
+        self._db.round_trip()
+        self._db.update(self, field_updates, option=option)
+
+    def delete(self):
+        self._db.round_trip()
+        self._db.delete(self)
+
+
+class CollectionReference:
+    def __init__(self, db, path):
+        self._db = db
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return DocumentReference(self._db, self._path[:-1]) if len(self._path) > 1 else None
+
+    def document(self, doc_id=None):
+        return DocumentReference(self._db, self._path + (doc_id or uuid.uuid4().hex,))
+
+    def add(self, document):
+        doc_ref = self.document()
+        doc_ref.set(document)
+        return time.time(), doc_ref
+
+    def stream(self):
+        self._db.round_trip()
+        return iter(self._db.list_documents(self._path))
+
+    def get(self):
+        return list(self.stream())
+
+    def list_documents(self):
+        self._db.round_trip()
+        return [snapshot.reference for snapshot in self._db.list_documents(self._path)]
+
+    def select(self, field_paths):
+        return Query(self, field_paths)
+
+
+class Query:
+    def __init__(self, collection, field_paths):
+        self._collection = collection
+        self._field_paths = field_paths
+
+    def stream(self):
+        for snapshot in self._collection.stream():
+            data = snapshot.to_dict()
+            projected = {field: data[field] for field in self._field_paths if field in data}
+            yield DocumentSnapshot(snapshot.reference, projected, snapshot.update_time)
+
+
+class WriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, doc_ref, document, merge=False):
+        self._writes.append((doc_ref, lambda: self._db.write(doc_ref, document, merge=merge)))
+
+    def update(self, doc_ref, field_updates, option=None):
+        self._writes.append((doc_ref, lambda: self._db.update(doc_ref, field_updates, option=option)))
+
+    def delete(self, doc_ref):
+        self._writes.append((doc_ref, lambda: self._db.delete(doc_ref)))
+
+    def commit(self):
+        """Apply every write or none: a failed write restores the documents it touched"""
+        self._db.round_trip()
+        with self._db.lock:
+            paths = {doc_ref._path for doc_ref, _ in self._writes}
+            previous = {path: (self._db.documents.get(path), self._db.update_times.get(path)) for path in paths}
+            try:
+                for _, write in self._writes:
+                    write()
+            except Exception:
+                for path, (document, update_time) in previous.items():
+                    self._db.documents.pop(path, None)
+                    self._db.update_times.pop(path, None)
+                    if document is not None:
+                        self._db.documents[path] = document
+                        self._db.update_times[path] = update_time
+                raise
+        self._writes = []
+
+
+class LastUpdateOption:
+    def __init__(self, last_update_time):
+        self.last_update_time = last_update_time
+
+
+class InMemoryFirestore:
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.documents = {}
+        self.update_times = {}
+        self.clock = 0
+        self.round_trips = 0
+        self.lock = threading.RLock()
+
+    def round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def collection(self, name):
+        return CollectionReference(self, (name,))
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def write_option(self, last_update_time):
+        return LastUpdateOption(last_update_time)
+
+    def get_all(self, references, field_paths=None):
+        """Snapshots of references, with only field_paths (dotted, e.g. "data.model") if given"""
+        self.round_trip()
+        snapshots = [self.snapshot(reference) for reference in references]
+        if field_paths is None:
+            return snapshots
+        return [
+            DocumentSnapshot(snapshot.reference, project(snapshot._data, field_paths), snapshot.update_time)
+            if snapshot.exists else snapshot
+            for snapshot in snapshots
+        ]
+
+    def snapshot(self, reference):
+        with self.lock:
+            return DocumentSnapshot(
+                reference,
+                copy.deepcopy(self.documents.get(reference._path)),
+                self.update_times.get(reference._path),
+            )
+
+    def touch(self, reference):
+        self.clock += 1
+        self.update_times[reference._path] = self.clock
+
+    def list_documents(self, collection_path):
+        with self.lock:
+            paths = [path for path in self.documents if path[:-1] == collection_path]
+        return [self.snapshot(DocumentReference(self, path)) for path in paths]
+
+    def write(self, reference, document, merge=False):
+        """set(); merge=True merges every field of document, a list of field paths only those fields"""
+        with self.lock:
+            if not merge:
+                self.documents[reference._path] = copy.deepcopy(document)
+            else:
+                field_paths = merge if isinstance(merge, list) else [
+                    FieldPath(*path).to_api_repr() for path in leaf_paths(document)
+                ]
+                self.documents.setdefault(reference._path, {})
+                self.apply(reference, {
+                    field_path: get_nested(document, FieldPath.from_api_repr(field_path).parts)
+                    for field_path in field_paths
+                })
+            self.touch(reference)
+
+    def update(self, reference, field_updates, option=None):
+        with self.lock:
+            if reference._path not in self.documents:
+                raise google_exceptions.NotFound(f"No document to update: {'/'.join(reference._path)}")
+            if option and self.update_times.get(reference._path) != option.last_update_time:
+                raise google_exceptions.FailedPrecondition(f"Document changed: {'/'.join(reference._path)}")
+            self.apply(reference, field_updates)
+            self.touch(reference)
+
+    def apply(self, reference, field_updates):
+        # copy on write, so a failed batch can restore the previous document
+        document = copy.deepcopy(self.documents[reference._path])
+        self.documents[reference._path] = document
+        for field_path, value in field_updates.items():
+            *parents, field = FieldPath.from_api_repr(field_path).parts
+            target = document
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            if value is firestore.DELETE_FIELD:
+                target.pop(field, None)
+            else:
+                target[field] = copy.deepcopy(value)
+
+    def delete(self, reference):
+        with self.lock:
+            self.documents.pop(reference._path, None)
+            self.update_times.pop(reference._path, None)
+
+
+def leaf_paths(document, prefix=()):
+    for field, value in document.items():
+        if isinstance(value, dict) and value:
+            yield from leaf_paths(value, prefix + (field,))
+        else:
+            yield prefix + (field,)
+
+
+def project(document, field_paths):
+    projected = {}
+    for field_path in field_paths:
+        *parents, field = FieldPath.from_api_repr(field_path).parts
+        source, target = document, projected
+        for parent in parents:
+            source = source.get(parent)
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(parent, {})
+        else:
+            if field in source:
+                target[field] = source[field]
+    return projected
+
+
+def get_nested(document, path):
+    for field in path:
+        document = document[field]
+    return document
@@ -0,0 +1,160 @@
+"""
+Concurrent load test of the completion endpoint with sync versus eventlet gunicorn workers.
+
+For each worker class, starts `gunicorn -c gunicorn.conf.py` with the fake LLM
+(ENABLE_FAKE_LLM, fixed FAKE_LLM_LATENCY_MS), the LLM cache off and provider limits
+raised to --concurrency. It sends --requests completions --concurrency at a time, and
+meanwhile probes a cheap endpoint to measure how long other requests wait behind the generations.
+No provider keys, Firestore or Redis are needed.
+
+Run from backend/:
+    python -m benchmarks.load_test [--requests 40] [--concurrency 20] [--latency-ms 1000] [--workers 1]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * q), len(values) - 1)], 1)
+
+
+def start_server(worker_class, workers, port, latency_ms, concurrency):
+    env = {
+        **os.environ,
+        "GUNICORN_WORKER_CLASS": worker_class,
+        "GUNICORN_WORKERS": str(workers),
+        "ENABLE_FAKE_LLM": "true",
+        "FAKE_LLM_LATENCY_MS": str(latency_ms),
+        # measure the serving model, not the provider limits
+        "MODEL_MAX_CONCURRENCY": str(concurrency),
+        "PROVIDER_MAX_CONCURRENCY": str(concurrency),
+        "ENABLE_LLM_CACHE": "false",
+        "ENABLE_REDIS": "false",
+        "ENABLE_REDIS_PUBSUB": "false",
+        "ENABLE_LAZY_INIT": "true",
+        "FLASK_ENV": "load-test",
+        "CORS_ORIGIN": "*",
+        "GCP_PROJECT": os.getenv("GCP_PROJECT", "load-test"),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{port}", "src.app:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f"{base_url}/api/v1/cache/stats", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn with {worker_class} workers did not start")
+
+
+def run_load(base_url, total_requests, concurrency):
+    completion_ms = []
+    probe_ms = []
+    errors = 0
+    done = threading.Event()
+
+    def complete(_):
+        start = time.perf_counter()
+        response = requests.post(f"{base_url}/api/v1/completion", json={
+            "model": "qwen-2.5-7b",
+            "prompt": f"load test {uuid.uuid4()}",
+            "nodeId": "load-test",
+        }, timeout=300)
+        return response.status_code, (time.perf_counter() - start) * 1000
+
+    def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            try:
+                requests.get(f"{base_url}/api/v1/cache/stats", timeout=300)
+                probe_ms.append((time.perf_counter() - start) * 1000)
+            except requests.RequestException:
+                pass
+            time.sleep(0.1)
+
+    prober = threading.Thread(target=probe, daemon=True)
+    start = time.perf_counter()
+    prober.start()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for status, elapsed_ms in executor.map(complete, range(total_requests)):
+            if status == 200:
+                completion_ms.append(elapsed_ms)
+            else:
+                errors += 1
+    wall_s = time.perf_counter() - start
+    done.set()
+    prober.join()
+
+    return {
+        "requests": total_requests,
+        "errors": errors,
+        "wall_s": round(wall_s, 2),
+        "throughput_rps": round(len(completion_ms) / wall_s, 2),
+        "completion_p50_ms": percentile(completion_ms, 0.5),
+        "completion_p95_ms": percentile(completion_ms, 0.95),
+        "probe_p50_ms": percentile(probe_ms, 0.5),
+        "probe_p95_ms": percentile(probe_ms, 0.95),
+        "probe_mean_ms": round(statistics.mean(probe_ms), 1) if probe_ms else None,
+    }
+
+
+def benchmark(worker_classes, total_requests, concurrency, latency_ms, workers, base_port):
+    results = {}
+    for index, worker_class in enumerate(worker_classes):
+        process, base_url = start_server(worker_class, workers, base_port + index, latency_ms, concurrency)
+        try:
+            results[worker_class] = run_load(base_url, total_requests, concurrency)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = {
+        "benchmark": "load_test",
+        "fake_latency_ms": latency_ms,
+        "concurrency": concurrency,
+        "workers": workers,
+        "results": results,
+    }
+    if "sync" in results and "eventlet" in results and results["sync"]["throughput_rps"]:
+        report["eventlet_speedup"] = round(results["eventlet"]["throughput_rps"] / results["sync"]["throughput_rps"], 2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--worker-classes", default="sync,eventlet")
+    parser.add_argument("--base-port", type=int, default=5200)
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(
+        args.worker_classes.split(","),
+        args.requests,
+        args.concurrency,
+        args.latency_ms,
+        args.workers,
+        args.base_port,
+    ), indent=2))
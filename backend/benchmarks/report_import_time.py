@@ -0,0 +1,92 @@
+"""
+Import-time breakdown of the app, to track cold start regressions.
+
+Imports --module in a fresh interpreter with `python -X importtime` and reports
+the total import time, the slowest top-level packages (by self time summed over
+their modules) and the slowest imports made directly by the module (by cumulative time).
+Datastore clients are lazily initialized, so no Firestore or Redis server is needed.
+
+Run from backend/:
+    python -m benchmarks.report_import_time [--module src.app] [--top 15] [--max-ms 3000]
+Exits with 1 when the total exceeds --max-ms.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+
+def run_import(module):
+    env = {
+        "CORS_ORIGIN": "*",
+        "GCP_PROJECT": "import-time-report",
+        **os.environ,
+        "ENABLE_LAZY_INIT": "true",
+    }
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        errors = "\n".join(line for line in result.stderr.splitlines() if not line.startswith("import time:"))
+        raise RuntimeError(f"Importing {module} failed:\n{errors}")
+    return result.stderr, wall_ms
+
+
+def parse_import_times(output):
+    """Parse `-X importtime` lines into (module, self_us, cumulative_us, depth)"""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def report(module, top):
+    output, wall_ms = run_import(module)
+    entries = parse_import_times(output)
+
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        by_package[name.split(".")[0]] += self_us
+
+    # depth 1 entries are the modules imported directly by the module being measured
+    direct_imports = [(name, cumulative_us) for name, _, cumulative_us, depth in entries if depth == 1]
+    return {
+        "benchmark": "import_time",
+        "module": module,
+        "wall_ms": round(wall_ms, 1),
+        "import_ms": round(sum(self_us for _, self_us, _, _ in entries) / 1000, 1),
+        "modules_imported": len(entries),
+        "top_packages_ms": {
+            package: round(self_us / 1000, 1)
+            for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]
+        },
+        "top_direct_imports_ms": {
+            name: round(cumulative_us / 1000, 1)
+            for name, cumulative_us in sorted(direct_imports, key=lambda item: -item[1])[:top]
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="src.app")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, help="fail when the total import time exceeds this")
+    args = parser.parse_args()
+
+    result = report(args.module, args.top)
+    print(json.dumps(result, indent=2))
+    if args.max_ms is not None and result["import_ms"] > args.max_ms:
+        sys.exit(1)
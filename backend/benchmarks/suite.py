@@ -0,0 +1,434 @@
+"""
+Offline benchmark suite: runs the app in process against the fake LLM, fakeredis
+and an in-memory Firestore (see benchmarks/fakes.py), so no provider keys or datastores are needed.
+
+Covers:
+- completion: /api/v1/completion throughput and latency against client concurrency
+- chain: /api/v1/chain-completion latency against DAG width and depth, cold and with memoized ancestors
+- prompt: /api/v1/prompt latency for a node without context, generated per request against popped from the suggestion pool
+- stale: marking the descendants of a DAG's first layer stale, and refreshing them, against DAG width and depth
+- canvas: canvas save, load and single-node patch latency, and Firestore round trips, against node count
+- viewport: loading a screen-sized viewport of a large canvas, zoomed in and out, against loading all of it
+- validation: request body validation cost against node count
+- wire_format: canvas payload size and encode/decode time per format and compression, against node count
+- socketio: time to fan node updates out to Socket.IO clients against client count
+
+Results are keyed by benchmark and parameters, so two runs can be compared with
+    python -m benchmarks.compare base.json new.json
+
+Run from backend/ (needs `pip install -r benchmarks/requirements.txt`):
+    python -m benchmarks.suite [--output results.json] [--only completion,chain] [--llm-latency-ms 50]
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_validation import make_canvas
+from benchmarks.fakes import InMemoryFirestore, make_fake_redis
+
+
+BENCHMARKS = ["completion", "prompt", "chain", "stale", "canvas", "viewport", "validation", "wire_format", "socketio"]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return round(values[min(int(len(values) * q), len(values) - 1)], 2)
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def create_app(args):
+    """Import the app with the fake LLM, then swap its datastores for in-process stand-ins"""
+    os.environ.update({
+        "ENABLE_FAKE_LLM": "true",
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_LLM_TOKENS_PER_S": str(args.llm_tokens_per_s),
+        "ENABLE_REDIS": "false",
+        "ENABLE_REDIS_PUBSUB": "false",
+        "ENABLE_WRITE_BEHIND": "false",
+        "ENABLE_JOB_QUEUE": "false",
+        "ENABLE_LAZY_INIT": "true",
+        "LOG_SAMPLE_RATE": "0",
+        "FLASK_ENV": "benchmark",
+    })
+    os.environ.setdefault("CORS_ORIGIN", "*")
+    os.environ.setdefault("GCP_PROJECT", "benchmark")
+    # measure the app, not the provider limits
+    for limit in ["MODEL_MAX_CONCURRENCY", "PROVIDER_MAX_CONCURRENCY", "RESILIENCE_MAX_WORKERS"]:
+        os.environ.setdefault(limit, str(max(args.concurrency)))
+
+    from src.app import app, socketio
+    from src.db.canvas_cache import CanvasCache
+    from src.llm_cache import LLMResponseCache
+
+    db = InMemoryFirestore(latency_ms=args.firestore_latency_ms)
+    r = make_fake_redis()
+    app.config.update(
+        FIRESTORE=db,
+        REDIS=r,
+        CANVAS_CACHE=CanvasCache(redis=r),
+        LLM_CACHE=LLMResponseCache(redis=r, enabled=False),
+    )
+    return app, socketio, db, r
+
+
+def bench_completion(app, args):
+    results = {}
+    for concurrency in args.concurrency:
+        def complete(_):
+            client = app.test_client()
+            start = time.perf_counter()
+            response = client.post("/api/v1/completion", json={
+                "model": "qwen-2.5-7b",
+                "prompt": f"benchmark {uuid.uuid4()}",
+                "nodeId": "benchmark",
+            })
+            return response.status_code, (time.perf_counter() - start) * 1000
+
+        total_requests = concurrency * args.rounds
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(complete, range(total_requests)))
+        wall_s = time.perf_counter() - start
+
+        latencies = [elapsed_ms for status, elapsed_ms in outcomes if status == 200]
+        results[f"concurrency={concurrency}"] = {
+            "requests": total_requests,
+            "errors": total_requests - len(latencies),
+            "throughput_rps": round(len(latencies) / wall_s, 2),
+            "p50_ms": percentile(latencies, 0.5) if latencies else None,
+            "p95_ms": percentile(latencies, 0.95) if latencies else None,
+        }
+    return results
+
+
+def bench_prompt(app, r, args):
+    """Context-free prompt suggestions, generated per request, then popped from a filled PromptSuggestionPool"""
+    from src.ai_models import generate_prompt_question
+    from src.prompt_pool import PromptSuggestionPool
+
+    client = app.test_client()
+    body = {"parentNodes": []}
+    generated_ms = median_ms(lambda: client.post("/api/v1/prompt", json=body), args.repeat)
+
+    generated = iter(range(10 ** 9))
+    # the fake model always answers the same, number its answers so deduplication keeps them
+    prompt_pool = PromptSuggestionPool(
+        r,
+        generate=lambda: f"{generate_prompt_question([])} {next(generated)}",
+        key=f"benchmark-prompt-pool-{uuid.uuid4().hex[:8]}",
+    )
+    start = time.perf_counter()
+    added = prompt_pool.refill()
+    refill_ms = (time.perf_counter() - start) * 1000
+
+    app.config['PROMPT_POOL'] = prompt_pool
+    try:
+        pool_ms = median_ms(lambda: client.post("/api/v1/prompt", json=body), min(args.repeat, added))
+        served = client.post("/api/v1/prompt", json=body).headers.get("X-Cache")
+    finally:
+        app.config.pop('PROMPT_POOL')
+    return {
+        "generated_ms": generated_ms,
+        "pool_ms": pool_ms,
+        "pool_served": served == "pool",
+        "refill_ms": round(refill_ms, 2),
+        "refill_added": added,
+    }
+
+
+def store_dag(r, width, depth):
+    """Store depth layers of width nodes, each depending on every node of the layer before"""
+    from src.db.node_graph import index_node_parents
+
+    prefix = uuid.uuid4().hex[:8]
+    previous_layer = []
+    pipe = r.pipeline()
+    for layer in range(depth):
+        current_layer = [f"{prefix}-{layer}-{index}" for index in range(width)]
+        for node_id in current_layer:
+            index_node_parents(pipe, node_id, previous_layer)
+            pipe.hset(f"node:{node_id}", mapping={
+                "model": "qwen-2.5-7b",
+                "prompt": f"Step {layer} of the benchmark",
+                "parent_ids": json.dumps(previous_layer),
+            })
+        previous_layer = current_layer
+    pipe.execute()
+    return prefix, previous_layer
+
+
+def bench_chain(app, r, args):
+    client = app.test_client()
+    results = {}
+    for width, depth in args.dags:
+        prefix, last_layer = store_dag(r, width, depth)
+        body = {"model": "qwen-2.5-7b", "prompt": "Summarize", "nodeId": f"{prefix}-sink", "parentNodes": [{"id": node_id} for node_id in last_layer]}
+
+        start = time.perf_counter()
+        cold = client.post("/api/v1/chain-completion", json=body)
+        cold_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        warm = client.post("/api/v1/chain-completion", json=body)
+        warm_ms = (time.perf_counter() - start) * 1000
+
+        results[f"width={width},depth={depth}"] = {
+            "nodes": width * depth + 1,
+            "errors": [response.status_code for response in [cold, warm]].count(500),
+            "cold_ms": round(cold_ms, 2),
+            "cold_llm_calls": len(cold.json.get("recomputed", [])) if cold.status_code == 200 else None,
+            "warm_ms": round(warm_ms, 2),
+            "warm_llm_calls": len(warm.json.get("recomputed", [])) if warm.status_code == 200 else None,
+            # every layer waits for the one before, plus the sink
+            "critical_path_ms": (depth + 1) * args.llm_latency_ms,
+        }
+    return results
+
+
+def bench_stale(app, r, args):
+    """
+    Generate every node of a DAG, then change its first layer: mark its descendants stale,
+    and refresh them with the background refresher's batch, in dependency order
+    """
+    from src.ai_models import run_chain_completion
+    from src.db.node_graph import STALE_NODES_KEY, mark_descendants_stale
+    from src.stale_refresh import StaleNodeRefresher
+
+    os.environ["ENABLE_STALE_TRACKING"] = "true"
+    results = {}
+    for width, depth in args.dags:
+        prefix, last_layer = store_dag(r, width, depth)
+        run_chain_completion(r, f"{prefix}-sink", "qwen-2.5-7b", "Summarize", last_layer)
+        r.delete(STALE_NODES_KEY)
+        first_layer = [f"{prefix}-0-{index}" for index in range(width)]
+
+        start = time.perf_counter()
+        marked = mark_descendants_stale(r, first_layer, include_nodes=True)
+        mark_ms = (time.perf_counter() - start) * 1000
+
+        refresher = StaleNodeRefresher(r, batch_size=len(marked))
+        start = time.perf_counter()
+        refreshed = 0
+        while r.zcard(STALE_NODES_KEY):
+            refreshed += refresher.refresh()
+        refresh_ms = (time.perf_counter() - start) * 1000
+
+        results[f"width={width},depth={depth}"] = {
+            "nodes": width * depth + 1,
+            "marked": len(marked),
+            "mark_ms": round(mark_ms, 2),
+            "refreshed": refreshed,
+            "refresh_ms": round(refresh_ms, 2),
+            "critical_path_ms": (depth + 1) * args.llm_latency_ms,
+        }
+    os.environ.pop("ENABLE_STALE_TRACKING")
+    return results
+
+
+def bench_canvas(app, db, args):
+    client = app.test_client()
+    canvas_cache = app.config['CANVAS_CACHE']
+    results = {}
+    for node_count in args.nodes:
+        canvas_id = f"benchmark-{node_count}-{uuid.uuid4().hex[:8]}"
+        canvas = {**make_canvas(node_count), "canvasId": canvas_id}
+        round_trips = {}
+
+        def timed(operation, request):
+            before = db.round_trips
+            elapsed_ms = median_ms(request, args.repeat)
+            round_trips[operation] = (db.round_trips - before) // args.repeat
+            return elapsed_ms
+
+        def load_cold():
+            canvas_cache.invalidate(canvas_id)
+            client.get(f"/ds/v1/canvases/{canvas_id}")
+
+        save_ms = timed("save", lambda: client.post("/ds/v1/canvases", json=canvas))
+        load_cold_ms = timed("load_cold", load_cold)
+        load_cached_ms = timed("load_cached", lambda: client.get(f"/ds/v1/canvases/{canvas_id}"))
+        patch_ms = timed("patch", lambda: client.patch(f"/ds/v1/canvases/{canvas_id}", json={
+            "updates": [{"id": "node-0", "position": {"x": 1, "y": 2}}],
+        }))
+        results[f"nodes={node_count}"] = {
+            "save_ms": save_ms,
+            "load_cold_ms": load_cold_ms,
+            "load_cached_ms": load_cached_ms,
+            "patch_ms": patch_ms,
+            "firestore_round_trips": round_trips,
+            "load_status": client.get(f"/ds/v1/canvases/{canvas_id}").status_code,
+        }
+    return results
+
+
+def bench_viewport(app, args):
+    """Canvases with nodes laid out on a square grid, loaded in full and through a 1920x1080 viewport"""
+    client = app.test_client()
+    canvas_cache = app.config['CANVAS_CACHE']
+    results = {}
+    for node_count in args.viewport_nodes:
+        canvas_id = f"benchmark-viewport-{node_count}-{uuid.uuid4().hex[:8]}"
+        canvas = {**make_canvas(node_count), "canvasId": canvas_id}
+        columns = max(int(node_count ** 0.5), 1)
+        for index, node in enumerate(canvas["nodes"]):
+            node["position"] = {"x": (index % columns) * 800, "y": (index // columns) * 900}
+        client.post("/ds/v1/canvases", json=canvas)
+
+        def load(query=""):
+            canvas_cache.invalidate(canvas_id)
+            return client.get(f"/ds/v1/canvases/{canvas_id}{query}")
+
+        requests = {
+            "full": "",
+            "viewport": "?bbox=0,0,1920,1080&zoom=1",
+            "viewport_zoomed_out": "?bbox=0,0,7680,4320&zoom=0.25",
+        }
+        result = {}
+        for name, query in requests.items():
+            response = load(query)
+            result[f"{name}_ms"] = median_ms(lambda: load(query), args.repeat)
+            result[f"{name}_nodes"] = len(response.json["document"]["nodes"])
+            result[f"{name}_bytes"] = len(response.get_data())
+        results[f"nodes={node_count}"] = result
+    return results
+
+
+def bench_validation(args):
+    from benchmarks.bench_validation import run
+    return {f"nodes={result.pop('nodes')}": result for result in run(args.nodes, args.repeat)}
+
+
+def bench_wire_format(args):
+    from benchmarks.bench_wire_format import run
+    return {f"nodes={result.pop('nodes')}": result for result in run(args.nodes, args.repeat)}
+
+
+def bench_socketio(app, socketio, r, args):
+    from src.redis_listener import publish_node_update, start_redis_pubsub, stop_signal
+
+    app.config['PUBSUB_SUBSCRIPTIONS'] = start_redis_pubsub(r, socketio)
+    results = {}
+    try:
+        for client_count in args.clients:
+            canvas_id = f"benchmark-{uuid.uuid4().hex[:8]}"
+            channel = f"canvas:{canvas_id}:update"
+            clients = [socketio.test_client(app) for _ in range(client_count)]
+            for client in clients:
+                client.emit("subscribe", channel)
+            # the listener thread applies subscriptions asynchronously
+            deadline = time.time() + 5
+            while dict(r.pubsub_numsub(channel)).get(channel.encode(), 0) == 0 and time.time() < deadline:
+                time.sleep(0.01)
+
+            received = [0] * client_count
+            start = time.perf_counter()
+            for index in range(args.updates):
+                publish_node_update(r, f"{canvas_id}-node", {"prompt_response": f"update {index}"}, canvas_id=canvas_id)
+            deadline = time.time() + 30
+            while min(received) < args.updates and time.time() < deadline:
+                for index, client in enumerate(clients):
+                    received[index] += sum(1 for event in client.get_received() if event["name"] == channel)
+                time.sleep(0.001)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            for client in clients:
+                client.disconnect()
+            results[f"clients={client_count}"] = {
+                "updates": args.updates,
+                "delivered": sum(received),
+                "expected": args.updates * client_count,
+                "total_ms": round(elapsed_ms, 2),
+                "per_update_ms": round(elapsed_ms / args.updates, 3),
+            }
+    finally:
+        stop_signal.set()
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    results = {}
+    # the app prints while it runs, keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        app, socketio, db, r = create_app(args)
+        # the first call builds models and loads the tokenizer, keep it out of the timings
+        app.test_client().post("/api/v1/completion", json={"model": "qwen-2.5-7b", "prompt": "warm up", "nodeId": "warm-up"})
+        if "completion" in args.only:
+            results["completion"] = bench_completion(app, args)
+        if "prompt" in args.only:
+            results["prompt"] = bench_prompt(app, r, args)
+        if "chain" in args.only:
+            results["chain"] = bench_chain(app, r, args)
+        if "stale" in args.only:
+            results["stale"] = bench_stale(app, r, args)
+        if "canvas" in args.only:
+            results["canvas"] = bench_canvas(app, db, args)
+        if "viewport" in args.only:
+            results["viewport"] = bench_viewport(app, args)
+        if "validation" in args.only:
+            results["validation"] = bench_validation(args)
+        if "wire_format" in args.only:
+            results["wire_format"] = bench_wire_format(args)
+        if "socketio" in args.only:
+            results["socketio"] = bench_socketio(app, socketio, r, args)
+
+    return {
+        "benchmark": "suite",
+        "commit": get_commit(),
+        "config": {
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_tokens_per_s": args.llm_tokens_per_s,
+            "firestore_latency_ms": args.firestore_latency_ms,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def parse_ints(value):
+    return [int(item) for item in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", type=lambda value: value.split(","), default=BENCHMARKS)
+    parser.add_argument("--output")
+    parser.add_argument("--llm-latency-ms", type=int, default=50)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=0)
+    parser.add_argument("--firestore-latency-ms", type=float, default=2)
+    parser.add_argument("--concurrency", type=parse_ints, default=[1, 8, 32])
+    parser.add_argument("--rounds", type=int, default=4, help="completion requests per client")
+    parser.add_argument("--dags", type=lambda value: [tuple(parse_ints(dag.replace("x", ","))) for dag in value.split(";")],
+                        default=[(1, 1), (1, 4), (4, 1), (4, 4), (8, 2)], help="widthxdepth;...")
+    parser.add_argument("--nodes", type=parse_ints, default=[10, 100, 500, 2000])
+    parser.add_argument("--viewport-nodes", type=parse_ints, default=[500, 5000])
+    parser.add_argument("--clients", type=parse_ints, default=[1, 10, 50, 200])
+    parser.add_argument("--updates", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,32 @@
+import os
+import shutil
+import tempfile
+
+
+# Cooperative eventlet workers serve many requests at once, so slow LLM calls don't hold up
+# canvas reads and saves. Set GUNICORN_WORKER_CLASS=sync for one request per worker.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "eventlet")
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+
+if worker_class == "eventlet":
+    # gRPC calls block the eventlet hub, so talk to Firestore over REST
+    os.environ.setdefault("FIRESTORE_TRANSPORT", "rest")
+
+
+# Workers write Prometheus samples to files here, so /metrics on any worker reports all of them
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "polylogue-metrics"))
+
+
+def on_starting(server):
+    # drop samples left over from a previous run
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
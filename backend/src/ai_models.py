@@ -1,54 +1,20 @@
+import hashlib
 import json
-import os
-from langchain_together import ChatTogether
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain.prompts import PromptTemplate
+import time
+from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnableLambda
 from functools import partial
-from src.db.firestore import get_document_by_collection_and_id
-
-
-qwen_2_5_7b_together_model = ChatTogether(
-    model="Qwen/Qwen2.5-7B-Instruct-Turbo",
-    together_api_key=os.getenv("TOGETHER_API_KEY"),
-    temperature=0.7,
-)
-mixtral_8x7b_together_model = ChatTogether(
-    model="mistralai/Mixtral-8x7B-Instruct-v0.1",
-    together_api_key=os.getenv("TOGETHER_API_KEY"),
-)
-llama_3_3_70b_together_model = ChatTogether(
-    model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
-    together_api_key=os.getenv("TOGETHER_API_KEY")
-)
-if os.getenv("OPENAI_API_KEY"):
-    gpt_4o_model = ChatOpenAI(
-        model="gpt-4o",
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
-if os.getenv("ANTHROPIC_API_KEY"):
-    claude_sonnet_model = ChatAnthropic(
-        model="claude-3-5-sonnet-20240620",
-        api_key=os.getenv("ANTHROPIC_API_KEY"),
-    )
-
-
-def get_model(model_name):
-    if model_name == "qwen-2.5-7b":
-        llm = qwen_2_5_7b_together_model
-    elif model_name == "mixtral-8x7b":
-        llm = mixtral_8x7b_together_model
-    elif model_name == "llama-3.3-70b":
-        llm = llama_3_3_70b_together_model
-    elif model_name == "gpt-4o":
-        llm = gpt_4o_model
-    elif model_name == "claude-sonnet":
-        llm = claude_sonnet_model
-    else:
-        raise ValueError(f"Unsupported model type: {model_name}")
-    
-    return llm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from redis import exceptions as redis_exceptions
+from src.db.firestore import get_canvas_nodes
+from src.db.node_graph import is_stale_tracking_enabled, mark_descendants_stale
+from src.db.redis_scripts import ANCESTOR_NODES_SCRIPT, get_script
+from src.dag_executor import run_dag, topological_levels
+from src.llm_cache import make_cache_key
+from src.context_builder import count_tokens, fit_context, get_node_summary
+from src.model_registry import get_model
+from src.redis_listener import publish_node_update
+from src.structured_log import log_event
 
 
 context_prompt_question_template = PromptTemplate(
@@ -77,16 +43,27 @@ Add newlines between each bullet point.
 )
 
 
+summary_prompt_template = PromptTemplate(
+    input_variables=["response"],
+    template="""Summarize the following response in *LESS THAN 40 WORDS*, keeping its key facts and conclusions.
+Reply with the summary only.
+*Response:*
+{response}"""
+)
+
+
 def get_parent_responses_from_redis(redis, parent_nodes=None) -> list:
     if not parent_nodes:
         return []
 
+    pipe = redis.pipeline(transaction=False)
+    for node in parent_nodes:
+        pipe.hget(f"node:{node['id']}", "prompt_response")
+
     prev_chat_responses = []
-    for index, node in enumerate(parent_nodes):
-            node_id = node["id"]
-            if redis.exists(f"node:{node_id}"):
-                prompt_response = redis.hget(f"node:{node_id}", "prompt_response").decode('utf-8')
-                prev_chat_responses.append(f"Response {index+1}: {prompt_response}")
+    for index, prompt_response in enumerate(pipe.execute()):
+        if prompt_response is not None:
+            prev_chat_responses.append(f"Response {index+1}: {prompt_response.decode('utf-8')}")
     return prev_chat_responses
 
 
@@ -99,10 +76,9 @@ def get_parent_responses_from_firestore(db, parent_nodes=None) -> list:
     if not canvas_doc_id:
         return []
     try:
-        canvas_doc = get_document_by_collection_and_id(db, "canvases", canvas_doc_id)
+        canvas_nodes = get_canvas_nodes(db, "canvases", canvas_doc_id, [node["id"] for node in parent_nodes])
     except ValueError:
         return []
-    canvas_nodes = canvas_doc["nodes"]
     for index, node in enumerate(parent_nodes):
         node_id = node["id"]
         if node_id in canvas_nodes:
@@ -124,12 +100,75 @@ def get_parent_responses(parent_nodes=None) -> list:
     return prev_chat_responses
 
 
-def generate_prompt_question(parent_nodes):
+def summarize_response(text: str) -> str:
+    """Summarize a response so it can stand in for it in a descendant's context"""
+    chain = summary_prompt_template | get_model("qwen-2.5-7b")
+    return get_message_text(chain.invoke({"response": text}))
+
+
+def build_context(model: str, parent_nodes=None, redis=None):
+    """
+    Build the context from parent responses within the model's context token budget.
+    Responses are kept verbatim nearest first, and replaced by their cached summary once
+    they no longer fit. Returns (context, stats).
+    """
+    entries = [
+        {"id": node["id"], "text": node["data"]["prompt_response"]}
+        for node in parent_nodes or []
+    ]
+    texts, stats = fit_context(
+        entries,
+        model,
+        lambda entry: get_node_summary(redis, entry["id"], entry["text"], summarize_response),
+    )
+    context = "\n\n".join(
+        f"Response {index+1}: {text}"
+        for index, text in enumerate(texts)
+        if text is not None
+    )
+    return context, stats
+
+
+def prepare_context_prompt(model: str, prompt: str, parent_nodes=None, redis=None) -> dict:
+    context, context_stats = build_context(model, parent_nodes, redis=redis)
+    inputs = {
+        "context": context,
+        "prompt": prompt
+    }
+    return {
+        "inputs": inputs,
+        "prompt_tokens": count_tokens(context_prompt_template.format(**inputs), model),
+        "context": context_stats,
+    }
+
+
+def get_message_text(message) -> str:
+    """Extract the text of a (possibly chunked) chat model message"""
+    content = message.content if hasattr(message, 'content') else message
+    if isinstance(content, list):
+        # Anthropic chunks may arrive as a list of content blocks
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    return str(content)
+
+
+def get_prompt_question_cache_key(parent_nodes) -> str:
+    context = "\n\n".join(get_parent_responses(parent_nodes=parent_nodes))
+    return make_cache_key("prompt_question", context)
+
+
+def get_completion_cache_key(model: str, prompt: str, parent_nodes: list) -> str:
+    context = "\n\n".join(get_parent_responses(parent_nodes=parent_nodes))
+    return make_cache_key("completion_with_usage", model, context, prompt)
+
+
+def generate_prompt_question(parent_nodes, redis=None):
     """Generate a prompt suggestion"""
-    parent_responses = get_parent_responses(parent_nodes=parent_nodes)
-    context = "\n\n".join(parent_responses)
+    context, _ = build_context("qwen-2.5-7b", parent_nodes, redis=redis)
 
-    chain = context_prompt_question_template | qwen_2_5_7b_together_model
+    chain = context_prompt_question_template | get_model("qwen-2.5-7b")
     prompt_question = chain.invoke({ "context": context })
     
     return prompt_question.content if hasattr(prompt_question, 'content') else str(prompt_question)
@@ -139,65 +178,260 @@ def generate_response_with_context(
         model: str,
         prompt: str,
         parent_nodes: list,
+        redis=None,
+) -> dict:
+    """Generate a prompt response. Returns { response, promptTokens }"""
+    prepared = prepare_context_prompt(model, prompt, parent_nodes, redis=redis)
+    log_event("completion_context", model=model, context_chars=len(prepared["context"]), prompt_tokens=prepared["prompt_tokens"])
+
+    llm = get_model(model)
+
+    chain = context_prompt_template | llm
+
+    response_with_context = chain.invoke(prepared["inputs"])
+        
+    return {
+        "response": get_message_text(response_with_context),
+        "promptTokens": prepared["prompt_tokens"],
+    }
+
+
+def stream_response_with_context(
+        model: str,
+        prompt: str,
+        parent_nodes: list,
+        redis=None,
+        prepared=None,
 ):
-    parent_responses = get_parent_responses(parent_nodes=parent_nodes)
-    context = "\n\n".join(parent_responses)
+    """Yield prompt response tokens as the model generates them"""
+    prepared = prepared or prepare_context_prompt(model, prompt, parent_nodes, redis=redis)
 
     llm = get_model(model)
 
     chain = context_prompt_template | llm
 
-    response_with_context = chain.invoke({
+    for chunk in chain.stream(prepared["inputs"]):
+        token = get_message_text(chunk)
+        if token:
+            yield token
+
+
+def stream_completion_events(
+        model: str,
+        prompt: str,
+        parent_nodes: list,
+        redis=None,
+):
+    """
+    Yield (event, payload) pairs for a streamed completion.
+    Emits a "token" event per generated token, followed by a final "done" event
+    holding the full response, prompt token count and timings.
+    """
+    start = time.perf_counter()
+    time_to_first_token = None
+    tokens = []
+
+    prepared = prepare_context_prompt(model, prompt, parent_nodes, redis=redis)
+    for token in stream_response_with_context(model, prompt, parent_nodes, prepared=prepared):
+        if time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - start
+        tokens.append(token)
+        yield "token", {"token": token, "index": len(tokens) - 1}
+
+    yield "done", {
+        "response": "".join(tokens),
+        "promptTokens": prepared["prompt_tokens"],
+        "timeToFirstTokenMs": round((time_to_first_token or 0) * 1000, 2),
+        "totalMs": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def generate_responses_as_completed(
+        models: list,
+        prompt: str,
+        parent_nodes: list,
+        redis=None,
+        call=None,
+):
+    """
+    Generate responses to one prompt from several models at once, building the context once.
+    call(model, compute) runs each model's compute() and returns (result, status), e.g. through
+    the response cache; by default compute() is called directly.
+
+    Yields (model, result, error) as each model finishes, where result is
+    { response, promptTokens, cache, totalMs } with cache holding call's status,
+    and error is the raised exception, if any.
+    """
+    # Token counts differ slightly between tokenizers, so the shared context is fitted with the default one
+    context, _ = build_context(None, parent_nodes, redis=redis)
+    inputs = {
         "context": context,
         "prompt": prompt
-    })
-        
-    return response_with_context.content if hasattr(response_with_context, 'content') else str(response_with_context)
-
-
-def get_ancestor_nodes(redis, node_id) -> list:
-    """Get all ancestor nodes for a given node_id, including the node itself"""
-    def get_parent_nodes(node_id)->None:
-        if node_id in visited_node_ids or not redis.exists(f"node:{node_id}"):
-            return
-        visited_node_ids.add(node_id)
-        cur_node = redis.hgetall(f"node:{node_id}")
-        decoded_cur_node = {
-            k.decode('utf-8') : v.decode('utf-8')
-            for k, v in cur_node.items()
-            if k.decode('utf-8') in {"model", "prompt", "parent_ids"}
+    }
+    formatted_prompt = context_prompt_template.format(**inputs)
+    call = call or (lambda model, compute: (compute(), None))
+
+    def generate(model):
+        start = time.perf_counter()
+
+        def compute():
+            chain = context_prompt_template | get_model(model)
+            return {
+                "response": get_message_text(chain.invoke(inputs)),
+                "promptTokens": count_tokens(formatted_prompt, model),
+            }
+
+        result, status = call(model, compute)
+        return {
+            **result,
+            "cache": status,
+            "totalMs": round((time.perf_counter() - start) * 1000, 2),
         }
-        decoded_cur_node["id"] = node_id
-        decoded_cur_node["parent_ids"] = json.loads(decoded_cur_node["parent_ids"])
-        for parent_id in decoded_cur_node["parent_ids"]:
-            get_parent_nodes(parent_id)
-        # append node after so that root node is always first
-        ancestor_nodes.append(decoded_cur_node)
-
-    visited_node_ids = set()
+
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        futures = {executor.submit(generate, model): model for model in models}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+ANCESTOR_NODE_FIELDS = ["model", "prompt", "parent_ids", "prompt_response", "input_hash"]
+
+
+def decode_node_fields(node_id, values) -> dict:
+    """Decode an ancestor's hash fields. Raises ValueError for a node without a model or prompt."""
+    decoded_node = {
+        field: value.decode('utf-8')
+        for field, value in zip(ANCESTOR_NODE_FIELDS, values)
+        if value is not None
+    }
+    missing_fields = [field for field in ["model", "prompt"] if field not in decoded_node]
+    if missing_fields:
+        raise ValueError(f"Ancestor node {node_id} has no {' or '.join(missing_fields)}")
+    decoded_node["id"] = node_id
+    decoded_node["parent_ids"] = json.loads(decoded_node.get("parent_ids", "[]"))
+    return decoded_node
+
+
+def get_ancestor_nodes(redis, node_id, parent_ids=None) -> list:
+    """
+    Get all ancestor nodes for a given node_id in topological order, root nodes first.
+    The walk starts from parent_ids if given, otherwise from the node's stored parent_ids,
+    and runs as a single server-side Lua script.
+    Raises ValueError if an ancestor is stored without its model or prompt.
+    """
+    script = get_script(redis, ANCESTOR_NODES_SCRIPT)
+    try:
+        rows = script(
+            keys=[],
+            args=[
+                node_id,
+                json.dumps(parent_ids) if parent_ids is not None else "",
+                json.dumps(ANCESTOR_NODE_FIELDS),
+            ],
+            client=redis,
+        )
+    except redis_exceptions.ResponseError as e:
+        print(f"Ancestor script failed, falling back to pipelined traversal: {e}")
+        return get_ancestor_nodes_pipelined(redis, node_id, parent_ids=parent_ids)
+
+    return [decode_node_fields(row[0].decode('utf-8'), row[1:]) for row in rows]
+
+
+def get_ancestor_nodes_pipelined(redis, node_id, parent_ids=None) -> list:
+    """
+    Same as get_ancestor_nodes, fetching the graph one level per round trip with pipelines.
+    """
+    if parent_ids is None:
+        stored_parent_ids = redis.hget(f"node:{node_id}", "parent_ids")
+        parent_ids = json.loads(stored_parent_ids) if stored_parent_ids else []
+
+    nodes_by_id = {}
+    visited_node_ids = {node_id}
+    level = [parent_id for parent_id in parent_ids if parent_id not in visited_node_ids]
+    while level:
+        visited_node_ids.update(level)
+        pipe = redis.pipeline(transaction=False)
+        for level_node_id in level:
+            pipe.hmget(f"node:{level_node_id}", ANCESTOR_NODE_FIELDS)
+        next_level = []
+        for level_node_id, values in zip(level, pipe.execute()):
+            if all(value is None for value in values):
+                continue
+            nodes_by_id[level_node_id] = decode_node_fields(level_node_id, values)
+            for parent_id in nodes_by_id[level_node_id]["parent_ids"]:
+                if parent_id not in visited_node_ids and parent_id not in next_level:
+                    next_level.append(parent_id)
+        level = next_level
+
+    # iterative post-order walk, so every node comes after all of its parents
     ancestor_nodes = []
-    get_parent_nodes(node_id)
-    ancestor_nodes.pop()
+    emitted_node_ids = {node_id}
+    stack = [(parent_id, False) for parent_id in reversed(parent_ids)]
+    while stack:
+        cur_node_id, expanded = stack.pop()
+        if expanded:
+            ancestor_nodes.append(nodes_by_id[cur_node_id])
+            continue
+        if cur_node_id in emitted_node_ids or cur_node_id not in nodes_by_id:
+            continue
+        emitted_node_ids.add(cur_node_id)
+        stack.append((cur_node_id, True))
+        for parent_id in reversed(nodes_by_id[cur_node_id]["parent_ids"]):
+            stack.append((parent_id, False))
     return ancestor_nodes
     
 
-def generate_chained_responses(redis, cur_node):
-    ancestor_nodes = get_ancestor_nodes(redis, cur_node["id"])
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def hash_node_inputs(model: str, formatted_prompt: str, parent_output_hashes: list) -> str:
+    """Content address of a chain node: its model, rendered prompt and parent outputs"""
+    return hash_text(json.dumps([model, formatted_prompt, parent_output_hashes]))
+
+
+def generate_chained_responses(redis, cur_node, max_concurrency=None, reuse_ancestor_responses=False):
+    """
+    Generate responses for a node and all of its ancestors.
+    Ancestors whose model, rendered prompt and parent outputs are unchanged since their last run
+    reuse the prompt_response memoized in their node:{id} hash instead of calling the model.
+    With reuse_ancestor_responses, ancestors are fixed input instead: their stored prompt_response
+    is reused whatever their input_hash, and none of them is recomputed.
+    The current node is always recomputed.
+    Parent outputs that overflow CONTEXT_TOKEN_BUDGET are replaced by summaries cached on the parent node.
+    Raises ValueError if a parent is not stored in Redis, or is stored without its model or prompt.
+
+    Returns:
+    {
+        outputs: { node-output-<id>: str },
+        input_hashes: { <id>: str },
+        prompt_tokens: { <id>: int },
+        cache_hits: [<id>],
+        recomputed: [<id>],
+    }
+    """
+    ancestor_nodes = get_ancestor_nodes(redis, cur_node["id"], parent_ids=cur_node["parent_ids"])
     ancestor_nodes.append(cur_node)
+    # every parent's output goes into its child's prompt, so parents missing from Redis cannot be chained
+    stored_node_ids = {node["id"] for node in ancestor_nodes}
+    for node in ancestor_nodes:
+        missing_parent_ids = [parent_id for parent_id in node["parent_ids"] if parent_id not in stored_node_ids]
+        if missing_parent_ids:
+            raise ValueError(f"Parent nodes of {node['id']} are not stored: {', '.join(missing_parent_ids)}")
 
     initial_inputs = {}
-    output_keys = []
 
-    node_operations = []
+    node_operations = {}
     for node in ancestor_nodes:
         llm = get_model(node["model"])
 
         prompt_input_key = f"node-input-prompt-{node['id']}"
-        output_key = f"node-output-{node['id']}"
         parent_outputs = [f"node-output-{parent_id}" for parent_id in node['parent_ids']]
 
         initial_inputs[prompt_input_key] = node["prompt"]
-        output_keys.append(output_key)
 
         template = """Given the past dialog and prompt, reply thoughtfully in less than 120 words.
 There may be multiple or no past conversations.
@@ -212,7 +446,10 @@ There may be multiple or no past conversations.
             template=template,
         )
 
-        def process_node(inputs, node_llm, node_prompt_template, node_output_key):
+        def process_node(inputs, node, node_llm, node_prompt_template, use_memo, reuse_response):
+            if reuse_response:
+                return {"output": node.get("prompt_response", ""), "input_hash": node.get("input_hash"), "cache_hit": True, "prompt_tokens": 0}
+
             # Gather all required inputs
             prompt_input = inputs[node_prompt_template.input_variables[-1]]  # Last variable is the prompt
             parent_outputs = {
@@ -220,34 +457,117 @@ There may be multiple or no past conversations.
                 for k in node_prompt_template.input_variables 
                 if k != node_prompt_template.input_variables[-1]
             }
+
+            # Fit parent outputs into the context budget, summarizing the ones that do not fit
+            parent_contexts, _ = fit_context(
+                [
+                    {"id": k[len("node-output-"):], "text": parent_output}
+                    for k, parent_output in parent_outputs.items()
+                ],
+                node["model"],
+                lambda entry: get_node_summary(redis, entry["id"], entry["text"], summarize_response),
+            )
             
             # Format the prompt
             formatted_prompt = node_prompt_template.format(
-                **parent_outputs,
+                **{
+                    k: parent_context if parent_context is not None else ""
+                    for k, parent_context in zip(parent_outputs, parent_contexts)
+                },
                 **{node_prompt_template.input_variables[-1]: prompt_input}
             )
+            prompt_tokens = count_tokens(formatted_prompt, node["model"])
+
+            input_hash = hash_node_inputs(
+                node["model"],
+                formatted_prompt,
+                [hash_text(parent_output) for parent_output in parent_outputs.values()],
+            )
+            if use_memo and node.get("input_hash") == input_hash and node.get("prompt_response") is not None:
+                return {"output": node["prompt_response"], "input_hash": input_hash, "cache_hit": True, "prompt_tokens": prompt_tokens}
             
             # Get LLM response
             result = node_llm.invoke(formatted_prompt)
             
-            # Return the output with our key
-            return {node_output_key: result}
+            return {"output": get_message_text(result), "input_hash": input_hash, "cache_hit": False, "prompt_tokens": prompt_tokens}
         
         node_operation = RunnableLambda(
             partial(
                 process_node,
+                node=node,
                 node_llm=llm,
                 node_prompt_template=prompt_template,
-                node_output_key=output_key
+                use_memo=node is not cur_node,
+                reuse_response=reuse_ancestor_responses and node is not cur_node,
             )
         )
-        node_operations.append(node_operation)
+        node_operations[node["id"]] = node_operation
         
 
-    print(f"Chain Prompt Input Values: {initial_inputs}")
-
-    current_result = initial_inputs
-    for operation in node_operations:
-        current_result.update(operation.invoke(current_result))
-
-    return {k: current_result[k] for k in output_keys}
+    log_event("chain_started", node_id=cur_node["id"], nodes=len(ancestor_nodes), levels=len(topological_levels(ancestor_nodes)))
+
+    def run_node(node, parent_results):
+        # Each node only sees its own prompt and the outputs of its finished parents
+        inputs = {f"node-input-prompt-{node['id']}": initial_inputs[f"node-input-prompt-{node['id']}"]}
+        for parent_id, parent_result in parent_results.items():
+            inputs[f"node-output-{parent_id}"] = parent_result["output"]
+        return node_operations[node["id"]].invoke(inputs)
+
+    results = run_dag(ancestor_nodes, run_node, max_concurrency=max_concurrency)
+
+    return {
+        "outputs": {f"node-output-{node_id}": result["output"] for node_id, result in results.items()},
+        "input_hashes": {node_id: result["input_hash"] for node_id, result in results.items()},
+        "prompt_tokens": {node_id: result["prompt_tokens"] for node_id, result in results.items()},
+        "cache_hits": [node["id"] for node in ancestor_nodes if results[node["id"]]["cache_hit"]],
+        "recomputed": [node["id"] for node in ancestor_nodes if not results[node["id"]]["cache_hit"]],
+    }
+
+
+def run_chain_completion(redis, node_id, model, prompt, parent_node_ids, canvas_id=None, reuse_ancestor_responses=False) -> dict:
+    """
+    Generate a node's response along with its stale ancestors, and store every recomputed
+    response in its node:{id} hash, notifying subscribers.
+    With reuse_ancestor_responses only the node itself is generated, see generate_chained_responses.
+    Descendants of the recomputed nodes are marked stale.
+    Returns { response, cacheHits, recomputed, promptTokens }
+    """
+    chained_responses = generate_chained_responses(redis=redis, cur_node={
+        "id": node_id,
+        "model": model,
+        "prompt": prompt,
+        "parent_ids": parent_node_ids,
+    }, reuse_ancestor_responses=reuse_ancestor_responses)
+    outputs = chained_responses["outputs"]
+    input_hashes = chained_responses["input_hashes"]
+
+    pipe = redis.pipeline()
+    recomputed_ids = chained_responses["recomputed"]
+    if is_stale_tracking_enabled():
+        mark_descendants_stale(pipe, recomputed_ids, skip_node_ids=recomputed_ids)
+    for recomputed_id in recomputed_ids:
+        response = outputs[f"node-output-{recomputed_id}"]
+        if recomputed_id == node_id:
+            fields = {
+                "model": model,
+                "prompt": prompt,
+                "parent_ids": json.dumps(parent_node_ids or []),
+                "prompt_response": response,
+                "input_hash": input_hashes[node_id],
+            }
+            if canvas_id:
+                fields["canvas_id"] = canvas_id
+        else:
+            fields = {
+                "prompt_response": response,
+                "input_hash": input_hashes[recomputed_id],
+            }
+        publish_node_update(pipe, recomputed_id, fields, canvas_id=canvas_id)
+    pipe.execute()
+
+    return {
+        "response": outputs[f"node-output-{node_id}"],
+        "cacheHits": chained_responses["cache_hits"],
+        "recomputed": chained_responses["recomputed"],
+        "promptTokens": chained_responses["prompt_tokens"][node_id],
+    }
@@ -4,8 +4,23 @@ from flask import Flask
 from flask_cors import CORS
 from flask_socketio import SocketIO
 
-from src.redis_listener import start_redis_client, start_redis_pubsub
+from src.redis_listener import (
+    get_redis_url,
+    start_redis_client,
+    start_redis_pubsub,
+    register_shutdown_hook,
+    check_redis_connection_in_background,
+)
 from src.db.firestore import start_firestore_project_client
+from src.db.lazy_client import LazyClient
+from src.db.write_behind import CanvasWriteBuffer
+from src.db.canvas_cache import CanvasCache
+from src.llm_cache import LLMResponseCache
+from src.jobs import JobQueue, JobWorkerPool, make_job_handlers
+from src.stale_refresh import StaleNodeRefresher
+from src.prompt_pool import PromptSuggestionPool
+from src.metrics import init_request_metrics, is_metrics_enabled
+from src.wire_format import CompactRequest, OrjsonProvider
 
 
 env = os.environ.get("FLASK_ENV", "local")
@@ -18,27 +33,94 @@ else:
 
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.request_class = CompactRequest
 CORS(app, supports_credentials=True, origins=[os.environ["CORS_ORIGIN"]])
-socketio = SocketIO(app, cors_allowed_origins='*', transports=['websocket'])
 
+# A shared message queue lets any worker emit to clients connected to other workers
+enable_socketio_message_queue = os.getenv("ENABLE_SOCKETIO_MESSAGE_QUEUE", "false").lower() == "true"
+socketio = SocketIO(
+    app,
+    cors_allowed_origins='*',
+    transports=['websocket'],
+    message_queue=get_redis_url() if enable_socketio_message_queue else None,
+)
 
-ds_client = start_firestore_project_client(os.environ["GCP_PROJECT"])
+
+# Datastore clients connect in the background so they don't hold up app start
+enable_lazy_init = os.getenv("ENABLE_LAZY_INIT", "true").lower() == "true"
+
+
+gcp_project = os.environ["GCP_PROJECT"]
+if enable_lazy_init:
+    ds_client = LazyClient(lambda: start_firestore_project_client(gcp_project), name="firestore")
+    ds_client.warm_up()
+else:
+    ds_client = start_firestore_project_client(gcp_project)
 app.config['FIRESTORE'] = ds_client
 
 
 enable_redis = os.getenv("ENABLE_REDIS", "false").lower() == "true"
 if enable_redis:
-    r_client = start_redis_client()
+    r_client = start_redis_client(check_connection=not enable_lazy_init)
+    if enable_lazy_init:
+        check_redis_connection_in_background(r_client)
     app.config['REDIS'] = r_client
 
 
+enable_write_behind = os.getenv("ENABLE_WRITE_BEHIND", "false").lower() == "true"
+if enable_redis and enable_write_behind:
+    write_buffer = CanvasWriteBuffer(ds_client, r_client)
+    write_buffer.start()
+    register_shutdown_hook(write_buffer.stop)
+    app.config['WRITE_BUFFER'] = write_buffer
+
+
+app.config['CANVAS_CACHE'] = CanvasCache(redis=r_client if enable_redis else None)
+
+
+enable_llm_cache = os.getenv("ENABLE_LLM_CACHE", "true").lower() == "true"
+app.config['LLM_CACHE'] = LLMResponseCache(
+    redis=r_client if enable_redis else None,
+    enabled=enable_llm_cache,
+)
+
+
+# Completions and chain runs can be queued as jobs, run by a worker pool in every process
+enable_job_queue = os.getenv("ENABLE_JOB_QUEUE", "false").lower() == "true"
+if enable_redis and enable_job_queue:
+    job_queue = JobQueue(r_client)
+    app.config['JOB_QUEUE'] = job_queue
+    if os.getenv("ENABLE_JOB_WORKERS", "true").lower() == "true":
+        job_workers = JobWorkerPool(job_queue, make_job_handlers(r_client, app.config['LLM_CACHE']))
+        job_workers.start()
+        register_shutdown_hook(job_workers.stop)
+
+
+# Nodes left stale by changes to their ancestors can be recomputed in the background
+enable_stale_refresh = os.getenv("ENABLE_STALE_REFRESH", "false").lower() == "true"
+if enable_redis and enable_stale_refresh:
+    stale_refresher = StaleNodeRefresher(r_client)
+    stale_refresher.start()
+    register_shutdown_hook(stale_refresher.stop)
+
+
+# Prompt suggestions for nodes without context are pre-generated into a Redis pool
+enable_prompt_pool = os.getenv("ENABLE_PROMPT_POOL", "false").lower() == "true"
+if enable_redis and enable_prompt_pool:
+    prompt_pool = PromptSuggestionPool(r_client)
+    prompt_pool.start()
+    register_shutdown_hook(prompt_pool.stop)
+    app.config['PROMPT_POOL'] = prompt_pool
+
+
 enable_redis_pubsub = os.getenv("ENABLE_REDIS_PUBSUB", "false").lower() == "true"
 if enable_redis_pubsub:
-    pubsub = start_redis_pubsub(r_client, socketio)
-    app.config['PUBSUB'] = pubsub
+    subscriptions = start_redis_pubsub(r_client, socketio, use_leader_election=enable_socketio_message_queue)
+    app.config['PUBSUB_SUBSCRIPTIONS'] = subscriptions
 
-    from src.routes.sockets import socket_routes
 
+from src.routes.sockets import socket_routes
 
 
 from src.routes.datastore import ds_routes
@@ -49,5 +131,11 @@ from src.routes.api import api_routes
 app.register_blueprint(api_routes, url_prefix="/api")
 
 
+if is_metrics_enabled():
+    init_request_metrics(app)
+    from src.routes.metrics import metrics_routes
+    app.register_blueprint(metrics_routes)
+
+
 if __name__ == "__main__":
     socketio.run(app, debug=True)
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import threading
+from functools import lru_cache
+from cachetools import TTLCache
+
+from src.db.redis_scripts import HSET_IF_EXISTS_SCRIPT, get_script
+
+
+# tiktoken encodings closest to each model's tokenizer, others are approximated with cl100k_base
+MODEL_ENCODINGS = {
+    "gpt-4o": "o200k_base",
+}
+
+_local_summaries = TTLCache(maxsize=1024, ttl=3600)
+_local_summaries_lock = threading.Lock()
+
+
+def get_context_token_budget() -> int:
+    return int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(encoding_name):
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        print(f"Falling back to approximate token counts: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = _get_encoding(MODEL_ENCODINGS.get(model, "cl100k_base"))
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def get_node_summary(redis, node_id, text, summarize) -> str:
+    """
+    Get the summary of a node's response, computing it once with summarize(text).
+    Summaries are stored next to prompt_response in the node:{id} hash, keyed by a hash of the
+    response so an edited response gets a new summary. Summaries of nodes not stored in Redis,
+    or without Redis, are kept in process.
+    """
+    text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    if redis is not None and node_id:
+        summary, summary_hash = redis.hmget(f"node:{node_id}", "prompt_summary", "prompt_summary_hash")
+        if summary is not None and summary_hash is not None and summary_hash.decode('utf-8') == text_hash:
+            return summary.decode('utf-8')
+
+    with _local_summaries_lock:
+        summary = _local_summaries.get(text_hash)
+    if summary is not None:
+        return summary
+
+    summary = summarize(text)
+    stored = False
+    if redis is not None and node_id:
+        stored = get_script(redis, HSET_IF_EXISTS_SCRIPT)(
+            keys=[f"node:{node_id}"],
+            args=["prompt_summary", summary, "prompt_summary_hash", text_hash],
+            client=redis,
+        )
+    if not stored:
+        with _local_summaries_lock:
+            _local_summaries[text_hash] = summary
+    return summary
+
+
+def fit_context(entries, model, summarize_entry, budget=None):
+    """
+    Fit context entries into a token budget.
+    entries are dicts with "id" and "text", ordered nearest first. Each entry is kept verbatim
+    while it fits, then replaced by summarize_entry(entry) if that fits, and dropped otherwise.
+
+    Returns (texts, stats) where texts keeps the entries' original order (None for dropped entries)
+    and stats lists the ids kept in full, summarized and dropped along with the tokens used.
+    """
+    budget = budget if budget is not None else get_context_token_budget()
+    texts = [None] * len(entries)
+    stats = {"full": [], "summarized": [], "dropped": [], "tokens": 0, "budget": budget}
+
+    remaining = budget
+    for index, entry in enumerate(entries):
+        tokens = count_tokens(entry["text"], model)
+        if tokens <= remaining:
+            texts[index] = entry["text"]
+            stats["full"].append(entry["id"])
+            remaining -= tokens
+            continue
+
+        summary = summarize_entry(entry)
+        summary_tokens = count_tokens(summary, model)
+        if summary_tokens <= remaining:
+            texts[index] = summary
+            stats["summarized"].append(entry["id"])
+            remaining -= summary_tokens
+        else:
+            stats["dropped"].append(entry["id"])
+
+    stats["tokens"] = budget - remaining
+    return texts, stats
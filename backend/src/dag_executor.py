@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def topological_levels(nodes) -> list:
+    """
+    Group node ids into levels, where every node only depends on nodes in earlier levels.
+    Parent ids that are not part of the graph are ignored.
+    """
+    node_ids = {node["id"] for node in nodes}
+    pending_parents = {
+        node["id"]: {parent_id for parent_id in node["parent_ids"] if parent_id in node_ids}
+        for node in nodes
+    }
+
+    levels = []
+    placed = set()
+    while len(placed) < len(node_ids):
+        level = [
+            node["id"] for node in nodes
+            if node["id"] not in placed and pending_parents[node["id"]] <= placed
+        ]
+        if not level:
+            raise ValueError("Node graph contains a cycle")
+        levels.append(level)
+        placed.update(level)
+    return levels
+
+
+def run_dag(nodes, run_node, max_concurrency=None) -> dict:
+    """
+    Run every node of a DAG, starting each node as soon as all of its own parents have finished.
+    Independent nodes run concurrently, up to max_concurrency at a time.
+
+    run_node(node, parent_results) is called with a dict of the finished parents' results,
+    and the returned dict maps node id to its result.
+    """
+    max_concurrency = max_concurrency or int(os.getenv("CHAIN_MAX_CONCURRENCY", 4))
+    nodes_by_id = {node["id"]: node for node in nodes}
+
+    # Validates the graph, and gives a deterministic start order
+    levels = topological_levels(nodes)
+
+    children = {node_id: [] for node_id in nodes_by_id}
+    remaining_parents = {}
+    for node in nodes:
+        graph_parents = {parent_id for parent_id in node["parent_ids"] if parent_id in nodes_by_id}
+        remaining_parents[node["id"]] = len(graph_parents)
+        for parent_id in graph_parents:
+            children[parent_id].append(node["id"])
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        def submit(node_id):
+            node = nodes_by_id[node_id]
+            parent_results = {
+                parent_id: results[parent_id]
+                for parent_id in node["parent_ids"]
+                if parent_id in results
+            }
+            future = executor.submit(run_node, node, parent_results)
+            running[future] = node_id
+
+        running = {}
+        for node_id in levels[0]:
+            submit(node_id)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node_id = running.pop(future)
+                try:
+                    results[node_id] = future.result()
+                except Exception:
+                    for pending in running:
+                        pending.cancel()
+                    raise
+
+                for child_id in children[node_id]:
+                    remaining_parents[child_id] -= 1
+                    if remaining_parents[child_id] == 0:
+                        submit(child_id)
+
+    return results
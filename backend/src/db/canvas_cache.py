@@ -0,0 +1,68 @@
+import os
+import threading
+from cachetools import TTLCache
+
+
+class CanvasCache:
+    """
+    Read-through cache of serialized canvas GET responses.
+    Every canvas has a version number that writes bump, so stale entries are never served
+    and the version doubles as the canvas ETag.
+    Versions and bodies live in Redis when available, so every worker shares them,
+    with a per-process TTL cache in front. Without Redis, versions are per process.
+
+    Redis layout:
+    - canvas_cache:{canvas_id}:version: version counter
+    - canvas_cache:{canvas_id}: hash of {version, body}
+    """
+    def __init__(self, redis=None, maxsize=None, ttl=None, redis_ttl=None):
+        self.redis = redis
+        self.redis_ttl = redis_ttl or int(os.getenv("CANVAS_CACHE_REDIS_TTL", 3600))
+        self.local = TTLCache(
+            maxsize=maxsize or int(os.getenv("CANVAS_CACHE_MAXSIZE", 256)),
+            ttl=ttl or int(os.getenv("CANVAS_CACHE_TTL", 300)),
+        )
+        self.local_versions = {}
+        self.lock = threading.Lock()
+
+    def get_version(self, canvas_id) -> int:
+        if self.redis:
+            version = self.redis.get(f"canvas_cache:{canvas_id}:version")
+            return int(version) if version is not None else 0
+        return self.local_versions.get(canvas_id, 0)
+
+    def get_etag(self, canvas_id, version) -> str:
+        return f"{canvas_id}-{version}"
+
+    def get(self, canvas_id, version):
+        """Get the cached response body for this canvas version, or None"""
+        with self.lock:
+            entry = self.local.get(canvas_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        if self.redis:
+            cached_version, body = self.redis.hmget(f"canvas_cache:{canvas_id}", "version", "body")
+            if cached_version is not None and int(cached_version) == version:
+                with self.lock:
+                    self.local[canvas_id] = (version, body)
+                return body
+        return None
+
+    def set(self, canvas_id, version, body):
+        with self.lock:
+            self.local[canvas_id] = (version, body)
+        if self.redis:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(f"canvas_cache:{canvas_id}", mapping={"version": version, "body": body})
+            pipe.expire(f"canvas_cache:{canvas_id}", self.redis_ttl)
+            pipe.execute()
+
+    def invalidate(self, canvas_id):
+        """Bump the canvas version after a write, which invalidates every cached body and ETag"""
+        with self.lock:
+            self.local.pop(canvas_id, None)
+            if not self.redis:
+                self.local_versions[canvas_id] = self.local_versions.get(canvas_id, 0) + 1
+        if self.redis:
+            self.redis.incr(f"canvas_cache:{canvas_id}:version")
@@ -0,0 +1,76 @@
+import math
+
+
+# Canvas nodes are indexed in a uniform grid of GRID_CELL_SIZE px square cells.
+# Each cell is a canvases/{id}/grid/{cx}_{cy} document mapping the id of every node overlapping
+# the cell to its [x, y, width, height] rectangle, so a viewport query reads only the cells it covers.
+GRID_CELL_SIZE = 2000
+# React Flow's llmText node size, for nodes saved before they were measured
+DEFAULT_NODE_SIZE = (650, 700)
+# Cells a single query may read, so a zoomed-out viewport does not read the whole grid cell by cell
+MAX_VIEWPORT_CELLS = 400
+
+
+def node_rect(node):
+    """[x, y, width, height] of a node, or None without a position"""
+    position = node.get("position")
+    if not isinstance(position, dict) or "x" not in position or "y" not in position:
+        return None
+    measured = node.get("measured") or {}
+    return [
+        position["x"],
+        position["y"],
+        measured.get("width", DEFAULT_NODE_SIZE[0]),
+        measured.get("height", DEFAULT_NODE_SIZE[1]),
+    ]
+
+
+def cell_ids(rect) -> set:
+    """Ids of the grid cells a [x, y, width, height] rectangle overlaps"""
+    if rect is None:
+        return set()
+    x, y, width, height = rect
+    return {
+        f"{cx}_{cy}"
+        for cx in range(math.floor(x / GRID_CELL_SIZE), math.floor((x + width) / GRID_CELL_SIZE) + 1)
+        for cy in range(math.floor(y / GRID_CELL_SIZE), math.floor((y + height) / GRID_CELL_SIZE) + 1)
+    }
+
+
+def viewport_cell_ids(viewport):
+    """Ids of the cells a viewport covers, or None if there are more than MAX_VIEWPORT_CELLS"""
+    min_x, min_y, max_x, max_y = viewport
+    columns = math.floor(max_x / GRID_CELL_SIZE) - math.floor(min_x / GRID_CELL_SIZE) + 1
+    rows = math.floor(max_y / GRID_CELL_SIZE) - math.floor(min_y / GRID_CELL_SIZE) + 1
+    if columns * rows > MAX_VIEWPORT_CELLS:
+        return None
+    return cell_ids([min_x, min_y, max_x - min_x, max_y - min_y])
+
+
+def intersects(rect, viewport) -> bool:
+    if rect is None:
+        return False
+    x, y, width, height = rect
+    min_x, min_y, max_x, max_y = viewport
+    return x <= max_x and x + width >= min_x and y <= max_y and y + height >= min_y
+
+
+def build_grid(nodes) -> dict:
+    """Grid cells for a nodes map: {cell_id: {node_id: rect}}"""
+    cells = {}
+    for node_id, node in nodes.items():
+        rect = node_rect(node)
+        for cell_id in cell_ids(rect):
+            cells.setdefault(cell_id, {})[node_id] = rect
+    return cells
+
+
+def parse_viewport(bbox):
+    """Parse a "minX,minY,maxX,maxY" query parameter"""
+    try:
+        min_x, min_y, max_x, max_y = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise ValueError("bbox must be minX,minY,maxX,maxY")
+    if min_x > max_x or min_y > max_y:
+        raise ValueError("bbox min must not exceed max")
+    return min_x, min_y, max_x, max_y
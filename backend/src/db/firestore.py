@@ -1,7 +1,55 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache
+from google.api_core import exceptions as google_exceptions
 from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.cloud.firestore_v1.services.firestore import client as firestore_client
+from google.cloud.firestore_v1.services.firestore.transports.rest import FirestoreRestTransport
+
+from src.db.canvas_index import build_grid, cell_ids, intersects, node_rect, viewport_cell_ids
+from src.metrics import observe_firestore, record_firestore_payload
+
+
+DELETE_FIELD = firestore.DELETE_FIELD
+FIRESTORE_BATCH_LIMIT = 500
+
+CANVAS_NODES_COLLECTION = "nodes"
+CANVAS_GRID_COLLECTION = "grid"
+SHARDED_NODE_STORAGE = "subcollection"
+GRID_NODE_INDEX = "grid"
+
+# Canvases known to keep their nodes in the subcollection. A canvas never goes back, so this needs no expiry.
+_sharded_canvas_ids = LRUCache(maxsize=10000)
+_sharded_lock = threading.Lock()
+_executor = None
+
+
+class RestFirestoreClient(firestore.Client):
+    """
+    Firestore client using the REST transport instead of gRPC.
+    gRPC calls block eventlet's hub, whereas REST goes through monkey-patched sockets,
+    so this client is used when serving with eventlet workers.
+    """
+    @property
+    def _firestore_api(self):
+        if self._firestore_api_internal is None:
+            self._transport = FirestoreRestTransport(
+                host=self._target,
+                credentials=self._credentials,
+                client_info=self._client_info,
+                url_scheme="http" if self._emulator_host else "https",
+            )
+            self._firestore_api_internal = firestore_client.FirestoreClient(
+                transport=self._transport, client_options=self._client_options
+            )
+        return self._firestore_api_internal
 
 
 def start_firestore_project_client(project):
+    if os.getenv("FIRESTORE_TRANSPORT", "grpc").lower() == "rest":
+        return RestFirestoreClient(project=project)
     db = firestore.Client(project=project)
     return db
 
@@ -9,31 +57,437 @@ def start_firestore_project_client(project):
 def get_document_by_collection_and_id(db, collection_name, doc_id):
     collection = db.collection(collection_name)
     doc_ref = collection.document(doc_id)
-    doc = doc_ref.get()
+    with observe_firestore("read"):
+        doc = doc_ref.get()
     if doc.exists:
-        return doc.to_dict()
+        document = doc.to_dict()
+        record_firestore_payload("read", document)
+        return document
     else:
         raise ValueError(f"Document {doc_id} does not exist in {collection_name}")
 
 
 def save_document_in_collection(db, collection_name, document, doc_id=None):
     collection = db.collection(collection_name)
+    record_firestore_payload("write", document)
     
     if doc_id:
         doc_ref = collection.document(doc_id)
-        doc_ref.set(document)
+        with observe_firestore("write"):
+            doc_ref.set(document)
         return doc_id
     else:
-        doc_ref = collection.add(document)[0]
+        with observe_firestore("write"):
+            doc_ref = collection.add(document)[0]
         return doc_ref.id
 
 
 def update_document_in_collection(db, collection_name, document, doc_id):
     collection = db.collection(collection_name)
     
+    record_firestore_payload("update", document)
     try:
         doc_ref = collection.document(doc_id)
-        doc_ref.update(document)
+        with observe_firestore("update"):
+            doc_ref.update(document)
         return doc_id
     except:
         raise ValueError(f"Document {doc_id} does not exist in {collection_name}")
+
+
+def to_field_path_document(field_updates):
+    """
+    Convert field path tuples, e.g. ("nodes", node_id, "position"), to Firestore's dotted field paths
+    """
+    return {
+        FieldPath(*path).to_api_repr(): value
+        for path, value in field_updates.items()
+    }
+
+
+# Canvas storage.
+# A canvas' metadata (title, description, timestamps) lives in the canvases/{id} document, and each
+# node in a canvases/{id}/nodes/{node_id} document, so reads and writes only move the nodes they need
+# and canvases are not bound by the 1 MiB document limit.
+# Canvases saved before this keep their nodes in a `nodes` map on the canvas document, without the
+# `node_storage` marker. They are still read as is, and are migrated on their first node write
+# (or by running src.db.migrate_canvases). Every function returns and takes the same
+# {..., nodes: {<id>: node}} document shape as before.
+# Sharded canvases also keep a grid index of node rectangles in canvases/{id}/grid (see canvas_index.py),
+# updated along with their nodes and marked by `node_index` on the canvas document.
+
+
+def canvas_nodes_collection(db, collection_name, doc_id):
+    return db.collection(collection_name).document(doc_id).collection(CANVAS_NODES_COLLECTION)
+
+
+def is_sharded_canvas(canvas_doc) -> bool:
+    return canvas_doc.get("node_storage") == SHARDED_NODE_STORAGE
+
+
+def is_known_sharded_canvas(doc_id) -> bool:
+    with _sharded_lock:
+        return doc_id in _sharded_canvas_ids
+
+
+def mark_canvas_sharded(doc_id):
+    with _sharded_lock:
+        _sharded_canvas_ids[doc_id] = True
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Threads for concurrent Firestore reads and batch commits"""
+    global _executor
+    with _sharded_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("FIRESTORE_CONCURRENCY", 8)),
+                thread_name_prefix="firestore",
+            )
+        return _executor
+
+
+def commit_in_batches(db, writes, operation="batch_write", parallel=False):
+    """
+    Commit writes, given as (method, args, kwargs) of a write batch, FIRESTORE_BATCH_LIMIT per batch.
+    Only writes in the same batch are atomic. Batches are committed in order, or with parallel,
+    the first batch on its own and then the others concurrently.
+    """
+    batches = []
+    for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for method, args, kwargs in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+            getattr(batch, method)(*args, **kwargs)
+        batches.append(batch)
+
+    def commit(batch):
+        with observe_firestore(operation):
+            batch.commit()
+
+    if not parallel:
+        for batch in batches:
+            commit(batch)
+        return
+    if batches:
+        commit(batches[0])
+    for future in [get_executor().submit(commit, batch) for batch in batches[1:]]:
+        future.result()
+
+
+def grid_writes(grid_collection, nodes, stored_cells=None):
+    """
+    Writes bringing a canvas' grid index in line with its nodes map.
+    stored_cells maps the cells already stored to their entries, so only cells that differ are written.
+    """
+    stored_cells = stored_cells or {}
+    cells = build_grid(nodes)
+    writes = [
+        ("set", (grid_collection.document(cell_id), entries), {})
+        for cell_id, entries in cells.items() if stored_cells.get(cell_id) != entries
+    ]
+    writes += [("delete", (grid_collection.document(cell_id),), {}) for cell_id in set(stored_cells) - set(cells)]
+    return writes
+
+
+def replace_nodes_writes(canvas_ref, nodes):
+    """
+    Writes replacing every node of a canvas, and its grid index.
+    The stored nodes and grid cells are read first, so only the ones added, changed or deleted are written.
+    """
+    nodes_collection = canvas_ref.collection(CANVAS_NODES_COLLECTION)
+    grid_collection = canvas_ref.collection(CANVAS_GRID_COLLECTION)
+    executor = get_executor()
+    stored_nodes_future = executor.submit(read_canvas_nodes, nodes_collection)
+    stored_cells_future = executor.submit(read_grid_collection, grid_collection)
+
+    stored_nodes = stored_nodes_future.result()
+    writes = [
+        ("set", (nodes_collection.document(node_id), node), {})
+        for node_id, node in nodes.items() if stored_nodes.get(node_id) != node
+    ]
+    writes += [("delete", (nodes_collection.document(node_id),), {}) for node_id in set(stored_nodes) - set(nodes)]
+    return writes + grid_writes(grid_collection, nodes, stored_cells_future.result())
+
+
+def read_canvas_nodes(nodes_collection) -> dict:
+    with observe_firestore("read_nodes"):
+        nodes = {snapshot.id: snapshot.to_dict() for snapshot in nodes_collection.stream()}
+    record_firestore_payload("read_nodes", nodes)
+    return nodes
+
+
+def read_grid_collection(grid_collection) -> dict:
+    with observe_firestore("read_index"):
+        return {snapshot.id: snapshot.to_dict() for snapshot in grid_collection.stream()}
+
+
+def save_canvas_document(db, collection_name, canvas, nodes, doc_id):
+    """Create or overwrite a canvas: its metadata document and one document per node"""
+    canvas_ref = db.collection(collection_name).document(doc_id)
+    record_firestore_payload("write", canvas)
+    writes = [("set", (canvas_ref, {**canvas, "node_storage": SHARDED_NODE_STORAGE, "node_index": GRID_NODE_INDEX}), {})]
+    writes += replace_nodes_writes(canvas_ref, nodes)
+    commit_in_batches(db, writes, operation="write", parallel=True)
+    mark_canvas_sharded(doc_id)
+    return doc_id
+
+
+def get_canvas_document(db, collection_name, doc_id):
+    """Read a canvas with its nodes map, reading the canvas document and its nodes in parallel"""
+    canvas_ref = db.collection(collection_name).document(doc_id)
+    nodes_future = get_executor().submit(read_canvas_nodes, canvas_ref.collection(CANVAS_NODES_COLLECTION))
+    with observe_firestore("read"):
+        doc = canvas_ref.get()
+    if not doc.exists:
+        raise ValueError(f"Document {doc_id} does not exist in {collection_name}")
+
+    canvas_doc = doc.to_dict()
+    record_firestore_payload("read", canvas_doc)
+    if is_sharded_canvas(canvas_doc):
+        del canvas_doc["node_storage"]
+        canvas_doc.pop("node_index", None)
+        canvas_doc["nodes"] = nodes_future.result()
+        mark_canvas_sharded(doc_id)
+    return canvas_doc
+
+
+def build_canvas_index(db, canvas_ref, nodes):
+    """Build the grid index of a sharded canvas saved before the index existed"""
+    grid_collection = canvas_ref.collection(CANVAS_GRID_COLLECTION)
+    writes = grid_writes(grid_collection, nodes, read_grid_collection(grid_collection))
+    writes.append(("update", (canvas_ref, {"node_index": GRID_NODE_INDEX}), {}))
+    commit_in_batches(db, writes, operation="build_index")
+
+
+def read_grid_cells(db, grid_collection, grid_cell_ids) -> list:
+    with observe_firestore("read_index"):
+        snapshots = db.get_all([grid_collection.document(cell_id) for cell_id in grid_cell_ids])
+    return [snapshot.to_dict() for snapshot in snapshots if snapshot.exists]
+
+
+def get_canvas_viewport_document(db, collection_name, doc_id, viewport, field_paths=None, extra_node_ids=()):
+    """
+    Read a canvas with only the nodes whose rectangle intersects viewport, (min_x, min_y, max_x, max_y),
+    plus extra_node_ids. The grid cells covering the viewport are read along with the canvas document,
+    then only the matching nodes, limited to field_paths if given.
+    Canvases without a grid index, and viewports covering too many cells, are read in full,
+    so callers should still filter the nodes. A missing index is built on the way.
+    """
+    viewport_cells = viewport_cell_ids(viewport)
+    if viewport_cells is None:
+        return get_canvas_document(db, collection_name, doc_id)
+
+    canvas_ref = db.collection(collection_name).document(doc_id)
+    cells_future = get_executor().submit(read_grid_cells, db, canvas_ref.collection(CANVAS_GRID_COLLECTION), viewport_cells)
+    with observe_firestore("read"):
+        doc = canvas_ref.get()
+    if not doc.exists:
+        raise ValueError(f"Document {doc_id} does not exist in {collection_name}")
+
+    canvas_doc = doc.to_dict()
+    if not is_sharded_canvas(canvas_doc):
+        return canvas_doc
+    del canvas_doc["node_storage"]
+    mark_canvas_sharded(doc_id)
+    nodes_collection = canvas_ref.collection(CANVAS_NODES_COLLECTION)
+    if canvas_doc.pop("node_index", None) != GRID_NODE_INDEX:
+        canvas_doc["nodes"] = read_canvas_nodes(nodes_collection)
+        build_canvas_index(db, canvas_ref, canvas_doc["nodes"])
+        return canvas_doc
+
+    node_ids = {
+        node_id
+        for cell in cells_future.result()
+        for node_id, rect in cell.items()
+        if intersects(rect, viewport)
+    } | set(extra_node_ids)
+    canvas_doc["nodes"] = {}
+    if node_ids:
+        with observe_firestore("read_nodes"):
+            snapshots = db.get_all([nodes_collection.document(node_id) for node_id in node_ids], field_paths=field_paths)
+        canvas_doc["nodes"] = {snapshot.id: snapshot.to_dict() for snapshot in snapshots if snapshot.exists}
+    record_firestore_payload("read_nodes", canvas_doc["nodes"])
+    return canvas_doc
+
+
+def get_canvas_nodes(db, collection_name, doc_id, node_ids, field_paths=None) -> dict:
+    """Read some of a canvas' nodes, returning the ones that exist by id"""
+    if not node_ids:
+        return {}
+    nodes_collection = canvas_nodes_collection(db, collection_name, doc_id)
+    with observe_firestore("read_nodes"):
+        snapshots = db.get_all([nodes_collection.document(node_id) for node_id in node_ids], field_paths=field_paths)
+    nodes = {snapshot.id: snapshot.to_dict() for snapshot in snapshots if snapshot.exists}
+    if len(nodes) < len(set(node_ids)) and not is_known_sharded_canvas(doc_id):
+        canvas_doc = get_canvas_document(db, collection_name, doc_id)
+        nodes = {node_id: canvas_doc["nodes"][node_id] for node_id in node_ids if node_id in canvas_doc["nodes"]}
+    return nodes
+
+
+def migrate_canvas_document(db, collection_name, doc_id, max_attempts=3) -> bool:
+    """
+    Move a canvas' embedded nodes map into its nodes subcollection.
+    The canvas document is only switched over if it did not change since it was read;
+    with fewer than FIRESTORE_BATCH_LIMIT nodes the whole move is one atomic batch.
+    Returns whether the canvas was migrated, False if it already was.
+    """
+    canvas_ref = db.collection(collection_name).document(doc_id)
+    nodes_collection = canvas_ref.collection(CANVAS_NODES_COLLECTION)
+    for attempt in range(max_attempts):
+        with observe_firestore("read"):
+            snapshot = canvas_ref.get()
+        if not snapshot.exists:
+            raise ValueError(f"Document {doc_id} does not exist in {collection_name}")
+        canvas_doc = snapshot.to_dict()
+        if is_sharded_canvas(canvas_doc):
+            mark_canvas_sharded(doc_id)
+            return False
+
+        nodes = canvas_doc.get("nodes", {})
+        writes = [("set", (nodes_collection.document(node_id), node), {}) for node_id, node in nodes.items()]
+        writes += grid_writes(canvas_ref.collection(CANVAS_GRID_COLLECTION), nodes)
+        writes.append(("update", (canvas_ref, {
+            "nodes": DELETE_FIELD,
+            "node_storage": SHARDED_NODE_STORAGE,
+            "node_index": GRID_NODE_INDEX,
+        }), {
+            "option": db.write_option(last_update_time=snapshot.update_time),
+        }))
+        try:
+            commit_in_batches(db, writes, operation="migrate")
+        except google_exceptions.FailedPrecondition:
+            continue
+        mark_canvas_sharded(doc_id)
+        return True
+    raise RuntimeError(f"Canvas {doc_id} kept changing during its migration")
+
+
+def ensure_canvases_sharded(db, collection_name, doc_ids):
+    """Migrate canvases whose nodes are still embedded, checking each canvas once per process"""
+    unknown_doc_ids = [doc_id for doc_id in doc_ids if not is_known_sharded_canvas(doc_id)]
+    if not unknown_doc_ids:
+        return
+    collection = db.collection(collection_name)
+    with observe_firestore("read"):
+        snapshots = db.get_all([collection.document(doc_id) for doc_id in unknown_doc_ids])
+    for snapshot in snapshots:
+        if not snapshot.exists:
+            continue
+        if is_sharded_canvas(snapshot.to_dict()):
+            mark_canvas_sharded(snapshot.id)
+        else:
+            migrate_canvas_document(db, collection_name, snapshot.id)
+
+
+def set_nested_field(document, path, value):
+    for field in path[:-1]:
+        document = document.setdefault(field, {})
+    document[path[-1]] = value
+
+
+def update_canvases_in_batch(db, collection_name, field_updates_by_doc_id):
+    """
+    Apply field path updates to several canvases, e.g. {("nodes", node_id, "position"): {...}}.
+    Updates below ("nodes", <id>) go to that node's document, ("nodes",) replaces every node,
+    and other fields update the canvas document. Both the canvas document and the nodes given partial
+    updates must exist, otherwise NotFound is raised.
+    Nodes that are added, removed, moved or resized are moved in the grid index too.
+    Canvas documents are written in the first batch, so a missing canvas fails before any node is written.
+    """
+    collection = db.collection(collection_name)
+    ensure_canvases_sharded(db, collection_name, [
+        doc_id for doc_id, field_updates in field_updates_by_doc_id.items()
+        if any(path[0] == "nodes" for path in field_updates)
+    ])
+
+    canvas_writes = []
+    node_writes = []
+    # (doc_id, node_id): the node set, {} once deleted, or its changed position/measured fields by path
+    node_geometry = {}
+    for doc_id, field_updates in field_updates_by_doc_id.items():
+        canvas_ref = collection.document(doc_id)
+        nodes_collection = canvas_ref.collection(CANVAS_NODES_COLLECTION)
+        canvas_fields = {}
+        node_fields = {}
+        for path, value in field_updates.items():
+            if path[0] != "nodes":
+                canvas_fields[path] = value
+            elif len(path) == 1:
+                node_writes += replace_nodes_writes(canvas_ref, value)
+                canvas_fields[("node_index",)] = GRID_NODE_INDEX
+            elif len(path) == 2:
+                node_ref = nodes_collection.document(path[1])
+                node_writes.append(("delete", (node_ref,), {}) if value is DELETE_FIELD else ("set", (node_ref, value), {}))
+                node_geometry[(doc_id, path[1])] = ("set", {} if value is DELETE_FIELD else value)
+            else:
+                node_fields.setdefault(path[1], {})[path[2:]] = value
+                if path[2] in ("position", "measured"):
+                    kind, geometry = node_geometry.setdefault((doc_id, path[1]), ("update", {}))
+                    if kind == "update":
+                        geometry[path[2:]] = value
+
+        # partial node updates become one update per node, writing only the given fields;
+        # the node must exist, so an update cannot create a node without its type and data
+        for node_id, fields in node_fields.items():
+            node_writes.append(("update", (nodes_collection.document(node_id), to_field_path_document(fields)), {}))
+        if canvas_fields:
+            canvas_document = to_field_path_document(canvas_fields)
+            record_firestore_payload("update", canvas_document)
+            canvas_writes.append(("update", (canvas_ref, canvas_document), {}))
+
+    index_writes = grid_update_writes(db, collection, node_geometry)
+    commit_in_batches(db, canvas_writes + node_writes + index_writes, parallel=True)
+    return list(field_updates_by_doc_id)
+
+
+def grid_update_writes(db, collection, node_geometry):
+    """
+    Writes moving nodes between grid cells. The current rectangles of the nodes are read
+    in one round trip, to find the cells they leave.
+    """
+    if not node_geometry:
+        return []
+    node_refs = [
+        collection.document(doc_id).collection(CANVAS_NODES_COLLECTION).document(node_id)
+        for doc_id, node_id in node_geometry
+    ]
+    with observe_firestore("read_index"):
+        snapshots = db.get_all(node_refs, field_paths=["position", "measured"])
+    current_nodes = {
+        (snapshot.reference.parent.parent.id, snapshot.id): snapshot.to_dict()
+        for snapshot in snapshots if snapshot.exists
+    }
+
+    cell_entries = {}
+    for (doc_id, node_id), (kind, geometry) in node_geometry.items():
+        current_node = current_nodes.get((doc_id, node_id)) or {}
+        if kind == "set":
+            new_rect = node_rect(geometry)
+        else:
+            node = {field: current_node[field] for field in ("position", "measured") if field in current_node}
+            for path, value in geometry.items():
+                set_nested_field(node, path, value)
+            new_rect = node_rect(node)
+        current_rect = node_rect(current_node)
+        if new_rect == current_rect:
+            continue
+        for cell_id in cell_ids(current_rect) - cell_ids(new_rect):
+            cell_entries.setdefault((doc_id, cell_id), {})[node_id] = DELETE_FIELD
+        for cell_id in cell_ids(new_rect):
+            cell_entries.setdefault((doc_id, cell_id), {})[node_id] = new_rect
+
+    return [
+        ("set", (collection.document(doc_id).collection(CANVAS_GRID_COLLECTION).document(cell_id), entries), {
+            "merge": [FieldPath(node_id).to_api_repr() for node_id in entries],
+        })
+        for (doc_id, cell_id), entries in cell_entries.items()
+    ]
+
+
+def update_canvas_fields(db, collection_name, field_updates, doc_id):
+    """Apply field path updates to one canvas, see update_canvases_in_batch"""
+    try:
+        update_canvases_in_batch(db, collection_name, {doc_id: field_updates})
+    except google_exceptions.NotFound:
+        raise ValueError(f"Document {doc_id} or one of its updated nodes does not exist in {collection_name}")
+    return doc_id
@@ -0,0 +1,37 @@
+import threading
+
+
+class LazyClient:
+    """
+    Stand-in for a datastore client that is only built on first use,
+    so creating it does not slow down app start.
+    Attribute access is forwarded to the built client. warm_up() builds it
+    in a background thread, so the first request usually finds it ready.
+    """
+    def __init__(self, factory, name="client"):
+        self._factory = factory
+        self._name = name
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def warm_up(self):
+        def build():
+            try:
+                self.get()
+                print(f"Initialized {self._name} client")
+            except Exception as e:
+                print(f"Failed to initialize {self._name} client, retrying on first use: {e}")
+
+        thread = threading.Thread(target=build, name=f"{self._name}-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
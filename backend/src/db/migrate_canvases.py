@@ -0,0 +1,59 @@
+"""
+Move the nodes of canvases saved before node sharding out of the canvas document's `nodes` map
+and into its canvases/{id}/nodes subcollection (see src/db/firestore.py),
+and build the grid index of sharded canvases saved before it existed.
+Canvases are also migrated on their first node write, and indexed on their first viewport load,
+so this only finishes the migration early. Migrated canvases are skipped, so it can be run again safely.
+
+Run from backend/:
+    python -m src.db.migrate_canvases [--dry-run]
+"""
+import argparse
+import os
+from dotenv import load_dotenv
+
+from src.db.firestore import (
+    CANVAS_NODES_COLLECTION,
+    GRID_NODE_INDEX,
+    build_canvas_index,
+    is_sharded_canvas,
+    migrate_canvas_document,
+    read_canvas_nodes,
+    start_firestore_project_client,
+)
+
+
+def migrate_canvases(db, collection_name="canvases", dry_run=False) -> dict:
+    counts = {"canvases": 0, "migrated": 0, "indexed": 0, "failed": 0}
+    collection = db.collection(collection_name)
+    for snapshot in collection.select(["node_storage", "node_index"]).stream():
+        counts["canvases"] += 1
+        canvas_doc = snapshot.to_dict()
+        if is_sharded_canvas(canvas_doc) and canvas_doc.get("node_index") == GRID_NODE_INDEX:
+            continue
+        if dry_run:
+            counts["indexed" if is_sharded_canvas(canvas_doc) else "migrated"] += 1
+            continue
+        try:
+            if is_sharded_canvas(canvas_doc):
+                canvas_ref = collection.document(snapshot.id)
+                build_canvas_index(db, canvas_ref, read_canvas_nodes(canvas_ref.collection(CANVAS_NODES_COLLECTION)))
+                counts["indexed"] += 1
+            else:
+                counts["migrated"] += int(migrate_canvas_document(db, collection_name, snapshot.id))
+        except Exception as e:
+            counts["failed"] += 1
+            print(f"Failed to migrate canvas {snapshot.id}: {e}")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="only count the canvases to migrate or index")
+    args = parser.parse_args()
+
+    env = os.environ.get("FLASK_ENV", "local")
+    load_dotenv({"production": ".env.production", "local": ".env.local"}.get(env, ".env"))
+
+    db = start_firestore_project_client(os.environ["GCP_PROJECT"])
+    print(migrate_canvases(db, dry_run=args.dry_run))
@@ -0,0 +1,136 @@
+import json
+import os
+import time
+import redis as redis_lib
+
+from src.db.redis_scripts import INDEX_NODE_PARENTS_SCRIPT, MARK_STALE_SCRIPT, get_script
+from src.structured_log import log_event
+
+
+# Next to the parent_ids of every node:{id} hash, Redis keeps the reverse edges:
+# - node:{id}:children: set of the ids of nodes listing the node as a parent
+# - stale_nodes: zset of stale node ids, scored by the time they were marked, for the refresher
+# A node whose inputs or ancestors changed since its response was generated has a `stale` field
+# holding the time it was marked. Writing a new prompt_response clears it.
+STALE_NODES_KEY = "stale_nodes"
+# node hash fields that feed a node's response, and the response itself, as stored in Redis
+SYNCED_NODE_FIELDS = ["model", "prompt", "parent_ids", "prompt_response"]
+
+
+def is_stale_tracking_enabled() -> bool:
+    return os.getenv("ENABLE_STALE_TRACKING", "false").lower() == "true"
+
+
+def index_node_parents(r_client, node_id, parent_ids):
+    """
+    Update the children sets of a node's old and new parents. Must be queued before
+    the node's new parent_ids are written. r_client may be a pipeline.
+    """
+    script = get_script(r_client, INDEX_NODE_PARENTS_SCRIPT)
+    return script(keys=[], args=[node_id, json.dumps(parent_ids)], client=r_client)
+
+
+def clear_node_stale(r_client, node_id):
+    """Queue clearing a node's stale mark, e.g. along with its new response. r_client may be a pipeline."""
+    r_client.hdel(f"node:{node_id}", "stale")
+    r_client.zrem(STALE_NODES_KEY, node_id)
+
+
+def mark_descendants_stale(r_client, node_ids, skip_node_ids=(), include_nodes=False):
+    """
+    Mark every descendant of node_ids stale, and node_ids themselves with include_nodes,
+    in one server-side walk of the children sets, notifying each marked node's subscribers.
+    Nodes in skip_node_ids are walked through but not marked, e.g. nodes just recomputed.
+    Returns the ids newly marked, or queues the script if r_client is a pipeline.
+    """
+    if not node_ids:
+        return []
+    script = get_script(r_client, MARK_STALE_SCRIPT)
+    marked = script(
+        keys=[STALE_NODES_KEY],
+        args=[
+            json.dumps(list(node_ids)),
+            json.dumps(list(skip_node_ids)),
+            "1" if include_nodes else "0",
+            int(time.time() * 1000),
+        ],
+        client=r_client,
+    )
+    if isinstance(r_client, redis_lib.client.Pipeline):
+        return marked
+    return [node_id.decode("utf-8") for node_id in marked]
+
+
+def sync_canvas_nodes(r_client, node_changes, canvas_id=None) -> list:
+    """
+    Copy saved node changes to their node:{id} hashes and mark what they made stale.
+    node_changes maps node id to its (possibly partial) node data, or None if the node was deleted.
+    - A new prompt_response clears the node's stale mark, and marks its descendants stale.
+    - A new model, prompt or parent_ids marks the node and its descendants stale,
+      unless a new prompt_response was saved along with them.
+    - Deleting a node marks its descendants stale.
+    Only fields that differ from the stored ones are written. Partial changes to nodes not stored yet
+    are skipped, as the stored node would lack its model or prompt. Returns the ids newly marked stale.
+    """
+    node_ids = list(node_changes)
+    pipe = r_client.pipeline(transaction=False)
+    for node_id in node_ids:
+        pipe.hmget(f"node:{node_id}", SYNCED_NODE_FIELDS)
+    stored_nodes = {
+        node_id: dict(zip(SYNCED_NODE_FIELDS, [value.decode("utf-8") if value is not None else None for value in values]))
+        for node_id, values in zip(node_ids, pipe.execute())
+    }
+
+    changed_node_ids = []
+    stale_node_ids = []
+    fresh_node_ids = []
+    pipe = r_client.pipeline()
+    for node_id, data in node_changes.items():
+        stored = stored_nodes[node_id]
+        if data is None:
+            if stored["parent_ids"] is not None:
+                index_node_parents(pipe, node_id, [])
+                pipe.hdel(f"node:{node_id}", "parent_ids")
+                changed_node_ids.append(node_id)
+            continue
+
+        fields = {}
+        for field in SYNCED_NODE_FIELDS:
+            if field not in data:
+                continue
+            value = json.dumps(data[field]) if field == "parent_ids" else data[field]
+            if value != stored[field]:
+                fields[field] = value
+        if not fields:
+            continue
+        # chains read model and prompt from every stored node, so never store a node without them
+        if any(fields.get(field, stored[field]) is None for field in ["model", "prompt"]):
+            continue
+
+        if "parent_ids" in fields:
+            index_node_parents(pipe, node_id, data["parent_ids"])
+        if canvas_id:
+            fields["canvas_id"] = canvas_id
+        pipe.hset(f"node:{node_id}", mapping=fields)
+        changed_node_ids.append(node_id)
+        if "prompt_response" in fields:
+            clear_node_stale(pipe, node_id)
+            fresh_node_ids.append(node_id)
+        elif any(field in fields for field in ["model", "prompt", "parent_ids"]):
+            stale_node_ids.append(node_id)
+
+    if not changed_node_ids:
+        return []
+    # marks for nodes whose inputs changed, then for the descendants of the other changed nodes
+    mark_groups = [
+        (stale_node_ids, True),
+        ([node_id for node_id in changed_node_ids if node_id not in stale_node_ids], False),
+    ]
+    mark_groups = [(group, include_nodes) for group, include_nodes in mark_groups if group]
+    for group, include_nodes in mark_groups:
+        mark_descendants_stale(pipe, group, skip_node_ids=fresh_node_ids, include_nodes=include_nodes)
+    results = pipe.execute()
+
+    marked = [node_id.decode("utf-8") for result in results[len(results) - len(mark_groups):] for node_id in result]
+    log_event("nodes_synced", canvas_id=canvas_id, changed=len(changed_node_ids), marked_stale=len(marked))
+    return marked
@@ -0,0 +1,326 @@
+"""Lua scripts run server-side in Redis, so a whole node graph walk costs one round trip"""
+
+
+# ARGV[1]: node id, ARGV[2]: JSON array of parent ids to start from ("" to read them from the node),
+# ARGV[3]: JSON array of node hash fields to return.
+# Returns the ancestors of the node (excluding the node itself) in topological order,
+# each as an array of [id, field values...]. Nodes missing from Redis are skipped.
+ANCESTOR_NODES_SCRIPT = """
+local node_id = ARGV[1]
+local fields = cjson.decode(ARGV[3])
+local parent_field_index = nil
+for i, field in ipairs(fields) do
+    if field == 'parent_ids' then
+        parent_field_index = i
+    end
+end
+
+local seed_ids
+if ARGV[2] ~= '' then
+    seed_ids = cjson.decode(ARGV[2])
+else
+    local stored = redis.call('HGET', 'node:' .. node_id, 'parent_ids')
+    seed_ids = stored and cjson.decode(stored) or {}
+end
+
+local visited = {[node_id] = true}
+local ancestors = {}
+local stack = {}
+for i = #seed_ids, 1, -1 do
+    table.insert(stack, {id = seed_ids[i], expanded = false})
+end
+
+while #stack > 0 do
+    local top = stack[#stack]
+    if top.expanded then
+        -- every parent has been emitted, so the node can be emitted
+        table.remove(stack)
+        local row = {top.id}
+        for i, value in ipairs(top.values) do
+            row[i + 1] = value
+        end
+        table.insert(ancestors, row)
+    elseif visited[top.id] or redis.call('EXISTS', 'node:' .. top.id) == 0 then
+        table.remove(stack)
+    else
+        visited[top.id] = true
+        top.expanded = true
+        top.values = redis.call('HMGET', 'node:' .. top.id, unpack(fields))
+        local parent_ids = {}
+        if parent_field_index and top.values[parent_field_index] then
+            parent_ids = cjson.decode(top.values[parent_field_index])
+        end
+        -- push in reverse so the first parent is walked first
+        for i = #parent_ids, 1, -1 do
+            table.insert(stack, {id = parent_ids[i], expanded = false})
+        end
+    end
+end
+
+return ancestors
+"""
+
+
+# ARGV[1]: node id, ARGV[2]: JSON array of the node's new parent ids.
+# Moves the node between the node:{id}:children sets of its old and new parents.
+# Runs before the new parent_ids are written to the node hash, which it reads the old ones from.
+INDEX_NODE_PARENTS_SCRIPT = """
+local node_id = ARGV[1]
+local stored = redis.call('HGET', 'node:' .. node_id, 'parent_ids')
+local old_parent_ids = stored and cjson.decode(stored) or {}
+local new_parent_ids = cjson.decode(ARGV[2])
+local kept = {}
+for _, parent_id in ipairs(new_parent_ids) do
+    kept[parent_id] = true
+    redis.call('SADD', 'node:' .. parent_id .. ':children', node_id)
+end
+for _, parent_id in ipairs(old_parent_ids) do
+    if not kept[parent_id] then
+        redis.call('SREM', 'node:' .. parent_id .. ':children', node_id)
+    end
+end
+return #new_parent_ids
+"""
+
+
+# KEYS[1]: stale nodes zset. ARGV[1]: JSON array of node ids, ARGV[2]: JSON array of node ids not to mark,
+# ARGV[3]: "1" to mark the given nodes as well as their descendants, ARGV[4]: now in ms.
+# Walks node:{id}:children breadth first and marks every descendant stale: sets its `stale` field,
+# queues it for refresh and publishes {nodeId, canvasId, stale: true} to its update channels.
+# Nodes that are already stale are walked but not marked again. Returns the ids newly marked.
+MARK_STALE_SCRIPT = """
+local skipped = {}
+for _, node_id in ipairs(cjson.decode(ARGV[2])) do
+    skipped[node_id] = true
+end
+
+local marked = {}
+local function mark(node_id)
+    local node_key = 'node:' .. node_id
+    if skipped[node_id] or redis.call('EXISTS', node_key) == 0 or redis.call('HEXISTS', node_key, 'stale') == 1 then
+        return
+    end
+    redis.call('HSET', node_key, 'stale', ARGV[4])
+    redis.call('ZADD', KEYS[1], 'NX', ARGV[4], node_id)
+    local canvas_id = redis.call('HGET', node_key, 'canvas_id')
+    local message = cjson.encode({nodeId = node_key, canvasId = canvas_id or cjson.null, stale = true})
+    redis.call('PUBLISH', node_key .. ':update', message)
+    if canvas_id then
+        redis.call('PUBLISH', 'canvas:' .. canvas_id .. ':update', message)
+    end
+    table.insert(marked, node_id)
+end
+
+local visited = {}
+local queue = {}
+for _, node_id in ipairs(cjson.decode(ARGV[1])) do
+    if not visited[node_id] then
+        visited[node_id] = true
+        table.insert(queue, node_id)
+        if ARGV[3] == '1' then
+            mark(node_id)
+        end
+    end
+end
+
+local head = 1
+while head <= #queue do
+    local node_id = queue[head]
+    head = head + 1
+    for _, child_id in ipairs(redis.call('SMEMBERS', 'node:' .. node_id .. ':children')) do
+        if not visited[child_id] then
+            visited[child_id] = true
+            mark(child_id)
+            table.insert(queue, child_id)
+        end
+    end
+end
+
+return marked
+"""
+
+
+# KEYS[1]: node hash. ARGV: field, value pairs.
+# Sets the fields only if the node is stored, so annotations never create a partial node. Returns 1 if set.
+HSET_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+
+# KEYS[1]: pool zset, KEYS[2]: served zset. ARGV[1]: oldest score to keep (ms), ARGV[2]: now in ms,
+# ARGV[3]: pool capacity, ARGV[4]: JSON array of suggestions.
+# Drops expired entries, then adds suggestions that are neither pooled nor recently served,
+# until the pool is at capacity. Returns {added, pool size}.
+ADD_SUGGESTIONS_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[1])
+local size = redis.call('ZCARD', KEYS[1])
+local added = 0
+for _, suggestion in ipairs(cjson.decode(ARGV[4])) do
+    if size >= tonumber(ARGV[3]) then
+        break
+    end
+    if not redis.call('ZSCORE', KEYS[2], suggestion) and redis.call('ZADD', KEYS[1], 'NX', ARGV[2], suggestion) == 1 then
+        added = added + 1
+        size = size + 1
+    end
+end
+return {added, size}
+"""
+
+
+# KEYS[1]: pool zset, KEYS[2]: served zset, KEYS[3]: refiller wake-up list.
+# ARGV[1]: oldest score to keep (ms), ARGV[2]: now in ms, ARGV[3]: low watermark.
+# Drops expired entries and pops the oldest suggestion, remembering it as served.
+# Leaves a single wake-up in the list once the pool is below the low watermark.
+# Returns {pool size, suggestion}, or {0} if the pool is empty.
+POP_SUGGESTION_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+local popped = redis.call('ZPOPMIN', KEYS[1])
+local size = redis.call('ZCARD', KEYS[1])
+if size < tonumber(ARGV[3]) then
+    redis.call('LPUSH', KEYS[3], 1)
+    redis.call('LTRIM', KEYS[3], 0, 0)
+end
+if #popped == 0 then
+    return {0}
+end
+redis.call('ZADD', KEYS[2], ARGV[2], popped[1])
+return {size, popped[1]}
+"""
+
+
+# KEYS[1]: lock key, ARGV[1]: owner token, ARGV[2]: ttl in milliseconds.
+# Acquires the lock if free, or extends it if the token already owns it. Returns 1 if owned.
+ACQUIRE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+
+# KEYS[1]: lock key, ARGV[1]: owner token. Releases the lock only if the token owns it.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+# KEYS[1]: queue zset, KEYS[2]: delayed zset, KEYS[3]: job hash, KEYS[4]: stats hash.
+# ARGV[1]: admission limit on queued + delayed jobs, ARGV[2]: queue score, ARGV[3]: JSON job fields.
+# Stores and queues the job unless the queue is at the limit. Returns 1 if queued, 0 if rejected.
+ENQUEUE_JOB_SCRIPT = """
+local depth = redis.call('ZCARD', KEYS[1]) + redis.call('ZCARD', KEYS[2])
+if depth >= tonumber(ARGV[1]) then
+    redis.call('HINCRBY', KEYS[4], 'rejected', 1)
+    return 0
+end
+local fields = cjson.decode(ARGV[3])
+for field, value in pairs(fields) do
+    redis.call('HSET', KEYS[3], field, value)
+end
+redis.call('ZADD', KEYS[1], ARGV[2], fields['id'])
+redis.call('HINCRBY', KEYS[4], 'enqueued', 1)
+return 1
+"""
+
+
+# KEYS[1]: queue zset, KEYS[2]: running zset, KEYS[3]: stats hash.
+# ARGV[1]: now in ms, ARGV[2]: lease in ms, ARGV[3]: job hash key prefix.
+# Moves the highest priority job to the running set under a lease. Returns its id, or nil.
+CLAIM_JOB_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return nil
+end
+local job_id = popped[1]
+local job_key = ARGV[3] .. job_id
+local now = tonumber(ARGV[1])
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), job_id)
+redis.call('HSET', job_key, 'status', 'running', 'started_at', ARGV[1])
+redis.call('HINCRBY', job_key, 'attempts', 1)
+local enqueued_at = tonumber(redis.call('HGET', job_key, 'enqueued_at') or ARGV[1])
+redis.call('HINCRBY', KEYS[3], 'started', 1)
+redis.call('HINCRBYFLOAT', KEYS[3], 'wait_ms', now - enqueued_at)
+return job_id
+"""
+
+
+# KEYS[1]: running zset, KEYS[2]: delayed zset, KEYS[3]: job hash, KEYS[4]: stats hash.
+# ARGV[1]: job id, ARGV[2]: JSON job fields to set, ARGV[3]: stats counter to increment,
+# ARGV[4]: score to delay the job for a retry at, or "" when it is finished.
+# Applies only while the job still holds its lease. Returns 1 if applied, 0 if the lease was lost.
+FINISH_JOB_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+local fields = cjson.decode(ARGV[2])
+for field, value in pairs(fields) do
+    redis.call('HSET', KEYS[3], field, value)
+end
+if ARGV[4] ~= '' then
+    redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+end
+redis.call('HINCRBY', KEYS[4], ARGV[3], 1)
+return 1
+"""
+
+
+# KEYS[1]: queue zset, KEYS[2]: running zset, KEYS[3]: delayed zset, KEYS[4]: stats hash.
+# ARGV[1]: now in ms, ARGV[2]: job hash key prefix, ARGV[3]: queue score per priority level.
+# Requeues jobs whose lease expired (or fails them once out of attempts) and queues due retries.
+# Returns the number of jobs moved.
+REAP_JOBS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local moved = 0
+
+local function requeue(job_id, job_key)
+    local priority = tonumber(redis.call('HGET', job_key, 'priority') or 1)
+    redis.call('ZADD', KEYS[1], priority * tonumber(ARGV[3]) + now, job_id)
+    redis.call('HSET', job_key, 'status', 'queued', 'enqueued_at', ARGV[1])
+end
+
+for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    local job_key = ARGV[2] .. job_id
+    redis.call('ZREM', KEYS[2], job_id)
+    local attempts = tonumber(redis.call('HGET', job_key, 'attempts') or 0)
+    local max_attempts = tonumber(redis.call('HGET', job_key, 'max_attempts') or 1)
+    if attempts >= max_attempts then
+        redis.call('HSET', job_key, 'status', 'failed', 'error', 'Lease expired', 'finished_at', ARGV[1])
+        redis.call('HINCRBY', KEYS[4], 'failed', 1)
+    else
+        requeue(job_id, job_key)
+        redis.call('HINCRBY', KEYS[4], 'lease_expired', 1)
+    end
+    moved = moved + 1
+end
+
+for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)) do
+    redis.call('ZREM', KEYS[3], job_id)
+    requeue(job_id, ARGV[2] .. job_id)
+    moved = moved + 1
+end
+
+return moved
+"""
+
+
+_registered_scripts = {}
+
+
+def get_script(redis, source):
+    """Register a Lua script once per process; the returned Script runs via EVALSHA"""
+    if source not in _registered_scripts:
+        _registered_scripts[source] = redis.register_script(source)
+    return _registered_scripts[source]
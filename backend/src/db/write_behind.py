@@ -0,0 +1,255 @@
+import json
+import os
+import threading
+from datetime import datetime
+from google.api_core import exceptions as google_exceptions
+
+from src.db.firestore import DELETE_FIELD, FIRESTORE_BATCH_LIMIT, update_canvases_in_batch
+
+
+DELETED = {"__delete__": True}
+
+
+class CanvasWriteBuffer:
+    """
+    Write-behind buffer for canvas documents.
+    Mutations are staged in Redis as field path updates, where a newer update to the same field
+    (or a parent of it) replaces the older one. A background thread flushes staged canvases
+    to Firestore in batched writes every flush_interval seconds, or sooner once max_pending
+    mutations are waiting.
+
+    Redis layout:
+    - canvas_buffer:{canvas_id}: hash of JSON field path -> JSON value
+    - canvas_buffer:dirty: set of canvas ids with staged mutations
+    - canvas_buffer:stats: counters used to report write amplification
+    """
+    def __init__(self, db, redis, collection_name="canvases", flush_interval=None, max_pending=None):
+        self.db = db
+        self.redis = redis
+        self.collection_name = collection_name
+        self.flush_interval = flush_interval or float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 2))
+        self.max_pending = max_pending or int(os.getenv("WRITE_BEHIND_MAX_PENDING", 200))
+
+        self.namespace = "canvas_buffer"
+        self.dirty_key = f"{self.namespace}:dirty"
+        self.pending_key = f"{self.namespace}:pending"
+        self.stats_key = f"{self.namespace}:stats"
+        self.flush_lock_key = f"{self.namespace}:flush_lock"
+
+        self.flush_requested = threading.Event()
+        self.stop_signal = threading.Event()
+        self.thread = None
+
+    def stage(self, canvas_id, field_updates):
+        """
+        Stage field path updates, e.g. {("nodes", node_id, "position"): {...}}, for a canvas
+        """
+        if not field_updates:
+            return
+        buffer_key = self._buffer_key(canvas_id)
+
+        def merge_into_buffer(pipe):
+            staged = self._decode(pipe.hgetall(buffer_key))
+            fields_to_set, fields_to_delete = merge_field_updates(staged, field_updates)
+            pipe.multi()
+            if fields_to_delete:
+                pipe.hdel(buffer_key, *[json.dumps(path) for path in fields_to_delete])
+            pipe.hset(buffer_key, mapping={
+                json.dumps(path): json.dumps(encode_value(value))
+                for path, value in fields_to_set.items()
+            })
+            pipe.sadd(self.dirty_key, canvas_id)
+            pipe.incr(self.pending_key)
+            pipe.hincrby(self.stats_key, "staged_requests", 1)
+            pipe.hincrby(self.stats_key, "staged_fields", len(field_updates))
+
+        results = self.redis.transaction(merge_into_buffer, buffer_key)
+        pending = results[-3]
+        if pending >= self.max_pending:
+            self.flush_requested.set()
+
+    def get_staged_updates(self, canvas_id):
+        return self._decode(self.redis.hgetall(self._buffer_key(canvas_id)))
+
+    def discard(self, canvas_id):
+        """Drop staged mutations, e.g. after the whole document was overwritten"""
+        pipe = self.redis.pipeline()
+        pipe.delete(self._buffer_key(canvas_id))
+        pipe.srem(self.dirty_key, canvas_id)
+        pipe.execute()
+
+    def flush(self):
+        """
+        Write every staged canvas to Firestore. Returns the number of documents written.
+        Staged fields are only removed from Redis once committed, and only if they were not
+        updated again in the meantime, so readers never miss a mutation.
+        """
+        lock_timeout_ms = int(max(self.flush_interval * 10, 30) * 1000)
+        if not self.redis.set(self.flush_lock_key, 1, nx=True, px=lock_timeout_ms):
+            return 0
+
+        try:
+            self.redis.set(self.pending_key, 0)
+            canvas_ids = [canvas_id.decode('utf-8') for canvas_id in self.redis.smembers(self.dirty_key)]
+            written = 0
+            for start in range(0, len(canvas_ids), FIRESTORE_BATCH_LIMIT):
+                written += self._flush_batch(canvas_ids[start:start + FIRESTORE_BATCH_LIMIT])
+            return written
+        finally:
+            self.redis.delete(self.flush_lock_key)
+
+    def get_stats(self) -> dict:
+        stats = {k.decode('utf-8'): int(v) for k, v in self.redis.hgetall(self.stats_key).items()}
+        staged_requests = stats.get("staged_requests", 0)
+        firestore_writes = stats.get("firestore_writes", 0)
+        stats["pending_canvases"] = self.redis.scard(self.dirty_key)
+        stats["write_reduction"] = round(staged_requests / firestore_writes, 2) if firestore_writes else None
+        return stats
+
+    def start(self):
+        self.stop_signal.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the flush thread and force a final flush"""
+        self.stop_signal.set()
+        self.flush_requested.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        while not self.stop_signal.is_set():
+            self.flush_requested.wait(timeout=self.flush_interval)
+            self.flush_requested.clear()
+            if self.stop_signal.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed: {e}")
+
+    def _flush_batch(self, canvas_ids):
+        pipe = self.redis.pipeline(transaction=False)
+        for canvas_id in canvas_ids:
+            pipe.hgetall(self._buffer_key(canvas_id))
+        raw_buffers = dict(zip(canvas_ids, pipe.execute()))
+
+        field_updates_by_canvas_id = {}
+        for canvas_id, raw_buffer in raw_buffers.items():
+            if raw_buffer:
+                field_updates = self._decode(raw_buffer)
+                field_updates[("updated_at",)] = datetime.now()
+                field_updates_by_canvas_id[canvas_id] = field_updates
+
+        if field_updates_by_canvas_id:
+            try:
+                update_canvases_in_batch(self.db, self.collection_name, field_updates_by_canvas_id)
+            except google_exceptions.NotFound as e:
+                # A batch fails as a whole, so retry canvases one by one and drop the missing ones
+                for canvas_id, field_updates in field_updates_by_canvas_id.items():
+                    try:
+                        update_canvases_in_batch(self.db, self.collection_name, {canvas_id: field_updates})
+                    except google_exceptions.NotFound:
+                        print(f"Dropping staged mutations for missing canvas {canvas_id}")
+                        self.discard(canvas_id)
+                        raw_buffers[canvas_id] = {}
+                        field_updates_by_canvas_id[canvas_id] = None
+                field_updates_by_canvas_id = {
+                    canvas_id: field_updates
+                    for canvas_id, field_updates in field_updates_by_canvas_id.items()
+                    if field_updates is not None
+                }
+
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hincrby(self.stats_key, "firestore_writes", len(field_updates_by_canvas_id))
+            pipe.hincrby(self.stats_key, "firestore_commits", 1)
+            pipe.execute()
+
+        for canvas_id, raw_buffer in raw_buffers.items():
+            self._remove_flushed(canvas_id, raw_buffer)
+        return len(field_updates_by_canvas_id)
+
+    def _remove_flushed(self, canvas_id, flushed_buffer):
+        buffer_key = self._buffer_key(canvas_id)
+
+        def remove_unchanged_fields(pipe):
+            current_buffer = pipe.hgetall(buffer_key)
+            flushed_fields = [
+                field for field, value in flushed_buffer.items()
+                if current_buffer.get(field) == value
+            ]
+            pipe.multi()
+            if flushed_fields:
+                pipe.hdel(buffer_key, *flushed_fields)
+            if len(flushed_fields) == len(current_buffer):
+                pipe.srem(self.dirty_key, canvas_id)
+
+        self.redis.transaction(remove_unchanged_fields, buffer_key)
+
+    def _buffer_key(self, canvas_id):
+        return f"{self.namespace}:{canvas_id}"
+
+    def _decode(self, raw_buffer):
+        return {
+            tuple(json.loads(path)): decode_value(json.loads(value))
+            for path, value in raw_buffer.items()
+        }
+
+
+def encode_value(value):
+    return DELETED if value is DELETE_FIELD else value
+
+
+def decode_value(value):
+    return DELETE_FIELD if value == DELETED else value
+
+
+def merge_field_updates(staged, field_updates):
+    """
+    Merge new field path updates into the staged ones, in place.
+    An update nested under a staged path is folded into that path's value, and
+    an update to a path replaces every staged path below it.
+    Returns (fields_to_set, fields_to_delete).
+    """
+    fields_to_set = {}
+    fields_to_delete = set()
+    for path, value in field_updates.items():
+        staged_ancestor = next(
+            (path[:i] for i in range(1, len(path)) if path[:i] in staged),
+            None,
+        )
+        if staged_ancestor is not None:
+            ancestor_value = staged[staged_ancestor]
+            if not isinstance(ancestor_value, dict):
+                ancestor_value = {}
+            apply_field_updates(ancestor_value, {path[len(staged_ancestor):]: value})
+            staged[staged_ancestor] = ancestor_value
+            fields_to_set[staged_ancestor] = ancestor_value
+            continue
+
+        for staged_path in list(staged):
+            if len(staged_path) > len(path) and staged_path[:len(path)] == path:
+                del staged[staged_path]
+                fields_to_set.pop(staged_path, None)
+                fields_to_delete.add(staged_path)
+        staged[path] = value
+        fields_to_set[path] = value
+        fields_to_delete.discard(path)
+    return fields_to_set, fields_to_delete
+
+
+def apply_field_updates(document, field_updates):
+    """Apply field path updates to a document dict, the way Firestore's update() would"""
+    for path, value in field_updates.items():
+        parent = document
+        for field in path[:-1]:
+            if not isinstance(parent.get(field), dict):
+                parent[field] = {}
+            parent = parent[field]
+        if value is DELETE_FIELD:
+            parent.pop(path[-1], None)
+        else:
+            parent[path[-1]] = value
+    return document
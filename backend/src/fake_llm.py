@@ -0,0 +1,74 @@
+import os
+import random
+import time
+from pydantic import Field
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Stand-in chat model with a set latency and no network calls, for load tests and benchmarks.
+    Replies with a canned response, or response_tokens words when set.
+    Without a token rate, streams spread the latency over the tokens. With tokens_per_s,
+    latency_ms is the time to the first token and each further token arrives at that rate.
+    A tail_rate share of calls take tail_latency_ms instead, and a failure_rate share raise.
+    Calls slower than their timeout argument raise TimeoutError once it runs out, like a provider client.
+    Latency uses time.sleep, so it yields to other requests under eventlet.
+    """
+    model: str = "fake"
+    latency_ms: float = Field(default_factory=lambda: float(os.getenv("FAKE_LLM_LATENCY_MS", 1000)))
+    tail_latency_ms: float = Field(default_factory=lambda: float(os.getenv("FAKE_LLM_TAIL_LATENCY_MS", 0)))
+    tail_rate: float = Field(default_factory=lambda: float(os.getenv("FAKE_LLM_TAIL_RATE", 0)))
+    failure_rate: float = 0
+    tokens_per_s: float = Field(default_factory=lambda: float(os.getenv("FAKE_LLM_TOKENS_PER_S", 0)))
+    response_tokens: int = Field(default_factory=lambda: int(os.getenv("FAKE_LLM_RESPONSE_TOKENS", 0)))
+    response: str = "This is a placeholder response from the fake model."
+
+    def get_response(self) -> str:
+        if self.response_tokens:
+            return " ".join(f"token{index}" for index in range(self.response_tokens))
+        return self.response
+
+    def get_latency_s(self) -> float:
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ConnectionError("Fake provider failure")
+        if self.tail_rate and random.random() < self.tail_rate:
+            return self.tail_latency_ms / 1000
+        return self.latency_ms / 1000
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def get_usage(self, messages) -> dict:
+        # rough token counts, so usage metrics have data under load tests
+        input_tokens = sum(len(str(message.content)) for message in messages) // 4
+        output_tokens = len(self.get_response()) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def get_token_delays_s(self, tokens) -> list:
+        """Seconds to wait before each token"""
+        latency_s = self.get_latency_s()
+        if self.tokens_per_s:
+            return [latency_s] + [1 / self.tokens_per_s] * (len(tokens) - 1)
+        return [latency_s / len(tokens)] * len(tokens)
+
+    def _generate(self, messages, stop=None, run_manager=None, timeout=None, **kwargs) -> ChatResult:
+        response = self.get_response()
+        latency_s = sum(self.get_token_delays_s(response.split(" ")))
+        if timeout is not None and latency_s > timeout:
+            # like a client request timeout
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake provider did not respond within {timeout:.1f}s")
+        time.sleep(latency_s)
+        message = AIMessage(content=response, usage_metadata=self.get_usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.get_response().split(" ")
+        for index, (token, delay_s) in enumerate(zip(tokens, self.get_token_delays_s(tokens))):
+            time.sleep(delay_s)
+            usage = self.get_usage(messages) if index == len(tokens) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token if index == 0 else f" {token}", usage_metadata=usage))
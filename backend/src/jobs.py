@@ -0,0 +1,309 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from src.ai_models import generate_response_with_context, get_completion_cache_key, run_chain_completion
+from src.redis_listener import publish_node_update
+from src.db.node_graph import is_stale_tracking_enabled, mark_descendants_stale
+from src.db.redis_scripts import (
+    CLAIM_JOB_SCRIPT,
+    ENQUEUE_JOB_SCRIPT,
+    FINISH_JOB_SCRIPT,
+    REAP_JOBS_SCRIPT,
+    get_script,
+)
+
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+# Queue scores are priority * PRIORITY_SCORE + enqueue time in ms, so jobs run by priority, then FIFO
+PRIORITY_SCORE = 10 ** 13
+
+
+class QueueFull(Exception):
+    """The job queue is at its admission limit for the job's priority"""
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def encode_fields(fields) -> str:
+    # strings, so Lua stores large timestamps verbatim rather than as floats
+    return json.dumps({field: str(value) for field, value in fields.items()})
+
+
+class JobQueue:
+    """
+    Durable priority queue of LLM jobs in Redis.
+    A claimed job is leased to its worker; if the worker dies and the lease expires, the job
+    is queued again until it runs out of attempts. Failed attempts are retried with backoff.
+    Enqueueing is refused (QueueFull) once queued jobs reach JOB_MAX_QUEUE_DEPTH,
+    or half of it for low priority jobs.
+
+    Redis layout:
+    - jobs:{id}: hash of job fields (type, payload, status, attempts, result, error, timestamps)
+    - jobs:queue: zset of queued job ids by priority and enqueue time
+    - jobs:running: zset of claimed job ids by lease deadline
+    - jobs:delayed: zset of job ids waiting to be retried, by retry time
+    - jobs:stats: counters shared by every worker
+    """
+    def __init__(self, redis, namespace="jobs", max_depth=None, max_attempts=None, lease_timeout=None, retry_backoff=None):
+        self.redis = redis
+        self.namespace = namespace
+        self.max_depth = max_depth or int(os.getenv("JOB_MAX_QUEUE_DEPTH", 100))
+        self.max_attempts = max_attempts or int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+        self.lease_timeout = lease_timeout or float(os.getenv("JOB_LEASE_TIMEOUT", 60))
+        self.retry_backoff = retry_backoff or float(os.getenv("JOB_RETRY_BACKOFF", 2))
+
+        self.queue_key = f"{namespace}:queue"
+        self.running_key = f"{namespace}:running"
+        self.delayed_key = f"{namespace}:delayed"
+        self.stats_key = f"{namespace}:stats"
+
+    def job_key(self, job_id) -> str:
+        return f"{self.namespace}:{job_id}"
+
+    def enqueue(self, job_type, payload, priority="normal") -> str:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unsupported priority: {priority}")
+        admission_limit = self.max_depth // 2 if priority == "low" else self.max_depth
+
+        job_id = uuid.uuid4().hex
+        enqueued_at = now_ms()
+        fields = {
+            "id": job_id,
+            "type": job_type,
+            "payload": json.dumps(payload),
+            "priority": PRIORITIES[priority],
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "created_at": enqueued_at,
+            "enqueued_at": enqueued_at,
+        }
+        queued = get_script(self.redis, ENQUEUE_JOB_SCRIPT)(
+            keys=[self.queue_key, self.delayed_key, self.job_key(job_id), self.stats_key],
+            args=[admission_limit, PRIORITIES[priority] * PRIORITY_SCORE + enqueued_at, encode_fields(fields)],
+            client=self.redis,
+        )
+        if not queued:
+            raise QueueFull(f"Job queue is full for {priority} priority jobs")
+        return job_id
+
+    def claim(self):
+        """Lease the next job, returning its fields or None when the queue is empty"""
+        job_id = get_script(self.redis, CLAIM_JOB_SCRIPT)(
+            keys=[self.queue_key, self.running_key, self.stats_key],
+            args=[now_ms(), int(self.lease_timeout * 1000), f"{self.namespace}:"],
+            client=self.redis,
+        )
+        if job_id is None:
+            return None
+        return self.get_job(job_id.decode('utf-8'))
+
+    def extend_leases(self, job_ids):
+        if not job_ids:
+            return
+        deadline = now_ms() + int(self.lease_timeout * 1000)
+        # XX: only jobs still leased, a reaped job is not re-leased
+        self.redis.zadd(self.running_key, {job_id: deadline for job_id in job_ids}, xx=True)
+
+    def _finish(self, job, fields, counter, retry_at=None) -> bool:
+        return bool(get_script(self.redis, FINISH_JOB_SCRIPT)(
+            keys=[self.running_key, self.delayed_key, self.job_key(job["id"]), self.stats_key],
+            args=[job["id"], encode_fields(fields), counter, retry_at if retry_at is not None else ""],
+            client=self.redis,
+        ))
+
+    def complete(self, job, result) -> bool:
+        return self._finish(job, {
+            "status": "succeeded",
+            "result": json.dumps(result),
+            "finished_at": now_ms(),
+        }, "succeeded")
+
+    def fail(self, job, error, retryable=True) -> bool:
+        """Retry the job after a backoff if it has attempts left, otherwise mark it failed"""
+        if retryable and job["attempts"] < job["max_attempts"]:
+            retry_at = now_ms() + int(self.retry_backoff * 2 ** (job["attempts"] - 1) * 1000)
+            return self._finish(job, {"status": "retrying", "error": error}, "retried", retry_at=retry_at)
+        return self._finish(job, {
+            "status": "failed",
+            "error": error,
+            "finished_at": now_ms(),
+        }, "failed")
+
+    def reap(self) -> int:
+        """Requeue jobs with expired leases and jobs due for a retry"""
+        return get_script(self.redis, REAP_JOBS_SCRIPT)(
+            keys=[self.queue_key, self.running_key, self.delayed_key, self.stats_key],
+            args=[now_ms(), f"{self.namespace}:", PRIORITY_SCORE],
+            client=self.redis,
+        )
+
+    def get_job(self, job_id):
+        values = self.redis.hgetall(self.job_key(job_id))
+        if not values:
+            return None
+        job = {field.decode('utf-8'): value.decode('utf-8') for field, value in values.items()}
+        for field in ["priority", "attempts", "max_attempts", "created_at", "enqueued_at", "started_at", "finished_at"]:
+            if field in job:
+                job[field] = int(float(job[field]))
+        job["payload"] = json.loads(job["payload"])
+        if "result" in job:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def get_stats(self) -> dict:
+        pipe = self.redis.pipeline(transaction=False)
+        for priority in PRIORITIES.values():
+            pipe.zcount(self.queue_key, priority * PRIORITY_SCORE, (priority + 1) * PRIORITY_SCORE - 1)
+        pipe.zcard(self.running_key)
+        pipe.zcard(self.delayed_key)
+        pipe.zrange(self.queue_key, 0, -1, withscores=True)
+        pipe.hgetall(self.stats_key)
+        *depths, running, delayed, queued, counters = pipe.execute()
+
+        counters = {field.decode('utf-8'): float(value) for field, value in counters.items()}
+        started = counters.get("started", 0)
+        now = now_ms()
+        oldest_wait_ms = max((now - score % PRIORITY_SCORE for _, score in queued), default=0)
+        return {
+            "queued": dict(zip(PRIORITIES, depths)),
+            "running": running,
+            "delayed": delayed,
+            "max_depth": self.max_depth,
+            "oldest_wait_ms": round(oldest_wait_ms, 2),
+            "avg_wait_ms": round(counters.get("wait_ms", 0) / started, 2) if started else 0,
+            **{
+                counter: int(counters.get(counter, 0))
+                for counter in ["enqueued", "rejected", "started", "succeeded", "retried", "failed", "lease_expired"]
+            },
+        }
+
+
+class JobWorkerPool:
+    """
+    Threads that claim and run jobs from a JobQueue, calling handlers[job type](payload).
+    Handlers raising ValueError fail the job for good, other errors are retried.
+    Leases of running jobs are renewed while they run.
+    """
+    def __init__(self, queue, handlers, concurrency=None, poll_interval=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency or int(os.getenv("JOB_WORKERS", 4))
+        self.poll_interval = poll_interval or float(os.getenv("JOB_POLL_INTERVAL", 0.25))
+        self.stop_signal = threading.Event()
+        self.threads = []
+        self.running_jobs = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.stop_signal.clear()
+        self.threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            for index in range(self.concurrency)
+        ]
+        self.threads.append(threading.Thread(target=self._maintain, name="job-maintainer", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Stop claiming jobs and wait briefly for running ones; unfinished jobs are requeued once their lease expires"""
+        self.stop_signal.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def _work(self):
+        while not self.stop_signal.is_set():
+            try:
+                job = self.queue.claim()
+            except Exception as e:
+                print(f"Failed to claim job: {e}")
+                self.stop_signal.wait(self.poll_interval)
+                continue
+            if job is None:
+                self.stop_signal.wait(self.poll_interval)
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                # the job keeps its lease until it expires and is requeued
+                print(f"Failed to finish job {job['id']}: {e}")
+
+    def _run(self, job):
+        with self.lock:
+            self.running_jobs.add(job["id"])
+        try:
+            handler = self.handlers.get(job["type"])
+            if handler is None:
+                raise ValueError(f"Unsupported job type: {job['type']}")
+            result = handler(job["payload"])
+        except ValueError as e:
+            self.queue.fail(job, str(e), retryable=False)
+        except Exception as e:
+            print(f"Job {job['id']} attempt {job['attempts']} failed: {e}")
+            self.queue.fail(job, type(e).__name__)
+        else:
+            self.queue.complete(job, result)
+        finally:
+            with self.lock:
+                self.running_jobs.discard(job["id"])
+
+    def _maintain(self):
+        """Renew leases of running jobs, requeue expired ones and release due retries"""
+        interval = min(self.queue.lease_timeout / 3, float(os.getenv("JOB_REAP_INTERVAL", 1)))
+        while not self.stop_signal.wait(interval):
+            try:
+                with self.lock:
+                    running_jobs = list(self.running_jobs)
+                self.queue.extend_leases(running_jobs)
+                self.queue.reap()
+            except Exception as e:
+                print(f"Job queue maintenance failed: {e}")
+
+
+def make_job_handlers(redis, llm_cache):
+    """Handlers for completion and chain completion jobs, storing results in node:{id} hashes"""
+    def run_completion(payload):
+        parent_nodes = payload.get("parentNodes", [])
+        prompt_completion, _ = llm_cache.get_or_compute(
+            get_completion_cache_key(payload["model"], payload["prompt"], parent_nodes),
+            lambda: generate_response_with_context(
+                model=payload["model"],
+                prompt=payload["prompt"],
+                parent_nodes=parent_nodes,
+                redis=redis,
+            ),
+        )
+        fields = {
+            "model": payload["model"],
+            "prompt": payload["prompt"],
+            "parent_ids": json.dumps([parent["id"] for parent in parent_nodes]),
+            "prompt_response": prompt_completion["response"],
+        }
+        if payload.get("canvasId"):
+            fields["canvas_id"] = payload["canvasId"]
+        pipe = redis.pipeline()
+        publish_node_update(pipe, payload["nodeId"], fields, canvas_id=payload.get("canvasId"))
+        if is_stale_tracking_enabled():
+            mark_descendants_stale(pipe, [payload["nodeId"]])
+        pipe.execute()
+        return prompt_completion
+
+    def run_chain(payload):
+        return run_chain_completion(
+            redis,
+            node_id=payload["nodeId"],
+            model=payload["model"],
+            prompt=payload["prompt"],
+            parent_node_ids=[parent["id"] for parent in payload.get("parentNodes", [])],
+            canvas_id=payload.get("canvasId"),
+        )
+
+    return {
+        "completion": run_completion,
+        "chain_completion": run_chain,
+    }
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from cachetools import TTLCache
+
+from src.db.redis_scripts import RELEASE_LOCK_SCRIPT, get_script
+
+
+CACHE_BYPASS_HEADER = "X-Cache-Bypass"
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache for LLM responses.
+    Lookups go through a per-process LRU/TTL cache, then a Redis tier shared by every worker.
+    Concurrent misses for the same key are coalesced so only one upstream call is made:
+    in process through an in-flight registry, and across workers through a short Redis lock.
+    """
+    def __init__(
+            self,
+            redis=None,
+            maxsize=None,
+            ttl=None,
+            redis_ttl=None,
+            lock_timeout=None,
+            namespace="llm_cache",
+            enabled=True,
+    ):
+        self.enabled = enabled
+        self.redis = redis
+        self.redis_ttl = redis_ttl or int(os.getenv("LLM_CACHE_REDIS_TTL", 3600))
+        self.lock_timeout = lock_timeout or float(os.getenv("LLM_CACHE_LOCK_TIMEOUT", 60))
+        self.namespace = namespace
+
+        self.local = TTLCache(
+            maxsize=maxsize or int(os.getenv("LLM_CACHE_MAXSIZE", 1024)),
+            ttl=ttl or int(os.getenv("LLM_CACHE_TTL", 600)),
+        )
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "coalesced": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "saved_ms": 0.0,
+        }
+
+    def get_or_compute(self, key, compute, bypass=False):
+        """
+        Return (value, status) for key, calling compute() only when no tier has the value.
+        status is one of "local_hit", "redis_hit", "coalesced", "miss", "bypass" or "disabled".
+        """
+        if not self.enabled:
+            return compute(), "disabled"
+
+        if bypass:
+            value, latency_ms = self._timed(compute)
+            self._store(key, value, latency_ms)
+            self._record("bypassed")
+            return value, "bypass"
+
+        with self.lock:
+            entry = self.local.get(key)
+            flight = self.in_flight.get(key)
+            is_leader = entry is None and flight is None
+            if is_leader:
+                flight = _InFlight()
+                self.in_flight[key] = flight
+
+        if entry is not None:
+            self._record("local_hits", entry["latency_ms"])
+            return entry["value"], "local_hit"
+
+        if not is_leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            self._record("coalesced", flight.value["latency_ms"])
+            return flight.value["value"], "coalesced"
+
+        try:
+            entry, status = self._get_or_compute_shared(key, compute)
+            flight.value = entry
+            return entry["value"], status
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            flight.done.set()
+
+    def get_stats(self) -> dict:
+        stats = {"process": dict(self.stats)}
+        if self.redis:
+            shared = self.redis.hgetall(f"{self.namespace}:stats")
+            stats["shared"] = {k.decode('utf-8'): float(v) for k, v in shared.items()}
+        return stats
+
+    def _get_or_compute_shared(self, key, compute):
+        if not self.redis:
+            value, latency_ms = self._timed(compute)
+            entry = self._store(key, value, latency_ms)
+            self._record("misses")
+            return entry, "miss"
+
+        entry = self._get_redis_entry(key)
+        if entry is not None:
+            with self.lock:
+                self.local[key] = entry
+            self._record("redis_hits", entry["latency_ms"])
+            return entry, "redis_hit"
+
+        lock_key = f"{self.namespace}:lock:{key}"
+        lock_token = uuid.uuid4().hex
+        if self.redis.set(lock_key, lock_token, nx=True, px=int(self.lock_timeout * 1000)):
+            try:
+                value, latency_ms = self._timed(compute)
+                entry = self._store(key, value, latency_ms)
+            finally:
+                # only release our own lock, it may have expired and been taken by another worker
+                get_script(self.redis, RELEASE_LOCK_SCRIPT)(keys=[lock_key], args=[lock_token], client=self.redis)
+            self._record("misses")
+            return entry, "miss"
+
+        # Another worker is computing this key, wait for it to publish the value
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline and self.redis.exists(lock_key):
+            time.sleep(0.05)
+            entry = self._get_redis_entry(key)
+            if entry is not None:
+                with self.lock:
+                    self.local[key] = entry
+                self._record("coalesced", entry["latency_ms"])
+                return entry, "coalesced"
+
+        entry = self._get_redis_entry(key)
+        if entry is not None:
+            with self.lock:
+                self.local[key] = entry
+            self._record("coalesced", entry["latency_ms"])
+            return entry, "coalesced"
+
+        value, latency_ms = self._timed(compute)
+        entry = self._store(key, value, latency_ms)
+        self._record("misses")
+        return entry, "miss"
+
+    def _get_redis_entry(self, key):
+        cached = self.redis.get(f"{self.namespace}:{key}")
+        return json.loads(cached) if cached is not None else None
+
+    def _store(self, key, value, latency_ms) -> dict:
+        entry = {"value": value, "latency_ms": latency_ms}
+        with self.lock:
+            self.local[key] = entry
+        if self.redis:
+            self.redis.set(f"{self.namespace}:{key}", json.dumps(entry), ex=self.redis_ttl)
+        return entry
+
+    def _timed(self, compute):
+        start = time.perf_counter()
+        value = compute()
+        return value, round((time.perf_counter() - start) * 1000, 2)
+
+    def _record(self, counter, saved_ms=0.0):
+        with self.lock:
+            self.stats[counter] += 1
+            self.stats["saved_ms"] += saved_ms
+        if self.redis:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hincrby(f"{self.namespace}:stats", counter, 1)
+            if saved_ms:
+                pipe.hincrbyfloat(f"{self.namespace}:stats", "saved_ms", saved_ms)
+            pipe.execute()
+
+
+def make_cache_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def is_cache_bypassed(request) -> bool:
+    """A request bypasses the cache with `X-Cache-Bypass: true` or `Cache-Control: no-cache`"""
+    if request.headers.get(CACHE_BYPASS_HEADER, "").lower() in {"1", "true"}:
+        return True
+    return "no-cache" in request.headers.get("Cache-Control", "").lower()
@@ -0,0 +1,175 @@
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+import redis
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# With PROMETHEUS_MULTIPROC_DIR set (see gunicorn.conf.py), every worker writes its samples
+# to files in that directory and /metrics aggregates them, so any worker reports the whole server.
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time to build a response, per blueprint route. Streamed responses are timed to their first byte.",
+    ["blueprint", "endpoint", "method", "status"],
+)
+schema_validation_duration = Histogram(
+    "schema_validation_seconds",
+    "Time spent validating JSON request bodies",
+    ["endpoint"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+firestore_operation_duration = Histogram(
+    "firestore_operation_seconds",
+    "Firestore call latency",
+    ["operation"],
+)
+firestore_payload_bytes = Histogram(
+    "firestore_payload_bytes",
+    "Approximate JSON size of a sample of the documents read from and written to Firestore",
+    ["operation"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+redis_round_trips = Counter(
+    "redis_round_trips_total",
+    "Redis round trips; a pipeline or script call is one round trip",
+)
+redis_round_trips_per_request = Histogram(
+    "redis_round_trips_per_request",
+    "Redis round trips made while handling one HTTP request",
+    ["endpoint"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55),
+)
+llm_time_to_first_token = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from sending a streamed completion to its first token",
+    ["model"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+llm_request_duration = Histogram(
+    "llm_request_duration_seconds",
+    "Model call latency, by outcome: ok, busy or error",
+    ["model", "mode", "outcome"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64),
+)
+llm_tokens = Counter(
+    "llm_tokens_total",
+    "Tokens reported by the provider, by kind: input or output",
+    ["model", "kind"],
+)
+socketio_emits = Counter(
+    "socketio_emits_total",
+    "Socket.IO events emitted, by event (update channels are grouped by kind)",
+    ["event"],
+)
+socketio_connected_clients = Gauge(
+    "socketio_connected_clients",
+    "Connected Socket.IO clients",
+    multiprocess_mode="livesum",
+)
+
+
+def is_metrics_enabled() -> bool:
+    return os.getenv("ENABLE_METRICS", "true").lower() == "true"
+
+
+def init_request_metrics(app):
+    """Time every request and count its Redis round trips"""
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.redis_round_trips = 0
+
+    @app.after_request
+    def observe_request(response):
+        if "request_start" not in g:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        http_request_duration.labels(
+            blueprint=request.blueprint or "",
+            endpoint=endpoint,
+            method=request.method,
+            status=response.status_code,
+        ).observe(time.perf_counter() - g.request_start)
+        redis_round_trips_per_request.labels(endpoint=endpoint).observe(g.redis_round_trips)
+        return response
+
+
+@contextmanager
+def observe_schema_validation(endpoint):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        schema_validation_duration.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def observe_firestore(operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        firestore_operation_duration.labels(operation=operation).observe(time.perf_counter() - start)
+
+
+def record_firestore_payload(operation, document):
+    """
+    Record a document's JSON size for a sampled share of calls, FIRESTORE_PAYLOAD_SAMPLE_RATE,
+    as measuring it means serializing the whole document again.
+    """
+    if not is_metrics_enabled() or random.random() >= float(os.getenv("FIRESTORE_PAYLOAD_SAMPLE_RATE", 0.01)):
+        return
+    firestore_payload_bytes.labels(operation=operation).observe(len(json.dumps(document, default=str)))
+
+
+def record_redis_round_trip():
+    redis_round_trips.inc()
+    if has_request_context() and "redis_round_trips" in g:
+        g.redis_round_trips += 1
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    """Pipeline counting each execute as one round trip"""
+    def execute(self, raise_on_error=True):
+        if self.command_stack:
+            record_redis_round_trip()
+        return super().execute(raise_on_error)
+
+    def immediate_execute_command(self, *args, **options):
+        record_redis_round_trip()
+        return super().immediate_execute_command(*args, **options)
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client counting round trips, overall and for the current request"""
+    def execute_command(self, *args, **options):
+        record_redis_round_trip()
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def record_llm_call(model, mode, outcome, seconds, message=None):
+    """Record a model call's latency and, when the provider reports usage, its tokens"""
+    llm_request_duration.labels(model=model, mode=mode, outcome=outcome).observe(seconds)
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        llm_tokens.labels(model=model, kind="input").inc(usage.get("input_tokens", 0))
+        llm_tokens.labels(model=model, kind="output").inc(usage.get("output_tokens", 0))
+
+
+def record_llm_first_token(model, seconds):
+    llm_time_to_first_token.labels(model=model).observe(seconds)
+
+
+def record_socketio_emit(event):
+    # node:{id}:update -> node:update, so labels stay bounded
+    parts = event.split(":")
+    if len(parts) == 3 and parts[2] == "update":
+        event = f"{parts[0]}:update"
+    socketio_emits.labels(event=event).inc()
@@ -0,0 +1,172 @@
+import importlib
+import os
+import threading
+from src.providers import LimitedChatModel, get_http_client, get_limiter
+from src.resilience import ResilientChatModel
+
+
+# Provider SDKs are only imported when one of their models is first used.
+# http_client_arg is the client argument taking the provider's shared HTTP pool, if it has one.
+# timeout_arg is the invoke argument setting a single request's timeout, if the client has one.
+# max_concurrency, here or on a model, overrides PROVIDER_MAX_CONCURRENCY / MODEL_MAX_CONCURRENCY.
+# A model's hedge_models are equivalent models that hedge its slow or failed calls (ENABLE_HEDGING).
+PROVIDERS = {
+    "together": {
+        "module": "langchain_together",
+        "class": "ChatTogether",
+        "api_key_env": "TOGETHER_API_KEY",
+        "api_key_arg": "together_api_key",
+        "http_client_arg": "http_client",
+        "timeout_arg": "timeout",
+    },
+    "openai": {
+        "module": "langchain_openai",
+        "class": "ChatOpenAI",
+        "api_key_env": "OPENAI_API_KEY",
+        "api_key_arg": "api_key",
+        "http_client_arg": "http_client",
+        "timeout_arg": "timeout",
+    },
+    "anthropic": {
+        "module": "langchain_anthropic",
+        "class": "ChatAnthropic",
+        "api_key_env": "ANTHROPIC_API_KEY",
+        "api_key_arg": "api_key",
+        # langchain_anthropic builds its own keep-alive client per model
+        "http_client_arg": None,
+        "timeout_arg": "timeout",
+    },
+    # Serves every model when ENABLE_FAKE_LLM is set, see src/fake_llm.py
+    "fake": {
+        "module": "src.fake_llm",
+        "class": "FakeChatModel",
+        "api_key_env": None,
+        "api_key_arg": None,
+        "http_client_arg": None,
+        "timeout_arg": "timeout",
+    },
+}
+
+
+MODEL_REGISTRY = {
+    "qwen-2.5-7b": {
+        "provider": "together",
+        "model": "Qwen/Qwen2.5-7B-Instruct-Turbo",
+        "options": {"temperature": 0.7},
+    },
+    "mixtral-8x7b": {
+        "provider": "together",
+        "model": "mistralai/Mixtral-8x7B-Instruct-v0.1",
+    },
+    "llama-3.3-70b": {
+        "provider": "together",
+        "model": "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
+        "hedge_models": ["llama-3.3-70b-turbo"],
+    },
+    "gpt-4o": {
+        "provider": "openai",
+        "model": "gpt-4o",
+    },
+    "claude-sonnet": {
+        "provider": "anthropic",
+        "model": "claude-3-5-sonnet-20240620",
+    },
+}
+
+
+# Models that only serve as hedges, users cannot select them
+HEDGE_MODELS = {
+    # Paid endpoint of the same model, hedges the free tier's slow tail
+    "llama-3.3-70b-turbo": {
+        "provider": "together",
+        "model": "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+    },
+}
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model_spec(model_name) -> dict:
+    return MODEL_REGISTRY.get(model_name) or HEDGE_MODELS[model_name]
+
+
+def get_provider_name(model_name) -> str:
+    if os.getenv("ENABLE_FAKE_LLM", "false").lower() == "true":
+        return "fake"
+    return get_model_spec(model_name)["provider"]
+
+
+def is_model_available(model_name) -> bool:
+    if model_name not in MODEL_REGISTRY and model_name not in HEDGE_MODELS:
+        return False
+    api_key_env = PROVIDERS[get_provider_name(model_name)]["api_key_env"]
+    return not api_key_env or bool(os.getenv(api_key_env))
+
+
+def list_models() -> list:
+    """Names of the registered models whose provider API key is set"""
+    return [model_name for model_name in MODEL_REGISTRY if is_model_available(model_name)]
+
+
+def build_model(model_name):
+    spec = get_model_spec(model_name)
+    provider_name = get_provider_name(model_name)
+    provider = PROVIDERS[provider_name]
+    model_class = getattr(importlib.import_module(provider["module"]), provider["class"])
+    client_args = {}
+    if provider["api_key_env"]:
+        client_args[provider["api_key_arg"]] = os.getenv(provider["api_key_env"])
+    if provider["http_client_arg"]:
+        client_args[provider["http_client_arg"]] = get_http_client(provider_name)
+    if provider_name == spec["provider"]:
+        client_args.update(spec.get("options", {}))
+    llm = model_class(model=spec["model"], **client_args)
+
+    limited_llm = LimitedChatModel(llm, [
+        get_limiter(
+            f"model:{model_name}",
+            spec.get("max_concurrency") or int(os.getenv("MODEL_MAX_CONCURRENCY", 4)),
+        ),
+        get_limiter(
+            f"provider:{provider_name}",
+            provider.get("max_concurrency") or int(os.getenv("PROVIDER_MAX_CONCURRENCY", 8)),
+        ),
+    ], timeout_arg=provider.get("timeout_arg"))
+
+    return ResilientChatModel(
+        model_name,
+        provider_name,
+        limited_llm,
+        get_hedges=lambda: [
+            get_or_build_model(hedge_model_name)
+            for hedge_model_name in spec.get("hedge_models", [])
+            if is_model_available(hedge_model_name)
+        ],
+    )
+
+
+def get_model(model_name):
+    """
+    Get the chat model client for a model name, building it on first use.
+    Calls go through its timeout, circuit breaker and hedging (src/resilience.py),
+    then the model's and provider's concurrency limits (src/providers.py).
+    """
+    if model_name not in MODEL_REGISTRY:
+        raise ValueError(f"Unsupported model type: {model_name}")
+    return get_or_build_model(model_name)
+
+
+def get_or_build_model(model_name):
+    """Like get_model, for hedge models too"""
+    llm = _models.get(model_name)
+    if llm is not None:
+        return llm
+
+    if not is_model_available(model_name):
+        raise ValueError(f"Model {model_name} is not configured")
+    with _models_lock:
+        if model_name not in _models:
+            _models[model_name] = build_model(model_name)
+        return _models[model_name]
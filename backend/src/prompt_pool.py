@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.ai_models import generate_prompt_question
+from src.db.redis_scripts import ADD_SUGGESTIONS_SCRIPT, POP_SUGGESTION_SCRIPT, get_script
+from src.redis_listener import LeaderLock
+from src.structured_log import log_event
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def normalize_suggestion(suggestion) -> str:
+    return suggestion.strip().strip('"').strip()
+
+
+class PromptSuggestionPool:
+    """
+    Pool of pre-generated prompt suggestions for nodes without context, e.g. on a new canvas.
+    Suggestions without context do not depend on the request, so they are generated ahead of time
+    and a request pops one in a single round trip instead of waiting on the model.
+
+    A background refiller tops the pool up to high_watermark whenever it falls below low_watermark.
+    Suggestions older than max_age seconds are dropped, and a suggestion is not pooled again
+    within max_age of being served, so users do not keep seeing the same few questions.
+    Only one process refills at a time, elected with a Redis lock. It checks the pool every
+    refill_interval seconds, and as soon as a pop in any process leaves it below low_watermark.
+
+    Redis layout:
+    - prompt_pool: zset of suggestions by generation time
+    - prompt_pool:served: zset of recently served suggestions by serve time
+    - prompt_pool:wake: list the refiller blocks on, holding a wake-up once the pool runs low
+    """
+    def __init__(self, redis, generate=None, key="prompt_pool", low_watermark=None, high_watermark=None,
+                 max_age=None, refill_interval=None, refill_concurrency=None):
+        self.redis = redis
+        self.generate = generate or (lambda: generate_prompt_question([], redis=redis))
+        self.key = key
+        self.served_key = f"{key}:served"
+        self.wake_key = f"{key}:wake"
+        self.low_watermark = low_watermark or int(os.getenv("PROMPT_POOL_LOW_WATERMARK", 10))
+        self.high_watermark = high_watermark or int(os.getenv("PROMPT_POOL_HIGH_WATERMARK", 50))
+        self.max_age = max_age or float(os.getenv("PROMPT_POOL_MAX_AGE", 3600))
+        self.refill_interval = refill_interval or float(os.getenv("PROMPT_POOL_REFILL_INTERVAL", 5))
+        self.refill_concurrency = refill_concurrency or int(os.getenv("PROMPT_POOL_REFILL_CONCURRENCY", 4))
+        self.leader_lock = LeaderLock(redis, key=f"{key}:leader", ttl=max(self.refill_interval * 3, 30))
+        self.stop_signal = threading.Event()
+        self.thread = None
+
+    def oldest_score(self) -> int:
+        return now_ms() - int(self.max_age * 1000)
+
+    def pop(self):
+        """Take a suggestion from the pool, or None if it is empty"""
+        result = get_script(self.redis, POP_SUGGESTION_SCRIPT)(
+            keys=[self.key, self.served_key, self.wake_key],
+            args=[self.oldest_score(), now_ms(), self.low_watermark],
+            client=self.redis,
+        )
+        log_event("prompt_pool_pop", hit=len(result) > 1, size=result[0])
+        return result[1].decode("utf-8") if len(result) > 1 else None
+
+    def add(self, suggestions) -> int:
+        """Pool new suggestions, skipping duplicates. Returns the number added."""
+        suggestions = [normalize_suggestion(suggestion) for suggestion in suggestions]
+        added, _ = get_script(self.redis, ADD_SUGGESTIONS_SCRIPT)(
+            keys=[self.key, self.served_key],
+            args=[self.oldest_score(), now_ms(), self.high_watermark, json.dumps([s for s in suggestions if s])],
+            client=self.redis,
+        )
+        return added
+
+    def size(self) -> int:
+        return self.redis.zcount(self.key, self.oldest_score(), "+inf")
+
+    def refill(self) -> int:
+        """
+        Generate suggestions until the pool is at its high watermark, stopping early
+        when a whole batch fails or duplicates pooled and served ones. Returns the number added.
+        """
+        start = time.perf_counter()
+        needed = self.high_watermark - self.size()
+        added = 0
+        attempts = 0
+        with ThreadPoolExecutor(max_workers=self.refill_concurrency) as executor:
+            while added < needed and attempts < needed * 2 and not self.stop_signal.is_set():
+                batch_size = min(self.refill_concurrency, needed - added)
+                futures = [executor.submit(self.generate) for _ in range(batch_size)]
+                suggestions = []
+                for future in futures:
+                    try:
+                        suggestions.append(future.result())
+                    except Exception as e:
+                        print(f"Failed to generate a prompt suggestion: {e}")
+                attempts += batch_size
+                batch_added = self.add(suggestions) if suggestions else 0
+                added += batch_added
+                if not batch_added:
+                    # the model keeps repeating itself, try again next interval
+                    break
+                # keep the lock while refilling, in case a refill outlasts its ttl
+                self.leader_lock.acquire()
+        log_event("prompt_pool_refilled", added=added, attempts=attempts, ms=round((time.perf_counter() - start) * 1000, 2))
+        return added
+
+    def start(self):
+        self.stop_signal.clear()
+        self.thread = threading.Thread(target=self._run, name="prompt-pool-refiller", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_signal.set()
+        # unblock the refiller if it is waiting for a wake-up
+        self.redis.lpush(self.wake_key, 1)
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.leader_lock.release()
+
+    def _run(self):
+        while not self.stop_signal.is_set():
+            try:
+                if not self.leader_lock.acquire():
+                    self.stop_signal.wait(self.refill_interval)
+                    continue
+                if self.size() < self.low_watermark:
+                    self.refill()
+                # woken early by a pop in any process leaving the pool below its low watermark
+                self.redis.blpop([self.wake_key], timeout=self.refill_interval)
+            except Exception as e:
+                print(f"Prompt suggestion pool refill failed: {e}")
+                self.stop_signal.wait(self.refill_interval)
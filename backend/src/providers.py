@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+from langchain_core.runnables import Runnable
+
+
+class ProviderBusy(Exception):
+    """A model or provider stayed at its concurrency limit for the whole queue timeout"""
+
+
+class ConcurrencyLimiter:
+    """
+    Semaphore bounding the in-flight requests to a provider or model.
+    Callers wait in line up to a timeout instead of fanning out without limit.
+    """
+    def __init__(self, name, max_concurrency):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.stats = {
+            "in_flight": 0,
+            "waiting": 0,
+            "max_waiting": 0,
+            "acquired": 0,
+            "rejected": 0,
+            "wait_ms": 0.0,
+        }
+
+    def acquire(self, timeout) -> bool:
+        start = time.perf_counter()
+        with self.lock:
+            self.stats["waiting"] += 1
+            self.stats["max_waiting"] = max(self.stats["max_waiting"], self.stats["waiting"])
+
+        acquired = self.semaphore.acquire(timeout=max(timeout, 0))
+
+        with self.lock:
+            self.stats["waiting"] -= 1
+            self.stats["wait_ms"] += (time.perf_counter() - start) * 1000
+            if acquired:
+                self.stats["in_flight"] += 1
+                self.stats["acquired"] += 1
+            else:
+                self.stats["rejected"] += 1
+        return acquired
+
+    def release(self):
+        with self.lock:
+            self.stats["in_flight"] -= 1
+        self.semaphore.release()
+
+    @contextmanager
+    def slot(self, deadline):
+        if not self.acquire(deadline - time.monotonic()):
+            raise ProviderBusy(f"{self.name} is at its concurrency limit of {self.max_concurrency}")
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        stats["max_concurrency"] = self.max_concurrency
+        stats["avg_wait_ms"] = round(stats["wait_ms"] / max(stats["acquired"] + stats["rejected"], 1), 2)
+        stats["wait_ms"] = round(stats["wait_ms"], 2)
+        return stats
+
+
+class LimitedChatModel(Runnable):
+    """
+    Chat model wrapper that takes a slot from its model limiter, then its provider limiter,
+    for every call. Streams hold their slots until the stream is exhausted or closed.
+    Raises ProviderBusy if the slots cannot be taken within the queue timeout.
+
+    invoke() takes an optional deadline (time.monotonic()) for the whole call. The slots are not
+    waited for past it, and the client's own request timeout (its timeout_arg) is set to the time
+    left, so a call its caller gave up on ends and frees its slots.
+    """
+    def __init__(self, llm, limiters, queue_timeout=None, timeout_arg=None):
+        self.llm = llm
+        self.limiters = limiters
+        self.queue_timeout = queue_timeout or float(os.getenv("PROVIDER_QUEUE_TIMEOUT", 10))
+        self.timeout_arg = timeout_arg
+
+    @contextmanager
+    def acquire(self, deadline=None):
+        queue_deadline = time.monotonic() + self.queue_timeout
+        if deadline is not None:
+            queue_deadline = min(queue_deadline, deadline)
+        with ExitStack() as stack:
+            for limiter in self.limiters:
+                stack.enter_context(limiter.slot(queue_deadline))
+            yield
+
+    def invoke(self, input, config=None, deadline=None, **kwargs):
+        with self.acquire(deadline):
+            if deadline is not None and self.timeout_arg:
+                kwargs[self.timeout_arg] = max(deadline - time.monotonic(), 0.001)
+            return self.llm.invoke(input, config, **kwargs)
+
+    def stream(self, input, config=None, **kwargs):
+        with self.acquire():
+            yield from self.llm.stream(input, config, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.llm, attr)
+
+
+_limiters = {}
+_http_clients = {}
+_lock = threading.Lock()
+
+
+def get_limiter(name, max_concurrency) -> ConcurrencyLimiter:
+    with _lock:
+        if name not in _limiters:
+            _limiters[name] = ConcurrencyLimiter(name, max_concurrency)
+        return _limiters[name]
+
+
+def get_http_client(provider):
+    """Keep-alive HTTP connection pool shared by every model of a provider"""
+    with _lock:
+        if provider not in _http_clients:
+            import httpx
+            max_connections = int(os.getenv("PROVIDER_MAX_CONNECTIONS", 20))
+            _http_clients[provider] = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    keepalive_expiry=float(os.getenv("PROVIDER_KEEPALIVE_EXPIRY", 60)),
+                ),
+                timeout=httpx.Timeout(float(os.getenv("PROVIDER_REQUEST_TIMEOUT", 60)), connect=5.0),
+            )
+        return _http_clients[provider]
+
+
+def get_pool_stats(http_client) -> dict:
+    try:
+        connections = http_client._transport._pool.connections
+    except AttributeError:
+        return {}
+    return {
+        "connections": len(connections),
+        "idle": sum(1 for connection in connections if connection.is_idle()),
+    }
+
+
+def get_provider_stats() -> dict:
+    """Concurrency limiter counters and HTTP pool sizes, for this process"""
+    with _lock:
+        limiters = dict(_limiters)
+        http_clients = dict(_http_clients)
+    stats = {"providers": {}, "models": {}}
+    for name, limiter in limiters.items():
+        kind, _, key = name.partition(":")
+        stats[f"{kind}s"][key] = limiter.get_stats()
+    for provider, http_client in http_clients.items():
+        stats["providers"].setdefault(provider, {})["pool"] = get_pool_stats(http_client)
+    return stats
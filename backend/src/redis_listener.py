@@ -1,12 +1,24 @@
 import os
 import gc
+import json
+import queue
 import signal
 import threading
+import time
+import uuid
 import redis
 
+from src.db.node_graph import clear_node_stale, index_node_parents, is_stale_tracking_enabled
+from src.db.redis_scripts import ACQUIRE_LOCK_SCRIPT, RELEASE_LOCK_SCRIPT, get_script
+from src.metrics import InstrumentedRedis, is_metrics_enabled, record_socketio_emit
+from src.structured_log import log_event
+
 
 redis_thread = None
 stop_signal = threading.Event()
+shutdown_hooks = []
+
+UPDATE_CHANNEL_PATTERNS = ["node:*:update", "canvas:*:update"]
 
 
 def check_redis_connection(r_client):
@@ -17,54 +29,212 @@ def check_redis_connection(r_client):
         raise Exception(f"Failed to connect to Redis: {err}")
 
 
-def redis_listener(socketio, r_client, pubsub, stop_signal):
-    """Background thread that subscribes to Redis and forwards messages to Socket.IO clients"""
-    pubsub.psubscribe('__keyspace@0__:node:*')
+def node_update_channel(node_id):
+    return f"node:{node_id}:update"
+
+
+def canvas_update_channel(canvas_id):
+    return f"canvas:{canvas_id}:update"
+
+
+def is_update_channel(channel):
+    parts = channel.split(":") if isinstance(channel, str) else []
+    return len(parts) == 3 and parts[0] in {"node", "canvas"} and parts[1] != "" and parts[2] == "update"
+
+
+def publish_node_update(r_client, node_id, fields, canvas_id=None):
+    """
+    Write fields to the node:{id} hash and publish the update to the node's channel
+    (and its canvas channel), carrying the response so listeners need no extra read.
+    With stale tracking, new parent_ids are also indexed in the parents' children sets,
+    and a new prompt_response clears the node's stale mark (see src/db/node_graph.py).
+    r_client may be a pipeline, in which case the caller executes it.
+    """
+    message = json.dumps({
+        "nodeId": f"node:{node_id}",
+        "canvasId": canvas_id,
+        "promptResponse": fields.get("prompt_response"),
+    })
+    pipe = r_client if isinstance(r_client, redis.client.Pipeline) else r_client.pipeline()
+    track_stale = is_stale_tracking_enabled()
+    if track_stale and "parent_ids" in fields:
+        index_node_parents(pipe, node_id, json.loads(fields["parent_ids"]))
+    pipe.hset(f"node:{node_id}", mapping=fields)
+    if track_stale and "prompt_response" in fields:
+        clear_node_stale(pipe, node_id)
+    pipe.publish(node_update_channel(node_id), message)
+    if canvas_id:
+        pipe.publish(canvas_update_channel(canvas_id), message)
+    if pipe is not r_client:
+        pipe.execute()
+
+
+class SubscriptionManager:
+    """
+    Reference-counted Redis channel subscriptions shared by every Socket.IO client of this process.
+    A channel is subscribed while at least one client is in its room.
+    Request handlers only queue (un)subscribe commands; the listener thread, which owns
+    the pubsub connection, applies them.
+    With subscribe_on_demand=False only room membership is tracked, for when an elected
+    listener subscribes to every update channel instead.
+    """
+    def __init__(self, pubsub, subscribe_on_demand=True):
+        self.pubsub = pubsub
+        self.subscribe_on_demand = subscribe_on_demand
+        self.lock = threading.Lock()
+        self.channel_counts = {}
+        self.client_channels = {}
+        self.pending = queue.Queue()
+
+    def add(self, sid, channel) -> bool:
+        with self.lock:
+            channels = self.client_channels.setdefault(sid, set())
+            if channel in channels:
+                return False
+            channels.add(channel)
+            self.channel_counts[channel] = self.channel_counts.get(channel, 0) + 1
+            if self.channel_counts[channel] == 1 and self.subscribe_on_demand:
+                self.pending.put(("subscribe", channel))
+        return True
+
+    def remove(self, sid, channel) -> bool:
+        with self.lock:
+            channels = self.client_channels.get(sid, set())
+            if channel not in channels:
+                return False
+            channels.discard(channel)
+            self._release(channel)
+        return True
+
+    def remove_client(self, sid) -> list:
+        with self.lock:
+            channels = self.client_channels.pop(sid, set())
+            for channel in channels:
+                self._release(channel)
+        return list(channels)
+
+    def apply_pending(self):
+        """Apply queued (un)subscribe commands, only called from the listener thread"""
+        while True:
+            try:
+                command, channel = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            if command == "subscribe":
+                self.pubsub.subscribe(channel)
+            else:
+                self.pubsub.unsubscribe(channel)
+
+    def _release(self, channel):
+        self.channel_counts[channel] -= 1
+        if self.channel_counts[channel] == 0:
+            del self.channel_counts[channel]
+            if self.subscribe_on_demand:
+                self.pending.put(("unsubscribe", channel))
+
+
+class LeaderLock:
+    """
+    Redis lock electing a single process, renewed by its owner before the ttl runs out.
+    """
+    def __init__(self, r_client, key="socketio:listener-leader", ttl=None):
+        self.r_client = r_client
+        self.key = key
+        self.ttl = ttl or float(os.getenv("SOCKETIO_LEADER_TTL", 10))
+        self.token = uuid.uuid4().hex
+
+    def acquire(self) -> bool:
+        """Acquire the lock, or renew it if already held. Returns whether this process is the leader."""
+        script = get_script(self.r_client, ACQUIRE_LOCK_SCRIPT)
+        return bool(script(keys=[self.key], args=[self.token, int(self.ttl * 1000)], client=self.r_client))
+
+    def release(self):
+        script = get_script(self.r_client, RELEASE_LOCK_SCRIPT)
+        script(keys=[self.key], args=[self.token], client=self.r_client)
+
+
+def redis_listener(socketio, subscriptions, stop_signal, leader_lock=None):
+    """
+    Background thread that forwards node and canvas update messages from Redis
+    to the Socket.IO room of the same name.
+
+    Without a leader_lock, every process subscribes to the channels its own clients are in.
+    With a leader_lock (Socket.IO message queue mode), only the elected process subscribes
+    to all update channels, and its emits reach every process through the message queue,
+    so each event is delivered once.
+    """
+    pubsub = subscriptions.pubsub
+    is_leader = False
+    next_election = 0
 
     try:
-        for message in pubsub.listen():
-            if stop_signal.is_set():  # Check if the stop signal is set
-                print("Stopping Redis listener thread...")
-                break
-
-            if message['type'] == 'pmessage':
-                event_type = message['data'].decode('utf-8')
-                if event_type == 'hset':
-                    channel = message['channel'].decode('utf-8')
-                    full_key = channel.replace('__keyspace@0__:', '')
-
-                    prompt_response = r_client.hget(full_key, "prompt_response").decode('utf-8')
-
-                    notification_channel = f"{full_key}:update"
-
-                    message = {
-                        "nodeId": full_key,
-                        "promptResponse": prompt_response,
-                    }
-                    
-                    print(f"{notification_channel}\n{prompt_response}\n\n")
-                    socketio.emit(
-                        notification_channel,
-                        message,
-                    )
+        while not stop_signal.is_set():
+            if leader_lock:
+                if time.monotonic() >= next_election:
+                    was_leader = is_leader
+                    is_leader = leader_lock.acquire()
+                    next_election = time.monotonic() + leader_lock.ttl / 3
+                    if is_leader and not was_leader:
+                        print("Elected Redis listener leader")
+                        pubsub.psubscribe(*UPDATE_CHANNEL_PATTERNS)
+                    elif was_leader and not is_leader:
+                        print("Lost Redis listener leadership")
+                        pubsub.punsubscribe()
+                if not is_leader:
+                    stop_signal.wait(min(1, max(next_election - time.monotonic(), 0)))
+                    continue
+            else:
+                subscriptions.apply_pending()
+
+            message = pubsub.get_message(ignore_subscribe_messages=True, timeout=0.1)
+            if not message or message['type'] not in {'message', 'pmessage'}:
+                continue
+
+            channel = message['channel'].decode('utf-8')
+            payload = json.loads(message['data'])
+
+            log_event("update_forwarded", channel=channel, response_chars=len(payload.get("promptResponse") or ""))
+            socketio.emit(channel, payload, to=channel)
+            record_socketio_emit(channel)
+        print("Stopping Redis listener thread...")
     finally:
-        pubsub.unsubscribe()
+        if leader_lock and is_leader:
+            leader_lock.release()
         pubsub.close()
         print("Redis pubsub connection closed.")
 
 
-def start_redis_client():
+def start_redis_client(check_connection=True):
+    """
+    Create the Redis client. Connections are opened on first command, so with
+    check_connection=False this does no network I/O.
+    With metrics enabled, the client counts its round trips.
+    """
     redis_host = os.environ.get("REDIS_HOST", "localhost")
     redis_port = int(os.environ.get("REDIS_PORT", 6379))
 
-    r_client = redis.Redis(host=redis_host, port=redis_port, db=0)
-    r_client.config_set('notify-keyspace-events', 'KEh')
+    redis_class = InstrumentedRedis if is_metrics_enabled() else redis.Redis
+    r_client = redis_class(host=redis_host, port=redis_port, db=0)
 
-    check_redis_connection(r_client)
+    if check_connection:
+        check_redis_connection(r_client)
 
     return r_client
 
 
+def check_redis_connection_in_background(r_client):
+    def check():
+        try:
+            check_redis_connection(r_client)
+            print("Connected to Redis")
+        except Exception as e:
+            print(e)
+
+    thread = threading.Thread(target=check, name="redis-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
 # Graceful shutdown handler
 def handle_sigint(signal, frame):
     print("Caught SIGINT, shutting down gracefully...")
@@ -73,21 +243,45 @@ def handle_sigint(signal, frame):
         redis_thread.join(timeout=5)  # Wait for the redis thread to finish
         print("Redis thread stopped.")
 
+    for hook in shutdown_hooks:
+        try:
+            hook()
+        except Exception as e:
+            print(f"Shutdown hook {hook.__name__} failed: {e}")
+
     gc.collect()
     exit(0)
 
 
-def start_redis_pubsub(r_client, socketio):
+def register_shutdown_hook(hook):
+    """Run hook when the process is shutting down on SIGINT"""
+    shutdown_hooks.append(hook)
+    signal.signal(signal.SIGINT, handle_sigint)
+
+
+def get_redis_url():
+    redis_host = os.environ.get("REDIS_HOST", "localhost")
+    redis_port = int(os.environ.get("REDIS_PORT", 6379))
+    return f"redis://{redis_host}:{redis_port}/0"
+
+
+def start_redis_pubsub(r_client, socketio, use_leader_election=False):
+    """
+    Start the Redis -> Socket.IO bridge thread.
+    use_leader_election should be set when Socket.IO runs with a shared message queue.
+    """
+    global redis_thread
     print("Starting Redis PubSub...")
     check_redis_connection(r_client)
     stop_signal.clear()
 
-    pubsub = r_client.pubsub()
+    subscriptions = SubscriptionManager(r_client.pubsub(), subscribe_on_demand=not use_leader_election)
+    leader_lock = LeaderLock(r_client) if use_leader_election else None
 
-    redis_thread = threading.Thread(target=redis_listener, args=(socketio, r_client, pubsub, stop_signal, ), daemon=True)
+    redis_thread = threading.Thread(target=redis_listener, args=(socketio, subscriptions, stop_signal, leader_lock, ), daemon=True)
     redis_thread.start()
 
     # Register the signal handler for SIGINT (Ctrl+C)
     signal.signal(signal.SIGINT, handle_sigint)
 
-    return pubsub
+    return subscriptions
@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from langchain_core.runnables import Runnable
+from src.providers import ProviderBusy
+from src.metrics import record_llm_call, record_llm_first_token
+
+
+class CircuitOpen(ProviderBusy):
+    """The provider's circuit breaker is open after repeated failures, so the call was not made"""
+
+
+class ModelTimeout(Exception):
+    """No response arrived within the model's adaptive timeout"""
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per model"""
+    def __init__(self, window=200):
+        self.window = window
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def record(self, model_name, latency_ms):
+        with self.lock:
+            self.latencies.setdefault(model_name, deque(maxlen=self.window)).append(latency_ms)
+
+    def percentile(self, model_name, q, min_samples=None):
+        """Latency percentile in ms, or None before min_samples calls have been recorded"""
+        min_samples = min_samples or int(os.getenv("RESILIENCE_MIN_SAMPLES", 20))
+        with self.lock:
+            latencies = sorted(self.latencies.get(model_name, ()))
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+
+    def get_timeout(self, model_name) -> float:
+        """Timeout in seconds: a multiple of the model's p99, kept within the configured bounds"""
+        min_timeout = float(os.getenv("RESILIENCE_MIN_TIMEOUT", 5))
+        max_timeout = float(os.getenv("RESILIENCE_MAX_TIMEOUT", 60))
+        p99 = self.percentile(model_name, 0.99)
+        if p99 is None:
+            return max_timeout
+        multiplier = float(os.getenv("RESILIENCE_TIMEOUT_MULTIPLIER", 2))
+        return min(max(p99 / 1000 * multiplier, min_timeout), max_timeout)
+
+    def get_hedge_delay(self, model_name):
+        """Seconds to wait for the model before sending a hedged request, its p95"""
+        p95 = self.percentile(model_name, 0.95)
+        if p95 is None:
+            return float(os.getenv("HEDGE_DEFAULT_DELAY_MS", 3000)) / 1000
+        return p95 / 1000
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            model_names = list(self.latencies)
+        return {
+            model_name: {
+                "samples": len(self.latencies[model_name]),
+                "p50_ms": self.percentile(model_name, 0.5, min_samples=1),
+                "p95_ms": self.percentile(model_name, 0.95, min_samples=1),
+                "p99_ms": self.percentile(model_name, 0.99, min_samples=1),
+                "timeout_s": self.get_timeout(model_name),
+            }
+            for model_name in model_names
+        }
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+    Opens after failure_threshold consecutive failures and rejects calls for reset_timeout seconds,
+    then lets a single trial call through: its success closes the circuit, its failure reopens it.
+    """
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+        self.reset_timeout = reset_timeout or float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0
+        self.trial_in_flight = False
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_call(self):
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "open" or (self.state == "half_open" and self.trial_in_flight):
+                self.rejected += 1
+                raise CircuitOpen(f"{self.name} circuit is open")
+            if self.state == "half_open":
+                self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Opening {self.name} circuit after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_neutral(self):
+        """The call never reached the provider, e.g. it was rejected by a concurrency limit"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+latency_tracker = LatencyTracker()
+_circuit_breakers = {}
+_hedge_stats = {}
+_executor = None
+_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider) -> CircuitBreaker:
+    with _lock:
+        if provider not in _circuit_breakers:
+            _circuit_breakers[provider] = CircuitBreaker(provider)
+        return _circuit_breakers[provider]
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("RESILIENCE_MAX_WORKERS", 32)),
+                thread_name_prefix="model-call",
+            )
+        return _executor
+
+
+def record_hedge(model_name, outcome):
+    with _lock:
+        stats = _hedge_stats.setdefault(model_name, {"sent": 0, "won": 0})
+        stats[outcome] += 1
+
+
+def is_hedging_enabled() -> bool:
+    return os.getenv("ENABLE_HEDGING", "false").lower() == "true"
+
+
+class ResilientChatModel(Runnable):
+    """
+    Chat model wrapper adding an adaptive timeout, a provider circuit breaker and optional hedging.
+
+    invoke() waits up to the model's timeout (see LatencyTracker.get_timeout), raising ModelTimeout.
+    Calls are also given that deadline as their request timeout, so timed out calls end rather
+    than keep holding a worker and their concurrency slots. Each call counts its own failure
+    against its provider's circuit, and calls still queued for a worker at the deadline are not sent.
+    With ENABLE_HEDGING, once the call passes the model's p95, or fails, the same input is also
+    sent to the first of get_hedges() whose circuit is closed, and the first response wins.
+    Streams go through the circuit breaker but are not timed out or hedged.
+    """
+    def __init__(self, model_name, provider, llm, get_hedges=None, tracker=None):
+        self.model_name = model_name
+        self.provider = provider
+        self.llm = llm
+        self.get_hedges = get_hedges or (lambda: [])
+        self.tracker = tracker or latency_tracker
+
+    def attempt(self, input, config=None, deadline=None, **kwargs):
+        """
+        A single call through the circuit breaker, recording its latency.
+        The call ends by the deadline (time.monotonic()), see LimitedChatModel.
+        Raises ModelTimeout without calling the provider if the deadline passed before the call started.
+        """
+        if deadline is not None and time.monotonic() >= deadline:
+            raise ModelTimeout(f"{self.model_name} was not called before its deadline")
+        breaker = get_circuit_breaker(self.provider)
+        breaker.before_call()
+        start = time.perf_counter()
+        try:
+            result = self.llm.invoke(input, config, deadline=deadline, **kwargs)
+        except ProviderBusy:
+            breaker.record_neutral()
+            record_llm_call(self.model_name, "invoke", "busy", time.perf_counter() - start)
+            raise
+        except Exception:
+            breaker.record_failure()
+            record_llm_call(self.model_name, "invoke", "error", time.perf_counter() - start)
+            raise
+        breaker.record_success()
+        self.tracker.record(self.model_name, (time.perf_counter() - start) * 1000)
+        record_llm_call(self.model_name, "invoke", "ok", time.perf_counter() - start, message=result)
+        return result
+
+    def get_hedge(self):
+        if not is_hedging_enabled():
+            return None
+        for hedge in self.get_hedges():
+            if not get_circuit_breaker(hedge.provider).is_open():
+                return hedge
+        return None
+
+    def invoke(self, input, config=None, **kwargs):
+        executor = get_executor()
+        start = time.monotonic()
+        deadline = start + self.tracker.get_timeout(self.model_name)
+        hedge = self.get_hedge()
+        hedge_at = start + self.tracker.get_hedge_delay(self.model_name) if hedge else None
+
+        futures = {executor.submit(self.attempt, input, config, deadline=deadline, **kwargs): self}
+        errors = []
+        while futures:
+            wait_until = min(deadline, hedge_at) if hedge_at else deadline
+            done, _ = wait(futures, timeout=max(wait_until - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                model = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if model is not self:
+                    record_hedge(self.model_name, "won")
+                return result
+
+            if time.monotonic() >= deadline:
+                # calls in flight end by the deadline and count their own failure, queued ones are dropped
+                for future in futures:
+                    future.cancel()
+                raise ModelTimeout(f"{self.model_name} did not respond within {deadline - start:.1f}s")
+            if hedge_at and (time.monotonic() >= hedge_at or not futures):
+                # hedge a slow primary, or fail over from a failed one
+                futures[executor.submit(hedge.attempt, input, config, deadline=deadline, **kwargs)] = hedge
+                record_hedge(self.model_name, "sent")
+                hedge_at = None
+
+        raise errors[0]
+
+    def stream(self, input, config=None, **kwargs):
+        breaker = get_circuit_breaker(self.provider)
+        breaker.before_call()
+        start = time.perf_counter()
+        usage = None
+        try:
+            for index, chunk in enumerate(self.llm.stream(input, config, **kwargs)):
+                if index == 0:
+                    record_llm_first_token(self.model_name, time.perf_counter() - start)
+                if getattr(chunk, "usage_metadata", None):
+                    usage = chunk
+                yield chunk
+        except ProviderBusy:
+            breaker.record_neutral()
+            record_llm_call(self.model_name, "stream", "busy", time.perf_counter() - start)
+            raise
+        except GeneratorExit:
+            breaker.record_neutral()
+            raise
+        except Exception:
+            breaker.record_failure()
+            record_llm_call(self.model_name, "stream", "error", time.perf_counter() - start)
+            raise
+        breaker.record_success()
+        self.tracker.record(self.model_name, (time.perf_counter() - start) * 1000)
+        # providers report usage once, on the last chunk
+        record_llm_call(self.model_name, "stream", "ok", time.perf_counter() - start, message=usage)
+
+    def __getattr__(self, attr):
+        return getattr(self.llm, attr)
+
+
+def get_resilience_stats() -> dict:
+    """Latency percentiles and timeouts per model, circuit states per provider and hedge counts"""
+    with _lock:
+        circuit_breakers = dict(_circuit_breakers)
+        hedges = {model_name: dict(stats) for model_name, stats in _hedge_stats.items()}
+    return {
+        "latency": latency_tracker.get_stats(),
+        "circuits": {provider: breaker.get_stats() for provider, breaker in circuit_breakers.items()},
+        "hedges": hedges,
+    }
@@ -1,25 +1,61 @@
-from flask import Blueprint, jsonify, request, current_app
+import json
+import time
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
 
 from src.ai_models import (
+    get_model,
     generate_prompt_question,
     generate_response_with_context,
+    generate_responses_as_completed,
+    get_completion_cache_key,
+    get_prompt_question_cache_key,
+    run_chain_completion,
+    stream_completion_events,
 )
+from src.jobs import QueueFull
+from src.llm_cache import is_cache_bypassed
+from src.providers import ProviderBusy, get_provider_stats
+from src.resilience import ModelTimeout, get_resilience_stats
+from src.wire_format import encode_response
 
 
 api_routes = Blueprint("api_routes", __name__)
+api_routes.after_request(encode_response)
 
 
 @api_routes.route("/v1/prompt", methods=["POST"])
 def generate_prompt():
     """Generate a prompt, given context"""
     data = request.json
+    llm_cache = current_app.config['LLM_CACHE']
+    r = current_app.config.get('REDIS')
+    parent_nodes = data.get("parentNodes", [])
+
+    # without context, any pre-generated suggestion will do
+    prompt_pool = current_app.config.get('PROMPT_POOL')
+    if prompt_pool and not parent_nodes and not is_cache_bypassed(request):
+        try:
+            prompt_question = prompt_pool.pop()
+        except Exception as e:
+            print(f"Failed to pop a pooled prompt suggestion: {e}")
+            prompt_question = None
+        if prompt_question is not None:
+            return jsonify({"prompt": prompt_question}), 200, {"X-Cache": "pool"}
 
     try:
-        prompt_question = generate_prompt_question(data.get("parentNodes", []))
+        prompt_question, cache_status = llm_cache.get_or_compute(
+            get_prompt_question_cache_key(parent_nodes),
+            lambda: generate_prompt_question(parent_nodes, redis=r),
+            bypass=is_cache_bypassed(request),
+        )
+    except ProviderBusy as e:
+        return jsonify({"error": "Model provider is busy, try again"}), 503, {"Retry-After": "1"}
+    except ModelTimeout as e:
+        return jsonify({"error": "Model timed out"}), 504
     except Exception as e:
         return jsonify({"error": "Internal Server Error"}), 500
     
-    return jsonify({"prompt": prompt_question}), 200
+    return jsonify({"prompt": prompt_question}), 200, {"X-Cache": cache_status}
 
 
 @api_routes.route("/v1/completion", methods=["POST"])
@@ -32,58 +68,289 @@ def generate():
         if key not in data:
             return jsonify({"error": f"{key} is required"}), 400
 
+    llm_cache = current_app.config['LLM_CACHE']
+    r = current_app.config.get('REDIS')
+    parent_nodes = data.get("parentNodes", [])
+
+    try:
+        prompt_completion, cache_status = llm_cache.get_or_compute(
+            get_completion_cache_key(model, prompt, parent_nodes),
+            lambda: generate_response_with_context(
+                model=model,
+                prompt=prompt,
+                parent_nodes=parent_nodes,
+                redis=r,
+            ),
+            bypass=is_cache_bypassed(request),
+        )
+    except ValueError as e:
+        return jsonify({"error": "Input Error"}), 400
+    except ProviderBusy as e:
+        return jsonify({"error": "Model provider is busy, try again"}), 503, {"Retry-After": "1"}
+    except ModelTimeout as e:
+        return jsonify({"error": "Model timed out"}), 504
+    except Exception as e:
+        return jsonify({"error": "Internal Server Error"}), 500
+    
+    return jsonify(prompt_completion), 200, {"X-Cache": cache_status}
+
+
+@api_routes.route("/v1/cache/stats", methods=["GET"])
+def cache_stats():
+    """LLM response cache hit/miss counters, for this process and shared across workers"""
+    llm_cache = current_app.config['LLM_CACHE']
+    return jsonify(llm_cache.get_stats()), 200
+
+
+@api_routes.route("/v1/providers/stats", methods=["GET"])
+def provider_stats():
+    """
+    Per-provider and per-model concurrency and queue counters, HTTP pool sizes,
+    model latencies and timeouts, circuit breaker states and hedge counts, for this process
+    """
+    return jsonify({**get_provider_stats(), **get_resilience_stats()}), 200
+
+
+@api_routes.route("/v1/completion/stream", methods=["POST"])
+def generate_stream():
+    """
+    Stream prompt response tokens as Server-Sent Events, given a prompt.
+    Sends a "token" event per token and a final "done" event with the full response.
+    """
+    data = request.json
+    r = current_app.config.get('REDIS')
+    for key in ["model", "prompt", "nodeId"]:
+        if key not in data:
+            return jsonify({"error": f"{key} is required"}), 400
+    model, prompt = data["model"], data["prompt"]
+
     try:
-        prompt_completion = generate_response_with_context(
+        get_model(model)
+    except ValueError as e:
+        return jsonify({"error": "Input Error"}), 400
+
+    def event_stream():
+        try:
+            for event, payload in stream_completion_events(
+                model=model,
+                prompt=prompt,
+                parent_nodes=data.get("parentNodes", []),
+                redis=r,
+            ):
+                yield format_sse(event, {"nodeId": data["nodeId"], **payload})
+        except ProviderBusy as e:
+            yield format_sse("error", {"nodeId": data["nodeId"], "error": "Model provider is busy, try again"})
+        except ModelTimeout as e:
+            yield format_sse("error", {"nodeId": data["nodeId"], "error": "Model timed out"})
+        except Exception as e:
+            yield format_sse("error", {"nodeId": data["nodeId"], "error": "Internal Server Error"})
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+MAX_MULTI_COMPLETION_MODELS = 8
+
+
+@api_routes.route("/v1/completion/multi", methods=["POST"])
+def generate_multi():
+    """
+    Generate responses to one prompt from several models at once, as Server-Sent Events.
+    Sends a "result" (or "error") event per model in the order they finish, then a "done" event.
+    Expect request.json to be in format:
+    {
+        prompt: str,
+        models: str[],
+        parentNodes?: Node[],
+        nodeIds?: { <model>: str },
+    }
+    """
+    data = request.json
+    for key in ["prompt", "models"]:
+        if key not in data:
+            return jsonify({"error": f"{key} is required"}), 400
+    models = list(dict.fromkeys(data["models"]))
+    if not models or len(models) > MAX_MULTI_COMPLETION_MODELS:
+        return jsonify({"error": f"models must list 1 to {MAX_MULTI_COMPLETION_MODELS} models"}), 400
+
+    try:
+        for model in models:
+            get_model(model)
+    except ValueError as e:
+        return jsonify({"error": "Input Error"}), 400
+
+    prompt = data["prompt"]
+    parent_nodes = data.get("parentNodes", [])
+    node_ids = data.get("nodeIds") or {}
+    llm_cache = current_app.config['LLM_CACHE']
+    r = current_app.config.get('REDIS')
+    bypass = is_cache_bypassed(request)
+
+    def call(model, compute):
+        return llm_cache.get_or_compute(
+            get_completion_cache_key(model, prompt, parent_nodes),
+            compute,
+            bypass=bypass,
+        )
+
+    def event_stream():
+        start = time.perf_counter()
+        try:
+            for model, result, error in generate_responses_as_completed(
+                models=models,
+                prompt=prompt,
+                parent_nodes=parent_nodes,
+                redis=r,
+                call=call,
+            ):
+                payload = {"model": model, "nodeId": node_ids.get(model)}
+                if error is None:
+                    yield format_sse("result", {**payload, **result})
+                elif isinstance(error, ProviderBusy):
+                    yield format_sse("error", {**payload, "error": "Model provider is busy, try again"})
+                elif isinstance(error, ModelTimeout):
+                    yield format_sse("error", {**payload, "error": "Model timed out"})
+                else:
+                    yield format_sse("error", {**payload, "error": "Internal Server Error"})
+        except Exception as e:
+            yield format_sse("error", {"model": None, "error": "Internal Server Error"})
+        yield format_sse("done", {"totalMs": round((time.perf_counter() - start) * 1000, 2)})
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+def format_sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@api_routes.route("/v1/chain-completion", methods=["POST"])
+def generate_chain():
+    """
+    Generate a prompt response along with its chain of ancestor responses.
+    Only ancestors whose inputs changed since their last run are sent to a model.
+    """
+    r = current_app.config.get('REDIS')
+    if not r:
+        return jsonify({"error": "Chained completions require Redis"}), 503
+
+    data = request.json
+    for key in ["model", "prompt", "nodeId"]:
+        if key not in data:
+            return jsonify({"error": f"{key} is required"}), 400
+    model, prompt, node_id = data["model"], data["prompt"], data["nodeId"]
+    canvas_id = data.get("canvasId")
+
+    try:
+        chain_completion = run_chain_completion(
+            r,
+            node_id=node_id,
             model=model,
             prompt=prompt,
-            parent_nodes=data.get("parentNodes", []),
+            parent_node_ids=[parent["id"] for parent in data.get("parentNodes", [])],
+            canvas_id=canvas_id,
         )
     except ValueError as e:
         return jsonify({"error": "Input Error"}), 400
+    except ProviderBusy as e:
+        return jsonify({"error": "Model provider is busy, try again"}), 503, {"Retry-After": "1"}
+    except ModelTimeout as e:
+        return jsonify({"error": "Model timed out"}), 504
     except Exception as e:
         return jsonify({"error": "Internal Server Error"}), 500
-    
-    return jsonify({"response": prompt_completion}), 200
 
+    return jsonify(chain_completion), 200
 
-# @api_routes.route("/v1/chain-completion", methods=["POST"])
-# def generate_chain():
-#     """Given chain prompt responses, given a prompt"""
-#     r = current_app.config['REDIS']
 
-#     data = request.json
-#     model, prompt, node_id = data["model"], data["prompt"], data["nodeId"]
-#     for key in ["model", "prompt", "nodeId"]:
-#         if key not in data:
-#             return jsonify({"error": f"{key} is required"}), 400
-    
-#     try:
-#         parent_node_ids = [parent["id"] for parent in data.get("parentNodes", [])]
-#         chained_responses = generate_chained_responses(redis=r, cur_node={
-#             "id": node_id,
-#             "model": model,
-#             "prompt": prompt,
-#             "parent_ids": parent_node_ids,
-#         })
-        
-#         pipe = r.pipeline()
-#         for output_key, response in chained_responses.items():
-#             if output_key.startswith("node-output-"):
-#                 key = output_key.replace("node-output-", "node:")
-#                 if key == f"node:{node_id}":
-#                     pipe.hset(f"node:{node_id}", mapping={
-#                         "model": model,
-#                         "prompt": prompt,
-#                         "parent_ids": json.dumps(parent_node_ids or []),
-#                         "prompt_response": response,
-#                     })
-#                 else:
-#                     pipe.hset(key, "prompt_response", response)
-#         pipe.execute()
-
-#     except ValueError as e:
-#         return jsonify({"error": "Input Error"}), 400
-#     except Exception as e:
-#         return jsonify({"error": "Internal Server Error"}), 500
-
-#     return jsonify({"response": chained_responses[f"node-output-{node_id}"]}), 200
+@api_routes.route("/v1/jobs/<job_type>", methods=["POST"])
+def enqueue_job(job_type):
+    """
+    Queue a completion or chain completion to run in the background, returning its job id.
+    The response is written to the node:{id} hash and pushed to the node's subscribers.
+    Expect request.json to be in format:
+    {
+        model: str,
+        prompt: str,
+        nodeId: str,
+        parentNodes?: Node[],
+        canvasId?: str,
+        priority?: "high" | "normal" | "low",
+    }
+    """
+    job_queue = current_app.config.get('JOB_QUEUE')
+    if not job_queue:
+        return jsonify({"error": "Job queue is not enabled"}), 503
+
+    job_types = {"completion": "completion", "chain-completion": "chain_completion"}
+    if job_type not in job_types:
+        return jsonify({"error": f"Unsupported job type: {job_type}"}), 404
+
+    data = request.json
+    for key in ["model", "prompt", "nodeId"]:
+        if key not in data:
+            return jsonify({"error": f"{key} is required"}), 400
+
+    try:
+        get_model(data["model"])
+        job_id = job_queue.enqueue(
+            job_types[job_type],
+            {
+                "model": data["model"],
+                "prompt": data["prompt"],
+                "nodeId": data["nodeId"],
+                "parentNodes": data.get("parentNodes", []),
+                "canvasId": data.get("canvasId"),
+            },
+            priority=data.get("priority", "normal"),
+        )
+    except ValueError as e:
+        return jsonify({"error": "Input Error"}), 400
+    except QueueFull as e:
+        return jsonify({"error": "Too many queued jobs, try again later"}), 429, {"Retry-After": "5"}
+    except Exception as e:
+        return jsonify({"error": "Internal Server Error"}), 500
+
+    return jsonify({"jobId": job_id}), 202
+
+
+@api_routes.route("/v1/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Job status: queued, running, retrying, succeeded or failed, with its result or error"""
+    job_queue = current_app.config.get('JOB_QUEUE')
+    if not job_queue:
+        return jsonify({"error": "Job queue is not enabled"}), 503
+
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} does not exist"}), 404
+
+    return jsonify({
+        "jobId": job["id"],
+        "type": job["type"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "waitMs": job["started_at"] - job["created_at"] if "started_at" in job else None,
+    }), 200
+
+
+@api_routes.route("/v1/jobs/stats", methods=["GET"])
+def job_stats():
+    """Queue depth per priority, running and delayed jobs, wait times and outcome counters"""
+    job_queue = current_app.config.get('JOB_QUEUE')
+    if not job_queue:
+        return jsonify({"error": "Job queue is not enabled"}), 503
+    return jsonify(job_queue.get_stats()), 200
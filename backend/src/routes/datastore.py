@@ -1,14 +1,66 @@
+import os
 from datetime import datetime
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app
+from src.db.canvas_index import intersects, node_rect, parse_viewport
+from src.db.node_graph import SYNCED_NODE_FIELDS, is_stale_tracking_enabled, sync_canvas_nodes
 from src.db.firestore import (
-    get_document_by_collection_and_id,
-    save_document_in_collection,
-    update_document_in_collection,
+    DELETE_FIELD,
+    get_canvas_document,
+    get_canvas_nodes,
+    get_canvas_viewport_document,
+    save_canvas_document,
+    update_canvas_fields,
 )
+from src.db.write_behind import apply_field_updates
 from src.routes.validation.validate import validate_json, OptionalField
+from src.wire_format import encode_response, representation_etag
 
 
 ds_routes = Blueprint("ds_routes", __name__)
+ds_routes.after_request(encode_response)
+
+
+NODE_SCHEMA = {
+    'id': str,
+    'type': str,
+    'position': {
+        'x': (int, float),
+        'y': (int, float),
+    },
+    'data': {
+        'model': str,
+        'prompt': str,
+        'prompt_response': str,
+        'parent_ids': [str],
+        'canvasId': str,
+    },
+    'selected': bool,
+    'measured': {
+        'width': (int, float),
+        'height': (int, float),
+    },
+    'origin': [(int, float)],
+}
+
+
+# Node fields read below CANVAS_DETAIL_ZOOM, where prompts and responses are too small to read
+NODE_SUMMARY_FIELDS = ['id', 'type', 'position', 'measured', 'selected', 'origin', 'data.model', 'data.parent_ids', 'data.canvasId']
+PARENT_STUB_FIELDS = ['id', 'position', 'measured']
+
+
+# Partial node: every field except id may be omitted, and data may be partial too
+NODE_UPDATE_SCHEMA = {
+    'id': str,
+    'type': OptionalField(str),
+    'position': OptionalField(NODE_SCHEMA['position']),
+    'data': OptionalField({
+        field: OptionalField(field_type)
+        for field, field_type in NODE_SCHEMA['data'].items()
+    }),
+    'selected': OptionalField(bool),
+    'measured': OptionalField(NODE_SCHEMA['measured']),
+    'origin': OptionalField(NODE_SCHEMA['origin']),
+}
 
 
 @ds_routes.route("/v1/canvases", methods=["POST"])
@@ -17,32 +69,14 @@ def canvases_operations():
     Routes to read/write to canvases collection
     """
     db = current_app.config['FIRESTORE']
+    write_buffer = current_app.config.get('WRITE_BUFFER')
+    canvas_cache = current_app.config['CANVAS_CACHE']
 
     @validate_json({
         'canvasId': str,
         'title': OptionalField(str),
         'description': OptionalField(str),
-        'nodes': [{
-            'id': str,
-            'type': str,
-            'position': {
-                'x': (int, float),
-                'y': (int, float),
-            },
-            'data': {
-                'model': str,
-                'prompt': str,
-                'prompt_response': str,
-                'parent_ids': [str],
-                'canvasId': str,
-            },
-            'selected': bool,
-            'measured': {
-                'width': (int, float),
-                'height': (int, float),
-            },
-            'origin': [(int, float)],
-        }],
+        'nodes': [NODE_SCHEMA],
         'createdBy': OptionalField(str),
     })
     def save_canvas():
@@ -59,23 +93,27 @@ def canvases_operations():
         """
         data = request.json
         try:
-            doc_id = save_document_in_collection(
+            doc_id = save_canvas_document(
                 db,
                 "canvases",
                 {
                     "canvas_id": data["canvasId"],
                     "title": data.get("title"),
                     "description": data.get("description"),
-                    "nodes": transform_nodes_arr_to_map(data["nodes"]),
                     "created_by": data.get("createdBy"),
                     "created_at": datetime.now(),
                     "updated_at": datetime.now(),
                 },
+                transform_nodes_arr_to_map(data["nodes"]),
                 doc_id=data["canvasId"]
             )
+            if write_buffer:
+                write_buffer.discard(doc_id)
+            canvas_cache.invalidate(doc_id)
         except Exception as e:
             return jsonify({"error": "Internal Server Error"}), 500
-        
+
+        sync_node_changes(doc_id, {node["id"]: node.get("data") for node in data["nodes"]})
         return jsonify({"document_id": doc_id}), 200
 
 
@@ -85,50 +123,128 @@ def canvases_operations():
         return jsonify({"error": "Internal Server Error"}), 500
 
 
-@ds_routes.route("/v1/canvases/<canvas_id>", methods=["GET", "PUT"])
+@ds_routes.route("/v1/canvases/<canvas_id>", methods=["GET", "PUT", "PATCH"])
 def canvas_operations(canvas_id):
     """
     Routes to read/write to single canvas in collection
     """
     db = current_app.config['FIRESTORE']
+    write_buffer = current_app.config.get('WRITE_BUFFER')
+    canvas_cache = current_app.config['CANVAS_CACHE']
 
     def get_canvas(id):
-        """Get a canvas document from datastore"""
+        """
+        Get a canvas document from datastore, including any mutations not flushed yet.
+        Serialized responses are cached per canvas version, which is also the ETag,
+        so a matching If-None-Match gets a 304 without reading Firestore.
+        With ?bbox=minX,minY,maxX,maxY only the nodes in that viewport are returned, see get_canvas_viewport.
+        """
+        if request.args.get("bbox"):
+            return get_canvas_viewport(id)
         try:
-            canvas_doc = get_document_by_collection_and_id(db, "canvases", id)
-            canvas_doc["nodes"] = transform_nodes_map_to_arr(canvas_doc["nodes"])
+            version = canvas_cache.get_version(id)
+            etag = representation_etag(canvas_cache.get_etag(id, version))
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            body = canvas_cache.get(id, version)
+            if body is None:
+                # read staged mutations first, so a flush in between cannot hide them
+                staged_updates = write_buffer.get_staged_updates(id) if write_buffer else {}
+                canvas_doc = get_canvas_document(db, "canvases", id)
+                apply_field_updates(canvas_doc, staged_updates)
+                canvas_doc["nodes"] = transform_nodes_map_to_arr(canvas_doc["nodes"])
+                body = jsonify({"document": canvas_doc}).get_data()
+                canvas_cache.set(id, version, body)
         except ValueError as e:
             return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": "Internal Server Error"}), 500
         
-        return jsonify({"document": canvas_doc}), 200
+        response = Response(body, status=200, mimetype="application/json")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+    def get_canvas_viewport(id):
+        """
+        Get the nodes of a canvas intersecting a viewport, looked up in the canvas' grid index,
+        plus position-only stubs of their parents outside it so edges can still be drawn.
+        ?zoom below CANVAS_DETAIL_ZOOM leaves out prompts and responses.
+        Responses are not cached, but their ETag follows the canvas version like full reads.
+        Response format:
+        {
+            document: { ...canvas, nodes: Node[] },
+            parentStubs: { id, position, measured }[],
+        }
+        """
+        try:
+            viewport = parse_viewport(request.args["bbox"])
+            zoom = float(request.args.get("zoom", 1))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        summary = zoom < float(os.getenv("CANVAS_DETAIL_ZOOM", 0.5))
+
+        try:
+            version = canvas_cache.get_version(id)
+            etag = representation_etag(f"{canvas_cache.get_etag(id, version)}-{request.args['bbox']}-{'summary' if summary else 'detail'}")
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            staged_updates = write_buffer.get_staged_updates(id) if write_buffer else {}
+            if ("nodes",) in staged_updates:
+                canvas_doc = get_canvas_document(db, "canvases", id)
+            else:
+                # staged nodes may have moved into the viewport since they were indexed
+                staged_node_ids = {path[1] for path in staged_updates if path[0] == "nodes" and len(path) > 1}
+                canvas_doc = get_canvas_viewport_document(
+                    db, "canvases", id, viewport,
+                    field_paths=NODE_SUMMARY_FIELDS if summary else None,
+                    extra_node_ids=staged_node_ids,
+                )
+            apply_field_updates(canvas_doc, staged_updates)
+            nodes = {
+                node_id: to_node_summary(node) if summary else node
+                for node_id, node in canvas_doc["nodes"].items()
+                if intersects(node_rect(node), viewport)
+            }
+
+            parent_ids = {
+                parent_id
+                for node in nodes.values()
+                for parent_id in node.get("data", {}).get("parent_ids", [])
+                if parent_id not in nodes
+            }
+            known_parents = {parent_id: canvas_doc["nodes"][parent_id] for parent_id in parent_ids if parent_id in canvas_doc["nodes"]}
+            parents = {
+                **get_canvas_nodes(db, "canvases", id, list(parent_ids - set(known_parents)), field_paths=PARENT_STUB_FIELDS),
+                **known_parents,
+            }
+            canvas_doc["nodes"] = transform_nodes_map_to_arr(nodes)
+            parent_stubs = [
+                {field: parent[field] for field in PARENT_STUB_FIELDS if field in parent}
+                for parent in parents.values()
+            ]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": "Internal Server Error"}), 500
+
+        response = jsonify({"document": canvas_doc, "parentStubs": parent_stubs})
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
     
     
     @validate_json({
         'title': OptionalField(str),
         'description': OptionalField(str),
-        'nodes': OptionalField([{
-            'id': str,
-            'type': str,
-            'position': {
-                'x': (int, float),
-                'y': (int, float),
-            },
-            'data': {
-                'model': str,
-                'prompt': str,
-                'prompt_response': str,
-                'parent_ids': [str],
-                'canvasId': str,
-            },
-            'selected': bool,
-            'measured': {
-                'width': (int, float),
-                'height': (int, float),
-            },
-            'origin': [(int, float)],
-        }]),
+        'nodes': OptionalField([NODE_SCHEMA]),
     })
     def update_canvas(id):
         """
@@ -142,15 +258,89 @@ def canvas_operations(canvas_id):
         """
         data = request.json
         try:
-            data["updated_at"] = datetime.now()
             if "nodes" in data:
                 data["nodes"] = transform_nodes_arr_to_map(data["nodes"])
-            doc_id = update_document_in_collection(db, "canvases", data, doc_id=id)
+            if write_buffer:
+                write_buffer.stage(id, {(field,): value for field, value in data.items()})
+                canvas_cache.invalidate(id)
+                doc_id = id
+            else:
+                data["updated_at"] = datetime.now()
+                doc_id = update_canvas_fields(db, "canvases", {(field,): value for field, value in data.items()}, doc_id=id)
+                canvas_cache.invalidate(id)
         except ValueError as e:
             return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": "Internal Server Error"}), 500
-        
+
+        if "nodes" in data:
+            sync_node_changes(id, {node_id: node.get("data") for node_id, node in data["nodes"].items()})
+        return jsonify({"document_id": doc_id}), 200
+
+
+    @validate_json({
+        'title': OptionalField(str),
+        'description': OptionalField(str),
+        'upserts': OptionalField([NODE_SCHEMA]),
+        'updates': OptionalField([NODE_UPDATE_SCHEMA]),
+        'deletes': OptionalField([str]),
+    })
+    def patch_canvas(id):
+        """
+        Apply per-node changes to a canvas document in datastore,
+        writing only the changed node fields
+        Expect request.json to be in format:
+        {
+            title?: str,
+            description?: str,
+            upserts?: Node[],
+            updates?: Partial<Node>[],
+            deletes?: str[],
+        }
+        """
+        data = request.json
+        try:
+            field_updates = transform_node_changes_to_field_updates(
+                upserts=data.get("upserts", []),
+                updates=data.get("updates", []),
+                deletes=data.get("deletes", []),
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        for field in ["title", "description"]:
+            if field in data:
+                field_updates[(field,)] = data[field]
+
+        try:
+            if write_buffer:
+                # Firestore rejects updates to missing nodes only once they are flushed, so check them now
+                unknown_node_ids = find_unknown_node_ids(
+                    db, id,
+                    {path[1] for path in field_updates if path[0] == "nodes" and len(path) > 2},
+                    write_buffer.get_staged_updates(id),
+                )
+                if unknown_node_ids:
+                    raise ValueError(f"Nodes {', '.join(sorted(unknown_node_ids))} do not exist in canvas {id}")
+                write_buffer.stage(id, field_updates)
+                canvas_cache.invalidate(id)
+                doc_id = id
+            else:
+                field_updates[("updated_at",)] = datetime.now()
+                doc_id = update_canvas_fields(db, "canvases", field_updates, doc_id=id)
+                canvas_cache.invalidate(id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": "Internal Server Error"}), 500
+
+        node_changes = {node["id"]: node.get("data") for node in data.get("upserts", [])}
+        for node_update in data.get("updates", []):
+            if "data" in node_update:
+                node_changes.setdefault(node_update["id"], {}).update(node_update["data"])
+        for node_id in data.get("deletes", []):
+            node_changes[node_id] = None
+        sync_node_changes(id, node_changes)
         return jsonify({"document_id": doc_id}), 200
     
 
@@ -158,11 +348,59 @@ def canvas_operations(canvas_id):
         return get_canvas(canvas_id)
     elif request.method == "PUT":
         return update_canvas(canvas_id)
+    elif request.method == "PATCH":
+        return patch_canvas(canvas_id)
     else:
         return jsonify({"error": "Internal Server Error"}), 500
 
 
 
+@ds_routes.route("/v1/write-behind/stats", methods=["GET"])
+def write_behind_stats():
+    """
+    Write-behind buffer counters: staged save requests versus Firestore document writes
+    """
+    write_buffer = current_app.config.get('WRITE_BUFFER')
+    if not write_buffer:
+        return jsonify({"error": "Write-behind buffer is not enabled"}), 404
+    return jsonify(write_buffer.get_stats()), 200
+
+
+def sync_node_changes(canvas_id, node_changes):
+    """
+    Mirror saved node data to Redis, marking nodes whose inputs changed, and their descendants, stale.
+    node_changes maps node id to its saved (possibly partial) data, or None if deleted.
+    Failures are logged only, the canvas is already saved.
+    """
+    r_client = current_app.config.get('REDIS')
+    if not r_client or not is_stale_tracking_enabled():
+        return
+    node_changes = {
+        node_id: data for node_id, data in node_changes.items()
+        if data is None or any(field in data for field in SYNCED_NODE_FIELDS)
+    }
+    if not node_changes:
+        return
+    try:
+        sync_canvas_nodes(r_client, node_changes, canvas_id=canvas_id)
+    except Exception as e:
+        print(f"Failed to sync nodes of canvas {canvas_id} to Redis: {e}")
+
+
+def find_unknown_node_ids(db, canvas_id, node_ids, staged_updates) -> set:
+    """Ids among node_ids of nodes neither saved in the canvas nor staged in the write-behind buffer"""
+    staged_nodes = staged_updates.get(("nodes",))
+    if isinstance(staged_nodes, dict):
+        return set(node_ids) - set(staged_nodes)
+    staged_node_ids = {path[1] for path in staged_updates if path[0] == "nodes" and len(path) > 1}
+    unknown_node_ids = {node_id for node_id in node_ids if staged_updates.get(("nodes", node_id)) is DELETE_FIELD}
+    unsaved_node_ids = set(node_ids) - staged_node_ids
+    if unsaved_node_ids:
+        saved_nodes = get_canvas_nodes(db, "canvases", canvas_id, list(unsaved_node_ids), field_paths=["id"])
+        unknown_node_ids |= unsaved_node_ids - set(saved_nodes)
+    return unknown_node_ids
+
+
 def transform_nodes_arr_to_map(nodes_arr):
     nodes_map = {}
     for node in nodes_arr:
@@ -175,3 +413,50 @@ def transform_nodes_map_to_arr(nodes_map):
     for node in nodes_map.values():
         nodes.append(node)
     return nodes
+
+
+def to_node_summary(node):
+    """Node without its prompt and response, for zoomed-out viewports"""
+    data = {field: value for field, value in node.get("data", {}).items() if field not in ("prompt", "prompt_response")}
+    return {**node, "data": data}
+
+
+def transform_node_changes_to_field_updates(upserts, updates, deletes):
+    """
+    Map node upserts, partial updates and deletes to Firestore field path updates,
+    e.g. {("nodes", <id>, "position"): {...}}
+    """
+    field_updates = {}
+    upserted_nodes = {}
+    for node in upserts:
+        upserted_nodes[node["id"]] = node
+        field_updates[("nodes", node["id"])] = node
+
+    for node_update in updates:
+        node_id = node_update["id"]
+        if node_id in upserted_nodes:
+            # merge into the upserted node, Firestore rejects overlapping field paths
+            upserted_node = upserted_nodes[node_id]
+            for field, value in node_update.items():
+                if field == "data":
+                    upserted_node["data"].update(value)
+                else:
+                    upserted_node[field] = value
+            continue
+
+        for field, value in node_update.items():
+            if field == "id":
+                continue
+            if field == "data":
+                for data_field, data_value in value.items():
+                    field_updates[("nodes", node_id, "data", data_field)] = data_value
+            else:
+                field_updates[("nodes", node_id, field)] = value
+
+    updated_node_ids = set(upserted_nodes) | {node_update["id"] for node_update in updates}
+    for node_id in deletes:
+        if node_id in updated_node_ids:
+            raise ValueError(f"Node {node_id} cannot be both deleted and updated")
+        field_updates[("nodes", node_id)] = DELETE_FIELD
+
+    return field_updates
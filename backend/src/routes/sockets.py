@@ -1,42 +1,86 @@
 from flask import Blueprint, request, current_app
+from flask_socketio import emit, join_room, leave_room
+
+from src.ai_models import get_model, stream_completion_events
+from src.metrics import record_socketio_emit, socketio_connected_clients
+from src.providers import ProviderBusy
+from src.redis_listener import is_update_channel
+from src.resilience import ModelTimeout
+from src.structured_log import log_event
 
 socket_routes = Blueprint("socket_routes", __name__)
 
 from src.app import socketio
 
-client_subscriptions = {}
 
 @socketio.on("connect")
 def handle_connect():
-    print(f"Client {request.sid} connected")
+    socketio_connected_clients.inc()
+    log_event("client_connected", sid=request.sid)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print(f"Client {request.sid} disconnected")
-    pubsub = current_app.config['PUBSUB']
-
-    channels = client_subscriptions.pop(request.sid, [])
-    for channel in channels:
-        pubsub.unsubscribe(channel)
+    socketio_connected_clients.dec()
+    log_event("client_disconnected", sid=request.sid)
+    subscriptions = current_app.config.get('PUBSUB_SUBSCRIPTIONS')
+    if subscriptions:
+        subscriptions.remove_client(request.sid)
 
 
 @socketio.on("subscribe")
 def handle_redis_subscribe(channel):
-    print(f"Client {request.sid} subscribed to {channel}")
-    pubsub = current_app.config['PUBSUB']
+    """Join the room for a node:{id}:update or canvas:{id}:update channel"""
+    subscriptions = current_app.config.get('PUBSUB_SUBSCRIPTIONS')
+    if not subscriptions or not is_update_channel(channel):
+        return
 
-    if request.sid not in client_subscriptions:
-        client_subscriptions[request.sid] = []
-    client_subscriptions[request.sid].append(channel)
-    pubsub.subscribe(channel)
+    log_event("client_subscribed", sid=request.sid, channel=channel)
+    join_room(channel)
+    subscriptions.add(request.sid, channel)
 
 
 @socketio.on("unsubscribe")
 def handle_redis_unsubscribe(channel):
-    print(f"Client {request.sid} unsubscribed from {channel}")
-    pubsub = current_app.config['PUBSUB']
-    
-    if request.sid in client_subscriptions and channel in client_subscriptions[request.sid]:
-        client_subscriptions[request.sid].remove(channel)
-        pubsub.unsubscribe(channel)
+    subscriptions = current_app.config.get('PUBSUB_SUBSCRIPTIONS')
+    if not subscriptions:
+        return
+
+    log_event("client_unsubscribed", sid=request.sid, channel=channel)
+    if subscriptions.remove(request.sid, channel):
+        leave_room(channel)
+
+
+@socketio.on("completion")
+def handle_completion_stream(data):
+    """
+    Stream prompt response tokens back to the requesting client.
+    Emits "completion:token" per token and a final "completion:done" with the full response.
+    """
+    for key in ["model", "prompt", "nodeId"]:
+        if key not in data:
+            emit("completion:error", {"nodeId": data.get("nodeId"), "error": f"{key} is required"})
+            return
+
+    node_id = data["nodeId"]
+    try:
+        get_model(data["model"])
+    except ValueError as e:
+        emit("completion:error", {"nodeId": node_id, "error": "Input Error"})
+        return
+
+    try:
+        for event, payload in stream_completion_events(
+            model=data["model"],
+            prompt=data["prompt"],
+            parent_nodes=data.get("parentNodes", []),
+            redis=current_app.config.get('REDIS'),
+        ):
+            emit(f"completion:{event}", {"nodeId": node_id, **payload})
+            record_socketio_emit(f"completion:{event}")
+    except ProviderBusy as e:
+        emit("completion:error", {"nodeId": node_id, "error": "Model provider is busy, try again"})
+    except ModelTimeout as e:
+        emit("completion:error", {"nodeId": node_id, "error": "Model timed out"})
+    except Exception as e:
+        emit("completion:error", {"nodeId": node_id, "error": "Internal Server Error"})
@@ -2,6 +2,8 @@ from flask import request, jsonify
 from functools import wraps
 from typing import Callable, Dict, List, Any
 
+from src.metrics import observe_schema_validation
+
 
 class OptionalField:
     def __init__(self, field_type):
@@ -12,16 +14,21 @@ def validate_json(required_fields: Dict[str, Any]):
     """
     Decorator to validate JSON request body against required fields and their types/schemas.
     Supports nested objects and arrays of structured objects.
+    The schema is compiled once, valid bodies only go through the compiled checks,
+    and error messages are only built for invalid bodies.
     """
+    is_valid = _compile_schema(required_fields)
+
     def decorator(f: Callable):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if not request.is_json:
-                return jsonify({"error": "Request must be JSON"}), 400
+            # MessagePack bodies are decoded by get_json() too, see src/wire_format.py
+            if not (request.is_json or request.is_msgpack):
+                return jsonify({"error": "Request must be JSON or MessagePack"}), 400
 
             data = request.get_json()
-            errors = _validate_schema(data, required_fields)
-
+            with observe_schema_validation(f.__name__):
+                errors = _validate_schema(data, required_fields) if not is_valid(data) else None
             if errors:
                 return jsonify({"errors": errors}), 400
 
@@ -30,6 +37,84 @@ def validate_json(required_fields: Dict[str, Any]):
     return decorator
 
 
+def _compile_schema(schema: Any) -> Callable[[Any], bool]:
+    """
+    Compile a schema (see _validate_schema) into a function returning whether data matches it.
+    Type checks are inlined where possible so valid data is checked without building paths or lists.
+    """
+    if isinstance(schema, dict):
+        fields = []
+        for field, field_type in schema.items():
+            is_optional = isinstance(field_type, OptionalField)
+            expected_type = field_type.field_type if is_optional else field_type
+            types = _as_types(expected_type)
+            check = None if types else _compile_schema(expected_type)
+            fields.append((field, is_optional, types, check))
+        fields = tuple(fields)
+        allowed_fields = frozenset(schema)
+
+        def check_dict(data):
+            if not isinstance(data, dict):
+                return False
+            for field, is_optional, types, check in fields:
+                if field not in data:
+                    if is_optional:
+                        continue
+                    return False
+                if types:
+                    if not isinstance(data[field], types):
+                        return False
+                elif not check(data[field]):
+                    return False
+            if len(data) > len(allowed_fields):
+                return False
+            for field in data:
+                if field not in allowed_fields:
+                    return False
+            return True
+        return check_dict
+
+    elif isinstance(schema, list):
+        if len(schema) != 1:
+            return lambda data: False
+
+        item_types = _as_types(schema[0])
+        if item_types:
+            def check_typed_list(data):
+                if not isinstance(data, list):
+                    return False
+                for item in data:
+                    if not isinstance(item, item_types):
+                        return False
+                return True
+            return check_typed_list
+
+        check_item = _compile_schema(schema[0])
+
+        def check_list(data):
+            if not isinstance(data, list):
+                return False
+            for item in data:
+                if not check_item(item):
+                    return False
+            return True
+        return check_list
+
+    types = _as_types(schema)
+    if types:
+        return lambda data: isinstance(data, types)
+    return lambda data: False
+
+
+def _as_types(schema: Any):
+    """Return schema as an isinstance() argument if it is a type or tuple of types, else None"""
+    if isinstance(schema, type):
+        return schema
+    if isinstance(schema, tuple) and schema and all(isinstance(t, type) for t in schema):
+        return schema
+    return None
+
+
 def _validate_schema(data: Any, schema: Any, path: str = "") -> List[str]:
     """
     Recursively validate data against a schema.
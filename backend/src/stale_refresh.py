@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import time
+
+from src.ai_models import run_chain_completion
+from src.dag_executor import run_dag
+from src.db.node_graph import STALE_NODES_KEY
+from src.redis_listener import LeaderLock
+from src.structured_log import log_event
+
+
+REFRESH_NODE_FIELDS = ["model", "prompt", "parent_ids", "canvas_id", "stale"]
+
+
+class StaleNodeRefresher:
+    """
+    Background pass recomputing stale nodes (see src/db/node_graph.py), oldest marks first.
+    Every interval seconds, up to batch_size due nodes are recomputed in dependency order:
+    a node starts once its stale parents in the batch are done, so its chain reuses their
+    new responses, and independent nodes run concurrently.
+    Only the stale nodes themselves are generated. Their ancestors are fixed input, read from
+    their stored responses, so a refresh never replaces the response of a node that is not stale.
+    Each new response goes through publish_node_update, which notifies subscribers and
+    clears the stale mark. Failed nodes are retried after retry_delay seconds.
+    Only one process refreshes at a time, elected with a Redis lock.
+    """
+    def __init__(self, redis, interval=None, batch_size=None, retry_delay=None, max_concurrency=None):
+        self.redis = redis
+        self.interval = interval or float(os.getenv("STALE_REFRESH_INTERVAL", 2))
+        self.batch_size = batch_size or int(os.getenv("STALE_REFRESH_BATCH", 50))
+        self.retry_delay = retry_delay or float(os.getenv("STALE_REFRESH_RETRY_DELAY", 30))
+        self.max_concurrency = max_concurrency
+        self.leader_lock = LeaderLock(redis, key="stale_refresh:leader", ttl=max(self.interval * 3, 10))
+        self.stop_signal = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_signal.clear()
+        self.thread = threading.Thread(target=self._run, name="stale-refresher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_signal.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.leader_lock.release()
+
+    def _run(self):
+        while not self.stop_signal.wait(self.interval):
+            try:
+                if self.leader_lock.acquire():
+                    self.refresh()
+            except Exception as e:
+                print(f"Stale node refresh failed: {e}")
+
+    def refresh(self) -> int:
+        """Recompute the due stale nodes of one batch. Returns the number of nodes refreshed."""
+        now = int(time.time() * 1000)
+        node_ids = [
+            node_id.decode("utf-8")
+            for node_id in self.redis.zrangebyscore(STALE_NODES_KEY, "-inf", now, start=0, num=self.batch_size)
+        ]
+        if not node_ids:
+            return 0
+
+        pipe = self.redis.pipeline(transaction=False)
+        for node_id in node_ids:
+            pipe.hmget(f"node:{node_id}", REFRESH_NODE_FIELDS)
+        nodes = []
+        dropped_node_ids = []
+        for node_id, values in zip(node_ids, pipe.execute()):
+            node = {field: value.decode("utf-8") for field, value in zip(REFRESH_NODE_FIELDS, values) if value is not None}
+            # refreshed since it was queued, or never generated by a model
+            if "stale" not in node or "model" not in node or "prompt" not in node:
+                dropped_node_ids.append(node_id)
+                continue
+            nodes.append({**node, "id": node_id, "parent_ids": json.loads(node.get("parent_ids", "[]"))})
+        if dropped_node_ids:
+            self.redis.zrem(STALE_NODES_KEY, *dropped_node_ids)
+
+        def refresh_node(node, parent_results):
+            start = time.perf_counter()
+            try:
+                result = run_chain_completion(
+                    self.redis,
+                    node_id=node["id"],
+                    model=node["model"],
+                    prompt=node["prompt"],
+                    parent_node_ids=node["parent_ids"],
+                    canvas_id=node.get("canvas_id"),
+                    reuse_ancestor_responses=True,
+                )
+            except ValueError as e:
+                # the node or one of its ancestors cannot be generated, retrying will not help
+                print(f"Dropping stale node {node['id']}: {e}")
+                self.redis.zrem(STALE_NODES_KEY, node["id"])
+                return {"refreshed": False}
+            except Exception as e:
+                print(f"Failed to refresh stale node {node['id']}: {e}")
+                retry_at = int((time.time() + self.retry_delay) * 1000)
+                self.redis.zadd(STALE_NODES_KEY, {node["id"]: retry_at}, xx=True)
+                return {"refreshed": False}
+            log_event(
+                "stale_node_refreshed",
+                node_id=node["id"],
+                recomputed=len(result["recomputed"]),
+                ms=round((time.perf_counter() - start) * 1000, 2),
+            )
+            return {"refreshed": True}
+
+        results = run_dag(nodes, refresh_node, max_concurrency=self.max_concurrency)
+        return sum(result["refreshed"] for result in results.values())
@@ -0,0 +1,16 @@
+import json
+import os
+import random
+import time
+
+
+def log_event(event, sample_rate=None, **fields):
+    """
+    Print a JSON log line for a sampled share of calls, so per-request and per-message
+    logging doesn't flood the logs or slow down hot paths. sample_rate defaults to LOG_SAMPLE_RATE.
+    """
+    if sample_rate is None:
+        sample_rate = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+    if sample_rate < 1 and random.random() >= sample_rate:
+        return
+    print(json.dumps({"event": event, "ts": round(time.time(), 3), "sample_rate": sample_rate, **fields}, default=str))
@@ -0,0 +1,167 @@
+import gzip
+import os
+import zlib
+from datetime import date
+
+import brotli
+import msgpack
+import orjson
+from flask import Request, request
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.http import http_date
+
+
+# Responses are JSON unless the client asks for MessagePack, and are compressed with brotli or gzip
+# when it accepts them. Request bodies may be MessagePack and gzip or brotli encoded too.
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+MSGPACK_MIMETYPES = {MSGPACK_MIMETYPE, "application/x-msgpack", "application/vnd.msgpack"}
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+# Fast settings, as every response is compressed on the fly
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    JSON provider encoding with orjson. Output matches Flask's default provider,
+    dates included, except that keys are not sorted and nothing is indented.
+    """
+    @staticmethod
+    def default(o):
+        if isinstance(o, date):
+            return http_date(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj, default=kwargs.get("default")).decode()
+
+    def dumps_bytes(self, obj, default=None):
+        return orjson.dumps(obj, default=default or self.default, option=ORJSON_OPTIONS)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=JSON_MIMETYPE)
+
+
+class CompactRequest(Request):
+    """
+    Request decoding gzip or brotli request bodies (Content-Encoding), and MessagePack bodies,
+    which get_json() and request.json return like JSON ones.
+    """
+    @property
+    def is_msgpack(self) -> bool:
+        return self.mimetype in MSGPACK_MIMETYPES
+
+    def get_data(self, cache=True, as_text=False, parse_form_data=False):
+        if getattr(self, "_cached_data", None) is None and self.content_encoding:
+            data = decompress(super().get_data(cache=False, parse_form_data=parse_form_data), self.content_encoding)
+            if not cache:
+                return data.decode(errors="replace") if as_text else data
+            self._cached_data = data
+        return super().get_data(cache=cache, as_text=as_text, parse_form_data=parse_form_data)
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if not self.is_msgpack:
+            return super().get_json(force=force, silent=silent, cache=cache)
+        if cache and self._cached_json[silent] is not Ellipsis:
+            return self._cached_json[silent]
+
+        try:
+            data = msgpack.unpackb(self.get_data(cache=cache))
+        except ValueError as e:
+            if silent:
+                return None
+            return self.on_json_loading_failed(e)
+        if cache:
+            self._cached_json = (data, data)
+        return data
+
+
+def get_max_decompressed_bytes() -> int:
+    return int(os.getenv("MAX_DECOMPRESSED_BYTES", 32 * 1024 * 1024))
+
+
+def decompress(data, content_encoding):
+    """Undo a Content-Encoding, which lists codings in the order they were applied"""
+    max_bytes = get_max_decompressed_bytes()
+    for encoding in reversed([encoding.strip().lower() for encoding in content_encoding.split(",")]):
+        if encoding == "identity":
+            continue
+        if encoding in ("gzip", "x-gzip"):
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = decompressor.decompress(data, max_bytes + 1)
+        elif encoding == "br":
+            decompressor = brotli.Decompressor()
+            output = []
+            size = 0
+            # feed brotli a chunk at a time, so a small body cannot expand without bound
+            for start in range(0, len(data), DECOMPRESS_CHUNK_SIZE):
+                output.append(decompressor.process(data[start:start + DECOMPRESS_CHUNK_SIZE]))
+                size += len(output[-1])
+                if size > max_bytes:
+                    break
+            data = b"".join(output)
+        else:
+            raise UnsupportedMediaType(f"Unsupported Content-Encoding: {encoding}")
+        if len(data) > max_bytes:
+            raise RequestEntityTooLarge(f"Request body is over {max_bytes} bytes once decompressed")
+    return data
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def is_compression_enabled() -> bool:
+    return os.getenv("ENABLE_COMPRESSION", "true").lower() == "true"
+
+
+def negotiated_mimetype() -> str:
+    """MessagePack if the client prefers it to JSON, else JSON"""
+    if request.accept_mimetypes.best_match([JSON_MIMETYPE, MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE:
+        return MSGPACK_MIMETYPE
+    return JSON_MIMETYPE
+
+
+def representation_etag(etag) -> str:
+    """ETag of the representation negotiated for this request, as its body differs per format"""
+    return f"{etag}-msgpack" if negotiated_mimetype() == MSGPACK_MIMETYPE else etag
+
+
+def encode_response(response):
+    """
+    after_request hook re-encoding JSON responses as MessagePack and compressing them, as the client accepts.
+    Streamed responses, e.g. server-sent events, are left as they are.
+    """
+    if response.is_streamed or response.direct_passthrough or response.status_code in (204, 304):
+        return response
+
+    response.vary.add("Accept")
+    if response.mimetype == JSON_MIMETYPE and negotiated_mimetype() == MSGPACK_MIMETYPE:
+        response.set_data(msgpack.packb(orjson.loads(response.get_data())))
+        response.mimetype = MSGPACK_MIMETYPE
+
+    if not is_compression_enabled() or "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(["br", "gzip"])
+    data = response.get_data()
+    if encoding is None or len(data) < int(os.getenv("COMPRESS_MIN_BYTES", 1024)):
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    # the compressed body is another byte sequence, so a strong ETag becomes weak
+    etag, is_weak = response.get_etag()
+    if etag and not is_weak:
+        response.set_etag(etag, weak=True)
+    return response